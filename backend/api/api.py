@@ -3,9 +3,14 @@ from ninja.files import UploadedFile
 from typing import List, Optional
 from django.shortcuts import get_object_or_404
 from .models import Task
-from .detection_utils import process_image, process_video, process_rubbish_image, process_rubbish_video, process_firesmoke_image, process_firesmoke_video, process_cross_image, process_cross_video
-from .models_loader import is_models_loaded
+from .detection_utils import process_image, process_rubbish_image, process_firesmoke_image, process_cross_image, process_multi_image, process_multi_video_file, parse_detectors
+from .models_loader import is_models_loaded, get_models_status
+from .inference_scheduler import inference_scheduler
+from .inference_pool import inference_pool
+from .result_cache import result_cache
+from .jobs import job_manager, save_upload
 import mimetypes
+import os
 from camera.ptz_service import PTZController
 
 api = NinjaAPI()
@@ -84,6 +89,19 @@ class CrossVideoDetectionResponseSchema(Schema):
     detections: list = None
     error: str = None
 
+# 异步任务Schema
+class JobSubmitSchema(Schema):
+    job_id: str
+    status: str
+
+# 多检测器合并Schema
+class MultiDetectionResponseSchema(Schema):
+    has_detection: bool
+    total_frames: int = None
+    detectors: list = None
+    results: dict = None
+    error: str = None
+
 # API路由
 @api.get("/tasks", response=List[TaskSchema])
 def list_tasks(request):
@@ -116,27 +134,41 @@ def delete_task(request, task_id: int):
     task.delete()
     return {"success": True}
 
-@api.post("/detect-behavior", response={200: DetectionResponseSchema, 500: DetectionResponseSchema})
-def detect_behavior(request, file: UploadedFile = File(...)):
+def _run_video_upload(file, detectors, async_job=False):
+    """视频上传分块写入临时文件；async_job时提交后台任务并立即返回任务ID，否则同步处理"""
+    video_path = save_upload(file)
+    if async_job:
+        job = job_manager.submit(video_path, detectors, filename=file.name)
+        return 202, {"job_id": job.id, "status": job.status}
+    
+    try:
+        return 200, process_multi_video_file(video_path, detectors)
+    finally:
+        if os.path.exists(video_path):
+            os.unlink(video_path)
+
+@api.post("/detect-behavior", response={200: DetectionResponseSchema, 202: JobSubmitSchema, 500: DetectionResponseSchema})
+def detect_behavior(request, file: UploadedFile = File(...), async_job: bool = False, camera_id: str = None):
     """检测图像或视频中的人物行为"""
     # 检查模型是否已加载
     if not is_models_loaded():
         return 500, {"has_warning": False, "error": "模型未成功加载"}
     
     try:
-        # 读取文件内容
-        file_content = file.read()
-        
         # 检测文件类型
         mime_type, _ = mimetypes.guess_type(file.name)
         
         # 根据文件类型处理
         if mime_type and mime_type.startswith('image/'):
             # 处理图像
-            result = process_image(file_content)
+            result = process_image(file.read(), camera_id)
         elif mime_type and mime_type.startswith('video/'):
-            # 处理视频
-            result = process_video(file_content)
+            # 处理视频：分块写入磁盘，async_job时转为后台任务
+            status, result = _run_video_upload(file, ['behavior'], async_job)
+            if status == 202:
+                return 202, result
+            if "error" not in result:
+                result = result["results"]["behavior"]
         else:
             return 500, {"has_warning": False, "error": "不支持的文件类型"}
         
@@ -149,27 +181,28 @@ def detect_behavior(request, file: UploadedFile = File(...)):
     except Exception as e:
         return 500, {"has_warning": False, "error": str(e)}
 
-@api.post("/detect-rubbish", response={200: RubbishDetectionResponseSchema, 500: RubbishDetectionResponseSchema})
-def detect_rubbish(request, file: UploadedFile = File(...)):
+@api.post("/detect-rubbish", response={200: RubbishDetectionResponseSchema, 202: JobSubmitSchema, 500: RubbishDetectionResponseSchema})
+def detect_rubbish(request, file: UploadedFile = File(...), async_job: bool = False, camera_id: str = None):
     """检测图像或视频中的垃圾物品"""
     # 检查模型是否已加载
     if not is_models_loaded():
         return 500, {"has_rubbish": False, "error": "模型未成功加载"}
     
     try:
-        # 读取文件内容
-        file_content = file.read()
-        
         # 检测文件类型
         mime_type, _ = mimetypes.guess_type(file.name)
         
         # 根据文件类型处理
         if mime_type and mime_type.startswith('image/'):
             # 处理图像
-            result = process_rubbish_image(file_content)
+            result = process_rubbish_image(file.read(), camera_id)
         elif mime_type and mime_type.startswith('video/'):
-            # 处理视频
-            result = process_rubbish_video(file_content)
+            # 处理视频：分块写入磁盘，async_job时转为后台任务
+            status, result = _run_video_upload(file, ['rubbish'], async_job)
+            if status == 202:
+                return 202, result
+            if "error" not in result:
+                result = result["results"]["rubbish"]
         else:
             return 500, {"has_rubbish": False, "error": "不支持的文件类型"}
         
@@ -182,27 +215,28 @@ def detect_rubbish(request, file: UploadedFile = File(...)):
     except Exception as e:
         return 500, {"has_rubbish": False, "error": str(e)}
 
-@api.post("/detect-firesmoke", response={200: FiresmokeDetectionResponseSchema, 500: FiresmokeDetectionResponseSchema})
-def detect_firesmoke(request, file: UploadedFile = File(...)):
+@api.post("/detect-firesmoke", response={200: FiresmokeDetectionResponseSchema, 202: JobSubmitSchema, 500: FiresmokeDetectionResponseSchema})
+def detect_firesmoke(request, file: UploadedFile = File(...), async_job: bool = False, camera_id: str = None):
     """检测图像或视频中的烟火"""
     # 检查模型是否已加载
     if not is_models_loaded():
         return 500, {"has_firesmoke": False, "error": "模型未成功加载"}
     
     try:
-        # 读取文件内容
-        file_content = file.read()
-        
         # 检测文件类型
         mime_type, _ = mimetypes.guess_type(file.name)
         
         # 根据文件类型处理
         if mime_type and mime_type.startswith('image/'):
             # 处理图像
-            result = process_firesmoke_image(file_content)
+            result = process_firesmoke_image(file.read(), camera_id)
         elif mime_type and mime_type.startswith('video/'):
-            # 处理视频
-            result = process_firesmoke_video(file_content)
+            # 处理视频：分块写入磁盘，async_job时转为后台任务
+            status, result = _run_video_upload(file, ['firesmoke'], async_job)
+            if status == 202:
+                return 202, result
+            if "error" not in result:
+                result = result["results"]["firesmoke"]
         else:
             return 500, {"has_firesmoke": False, "error": "不支持的文件类型"}
         
@@ -215,27 +249,28 @@ def detect_firesmoke(request, file: UploadedFile = File(...)):
     except Exception as e:
         return 500, {"has_firesmoke": False, "error": str(e)}
 
-@api.post("/detect-cross", response={200: CrossDetectionResponseSchema, 500: CrossDetectionResponseSchema})
-def detect_cross(request, file: UploadedFile = File(...)):
+@api.post("/detect-cross", response={200: CrossDetectionResponseSchema, 202: JobSubmitSchema, 500: CrossDetectionResponseSchema})
+def detect_cross(request, file: UploadedFile = File(...), async_job: bool = False, camera_id: str = None):
     """检测图像或视频中的翻越行为"""
     # 检查模型是否已加载
     if not is_models_loaded():
         return 500, {"has_cross": False, "error": "模型未成功加载"}
     
     try:
-        # 读取文件内容
-        file_content = file.read()
-        
         # 检测文件类型
         mime_type, _ = mimetypes.guess_type(file.name)
         
         # 根据文件类型处理
         if mime_type and mime_type.startswith('image/'):
             # 处理图像
-            result = process_cross_image(file_content)
+            result = process_cross_image(file.read(), camera_id)
         elif mime_type and mime_type.startswith('video/'):
-            # 处理视频
-            result = process_cross_video(file_content)
+            # 处理视频：分块写入磁盘，async_job时转为后台任务
+            status, result = _run_video_upload(file, ['cross'], async_job)
+            if status == 202:
+                return 202, result
+            if "error" not in result:
+                result = result["results"]["cross"]
         else:
             return 500, {"has_cross": False, "error": "不支持的文件类型"}
         
@@ -248,6 +283,104 @@ def detect_cross(request, file: UploadedFile = File(...)):
     except Exception as e:
         return 500, {"has_cross": False, "error": str(e)}
 
+@api.post("/detect", response={200: MultiDetectionResponseSchema, 202: JobSubmitSchema, 400: MultiDetectionResponseSchema, 500: MultiDetectionResponseSchema})
+def detect(request, file: UploadedFile = File(...), detectors: str = None, async_job: bool = False, camera_id: str = None):
+    """一次上传、一次解码，运行所选检测器（detectors为逗号分隔，如 behavior,firesmoke；默认全部）"""
+    # 检查模型是否已加载
+    if not is_models_loaded():
+        return 500, {"has_detection": False, "error": "模型未成功加载"}
+    
+    # 检测器名称在处理（或提交后台任务）之前校验
+    try:
+        detectors = parse_detectors(detectors)
+    except ValueError as e:
+        return 400, {"has_detection": False, "error": str(e)}
+    
+    try:
+        # 检测文件类型
+        mime_type, _ = mimetypes.guess_type(file.name)
+        
+        # 根据文件类型处理
+        if mime_type and mime_type.startswith('image/'):
+            result = process_multi_image(file.read(), detectors, camera_id)
+        elif mime_type and mime_type.startswith('video/'):
+            # 视频只解码一遍，所有检测器共用采样帧；async_job时转为后台任务
+            status, result = _run_video_upload(file, detectors, async_job)
+            if status == 202:
+                return 202, result
+        else:
+            return 500, {"has_detection": False, "error": "不支持的文件类型"}
+        
+        # 检查处理结果
+        if "error" in result:
+            return 500, {"has_detection": False, "error": result["error"]}
+        
+        return 200, result
+    
+    except Exception as e:
+        return 500, {"has_detection": False, "error": str(e)}
+
+@api.post("/jobs", response={202: JobSubmitSchema, 400: MultiDetectionResponseSchema, 500: MultiDetectionResponseSchema})
+def create_job(request, file: UploadedFile = File(...), detectors: str = None, sample_interval: int = 30):
+    """提交视频检测任务：上传分块写入磁盘，立即返回任务ID"""
+    if not is_models_loaded():
+        return 500, {"has_detection": False, "error": "模型未成功加载"}
+    
+    # 检测器名称在入队前校验，无效时不创建任务
+    try:
+        detectors = parse_detectors(detectors)
+    except ValueError as e:
+        return 400, {"has_detection": False, "error": str(e)}
+    
+    mime_type, _ = mimetypes.guess_type(file.name)
+    if not (mime_type and mime_type.startswith('video/')):
+        return 500, {"has_detection": False, "error": "不支持的文件类型"}
+    
+    try:
+        video_path = save_upload(file)
+        job = job_manager.submit(video_path, detectors, sample_interval, filename=file.name)
+        return 202, {"job_id": job.id, "status": job.status}
+    except Exception as e:
+        return 500, {"has_detection": False, "error": str(e)}
+
+@api.get("/jobs/{job_id}")
+def get_job(request, job_id: str):
+    """查询视频检测任务的进度、部分结果与最终结果"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return {"success": False, "error": "任务不存在"}
+    return {"success": True, **job.to_dict()}
+
+@api.delete("/jobs/{job_id}")
+def cancel_job(request, job_id: str):
+    """取消视频检测任务"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return {"success": False, "error": "任务不存在"}
+    return {"success": True, "job_id": job.id, "status": job.status}
+
+@api.get("/ready")
+def ready(request):
+    """检查各模型的加载状态（unloaded / loading / ready / failed）"""
+    models = get_models_status()
+    if inference_pool.enabled:
+        # 推理由工作进程执行，以各工作进程预热后回报的加载结果为准（主进程不持有模型）
+        models = inference_pool.get_models_status(list(models))
+        is_ready = inference_pool.is_ready()
+    else:
+        is_ready = all(state['state'] == 'ready' for state in models.values())
+    return {"ready": is_ready, "models": models, "pool_enabled": inference_pool.enabled}
+
+@api.get("/inference/stats")
+def get_inference_stats(request):
+    """获取微批推理调度器与多进程推理池的队列深度、合批及利用率统计，以及结果缓存命中率"""
+    return {
+        "success": True,
+        "scheduler": inference_scheduler.get_stats(),
+        "pool": inference_pool.get_stats(),
+        "result_cache": result_cache.get_stats()
+    }
+
 
 class PTZTurnLeftRequestSchema(Schema):
     ip: str
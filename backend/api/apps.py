@@ -0,0 +1,33 @@
+from django.apps import AppConfig
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+
+class ApiConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'api'
+
+    def ready(self):
+        """Django启动时执行：模型按需加载，仅在runserver主进程中后台预热"""
+        # 避免在Django migrate/makemigrations等命令中加载模型
+        if 'runserver' not in sys.argv and 'manage.py' in sys.argv[0]:
+            logger.info("跳过模型预热（非runserver模式）")
+            return
+        if 'runserver' in sys.argv and os.environ.get('RUN_MAIN') != 'true':
+            logger.info("跳过模型预热（非Django主进程）")
+            return
+        if os.environ.get('MODELS_WARMUP', '1') == '0':
+            logger.info("已关闭模型预热，模型将在首次使用时加载")
+            return
+
+        from .inference_pool import inference_pool
+        if inference_pool.enabled:
+            # 推理由工作进程执行，主进程无需持有模型
+            inference_pool.start()
+            return
+
+        from .models_loader import start_background_warmup
+        start_background_warmup()
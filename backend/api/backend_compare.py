@@ -0,0 +1,159 @@
+# api/backend_compare.py
+"""
+推理后端对比工具：以PyTorch权重的结果为基准，比较ONNX Runtime / OpenVINO（含int8）的精度与延迟
+
+用法（在backend目录下）:
+    python -m api.backend_compare --model person --images media/alarm_events/images
+    python -m api.backend_compare --model firesmoke --images a.jpg b.jpg --variants torch onnx onnx-int8 openvino
+"""
+import os
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+from .models_loader import MODEL_PATHS, load_model_variant
+
+DEFAULT_VARIANTS = ('torch', 'onnx', 'onnx-int8')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def _parse_variant(variant):
+    """'onnx-int8' -> ('onnx', True)"""
+    backend, _, suffix = variant.partition('-')
+    return backend, suffix == 'int8'
+
+
+def _collect_images(paths):
+    """展开目录并读取图像"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        else:
+            files.append(path)
+
+    images = [cv2.imread(path) for path in files]
+    return [img for img in images if img is not None]
+
+
+def _boxes(result, conf_threshold):
+    """提取 N x 6 数组：x1, y1, x2, y2, conf, cls"""
+    rows = [
+        box.xyxy[0].tolist() + [box.conf[0].item(), box.cls[0].item()]
+        for box in result.boxes
+        if box.conf[0].item() > conf_threshold
+    ]
+    return np.array(rows, dtype=np.float32).reshape(-1, 6)
+
+
+def _iou(box, others):
+    x1 = np.maximum(box[0], others[:, 0])
+    y1 = np.maximum(box[1], others[:, 1])
+    x2 = np.minimum(box[2], others[:, 2])
+    y2 = np.minimum(box[3], others[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-6)
+
+
+def _match(reference, candidate, iou_threshold):
+    """按同类别、IoU贪心匹配，返回 (匹配数, 匹配框的置信度差绝对值列表)"""
+    matched = 0
+    conf_diffs = []
+    used = np.zeros(len(candidate), dtype=bool)
+    for ref in reference:
+        same_cls = (candidate[:, 5] == ref[5]) & ~used
+        if not same_cls.any():
+            continue
+        ious = np.where(same_cls, _iou(ref, candidate), 0)
+        best = int(np.argmax(ious))
+        if ious[best] >= iou_threshold:
+            used[best] = True
+            matched += 1
+            conf_diffs.append(abs(float(candidate[best, 4]) - float(ref[4])))
+    return matched, conf_diffs
+
+
+def compare_backends(model_name, images, variants=DEFAULT_VARIANTS, runs=3,
+                     conf_threshold=0.5, iou_threshold=0.5):
+    """对比各后端：延迟（单张平均/P95）及相对PyTorch结果的召回率、精确率、置信度偏差"""
+    variants = list(variants)
+    if 'torch' not in variants:
+        variants.insert(0, 'torch')
+
+    outputs = {}
+    report = {}
+    for variant in variants:
+        backend, int8 = _parse_variant(variant)
+        model, weights = load_model_variant(model_name, backend, int8)
+        model(images[0], verbose=False)  # 预热
+
+        latencies = []
+        for _ in range(runs):
+            for img in images:
+                started = time.perf_counter()
+                model(img, verbose=False)
+                latencies.append((time.perf_counter() - started) * 1000)
+        outputs[variant] = [_boxes(model(img, verbose=False)[0], conf_threshold) for img in images]
+
+        report[variant] = {
+            'weights': os.path.basename(weights),
+            'latency_ms_mean': float(np.mean(latencies)),
+            'latency_ms_p95': float(np.percentile(latencies, 95)),
+        }
+
+    reference = outputs['torch']
+    ref_total = sum(len(boxes) for boxes in reference)
+    for variant in variants:
+        matched = 0
+        conf_diffs = []
+        cand_total = 0
+        for ref_boxes, cand_boxes in zip(reference, outputs[variant]):
+            m, diffs = _match(ref_boxes, cand_boxes, iou_threshold)
+            matched += m
+            conf_diffs.extend(diffs)
+            cand_total += len(cand_boxes)
+        report[variant].update({
+            'detections': cand_total,
+            'recall_vs_torch': matched / ref_total if ref_total else 1.0,
+            'precision_vs_torch': matched / cand_total if cand_total else 1.0,
+            'conf_abs_diff_mean': float(np.mean(conf_diffs)) if conf_diffs else 0.0,
+            'speedup_vs_torch': report['torch']['latency_ms_mean'] / report[variant]['latency_ms_mean'],
+        })
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='推理后端精度/延迟对比')
+    parser.add_argument('--model', required=True, choices=list(MODEL_PATHS))
+    parser.add_argument('--images', nargs='+', required=True, help='图像文件或目录')
+    parser.add_argument('--variants', nargs='+', default=list(DEFAULT_VARIANTS),
+                        help='torch / onnx / onnx-int8 / openvino / openvino-int8')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    images = _collect_images(args.images)
+    if not images:
+        print('未找到可用图像')
+        return 1
+
+    report = compare_backends(args.model, images, args.variants, args.runs)
+    print(f"模型: {args.model}，图像数: {len(images)}")
+    print(f"{'后端':<16}{'平均(ms)':>10}{'P95(ms)':>10}{'加速比':>8}{'召回':>8}{'精确':>8}{'置信度偏差':>12}")
+    for variant, row in report.items():
+        print(f"{variant:<16}{row['latency_ms_mean']:>10.1f}{row['latency_ms_p95']:>10.1f}"
+              f"{row['speedup_vs_torch']:>8.2f}{row['recall_vs_torch']:>8.2%}"
+              f"{row['precision_vs_torch']:>8.2%}{row['conf_abs_diff_mean']:>12.4f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,7 +3,9 @@ import cv2
 import numpy as np
 import tempfile
 import os
-from .models_loader import get_person_model, get_behavior_model, get_rubbish_model, get_firesmoke_model, get_cross_model, is_models_loaded
+from .models_loader import is_models_loaded
+from .inference_scheduler import infer
+from .result_cache import result_cache, perceptual_hash
 
 # 扩展边界框函数
 def expand_bbox(bbox, expand_ratio=0.2, img_width=None, img_height=None):
@@ -24,136 +26,155 @@ def expand_bbox(bbox, expand_ratio=0.2, img_width=None, img_height=None):
     
     return [new_x1, new_y1, new_x2, new_y2]
 
-# 处理单帧图像
-def process_image(image_data):
-    """处理单张图像，检测人物和行为"""
-    if not is_models_loaded():
-        return {"error": "模型未成功加载"}
-    
-    # 获取模型
-    person_model = get_person_model()
-    behavior_model = get_behavior_model()
-    
-    # 转换为OpenCV格式
+# 行为检测批量推理参数
+BEHAVIOR_INPUT_SIZE = 640  # 人物裁剪统一填充到的尺寸
+BEHAVIOR_MAX_BATCH = 16  # 单次批量推理的最大裁剪数
+
+# 解码图像
+def decode_image(image_data):
+    """将图像字节解码为OpenCV格式"""
     nparr = np.frombuffer(image_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    img_height, img_width = img.shape[:2]
-    
-    # 人物检测
-    person_results = person_model(img, classes=[0])  # 0是COCO数据集中的人类类别
-    
-    warnings = []
-    for result in person_results:
-        boxes = result.boxes
-        for box in boxes:
-            # 获取边界框坐标
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            
-            # 扩展边界框
-            expanded_bbox = expand_bbox([x1, y1, x2, y2], 0.2, img_width, img_height)
+    return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+# 等比缩放并填充
+def letterbox(img, size=BEHAVIOR_INPUT_SIZE, color=(114, 114, 114)):
+    """等比缩放图像并填充为 size x size，返回 (填充后图像, 缩放比例, (左侧填充, 顶部填充))"""
+    h, w = img.shape[:2]
+    scale = min(size / w, size / h)
+    new_w, new_h = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    
+    pad_x = (size - new_w) // 2
+    pad_y = (size - new_h) // 2
+    canvas = np.full((size, size, 3), color, dtype=np.uint8)
+    canvas[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+    
+    return canvas, scale, (pad_x, pad_y)
+
+# 单帧检测上下文
+class FrameContext:
+    """同一帧上各检测器共享的中间结果：人物检测只运行一次，供行为、翻越等下游检测器复用"""
+    
+    def __init__(self, img, parent=None, origin=(0, 0)):
+        self.img = img
+        self.height, self.width = img.shape[:2]
+        self.parent = parent  # 裁剪区域的上下文复用整帧的人物检测结果
+        self.origin = origin  # 在父图像中的左上角坐标
+        self._person_boxes = None
+    
+    @property
+    def person_boxes(self):
+        """人物边界框列表 [[x1, y1, x2, y2], ...]，首次访问时推理"""
+        if self._person_boxes is None:
+            if self.parent is not None:
+                # 将整帧的人物框裁剪到本区域并换算为区域内坐标
+                ox, oy = self.origin
+                boxes = []
+                for x1, y1, x2, y2 in self.parent.person_boxes:
+                    x1, x2 = max(0, x1 - ox), min(self.width, x2 - ox)
+                    y1, y2 = max(0, y1 - oy), min(self.height, y2 - oy)
+                    if x2 > x1 and y2 > y1:
+                        boxes.append([x1, y1, x2, y2])
+                self._person_boxes = boxes
+            else:
+                person_results = infer('person', [self.img], classes=[0], verbose=False)  # 0是COCO数据集中的人类类别
+                self._person_boxes = [
+                    box.xyxy[0].tolist()
+                    for result in person_results
+                    for box in result.boxes
+                ]
+        return self._person_boxes
+    
+    def crop(self, x1, y1, x2, y2):
+        """返回图像子区域的上下文"""
+        return FrameContext(self.img[y1:y2, x1:x2], parent=self, origin=(x1, y1))
+    
+    @property
+    def has_person(self):
+        return len(self.person_boxes) > 0
+    
+    def person_regions(self, expand_ratio=0.2):
+        """扩展后的人物区域（整数坐标，已裁剪到图像范围内，过滤空区域）"""
+        regions = []
+        for bbox in self.person_boxes:
+            expanded_bbox = expand_bbox(bbox, expand_ratio, self.width, self.height)
             ex1, ey1, ex2, ey2 = [int(coord) for coord in expanded_bbox]
-            
-            # 裁剪人物区域
-            person_crop = img[ey1:ey2, ex1:ex2]
-            
-            # 行为检测
-            behavior_results = behavior_model(person_crop)
-            
-            # 分析行为结果
-            for b_result in behavior_results:
-                b_boxes = b_result.boxes
-                for b_box in b_boxes:
-                    cls_id = int(b_box.cls[0].item())
-                    conf = b_box.conf[0].item()
-                    
-                    # 类别0是phone(手机)，类别1是smoke(吸烟)
-                    if cls_id == 0 and conf > 0.5:
-                        warnings.append({"type": "phone", "confidence": conf})
-                    elif cls_id == 1 and conf > 0.5:
-                        warnings.append({"type": "smoke", "confidence": conf})
-    
-    return {
-        "has_warning": len(warnings) > 0,
-        "warnings": warnings
-    }
+            if ex2 > ex1 and ey2 > ey1:
+                regions.append((ex1, ey1, ex2, ey2))
+        return regions
 
-# 处理视频
-def process_video(video_data, sample_interval=30):
-    """处理视频文件，每隔sample_interval帧采样一次"""
-    if not is_models_loaded():
-        return {"error": "模型未成功加载"}
-    
-    # 创建临时文件保存视频数据
-    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-        temp_file.write(video_data)
-        temp_file_path = temp_file.name
+# 在已解码图像上检测人物和行为
+def detect_behavior(img, ctx=None):
+    """复用人物检测结果，对所有人物裁剪进行一次批量行为推理"""
+    ctx = ctx or FrameContext(img)
+    
+    # 收集所有扩展后的人物裁剪
+    crops = []  # [(填充后裁剪, 缩放比例, 填充偏移, 裁剪原点)]
+    for ex1, ey1, ex2, ey2 in ctx.person_regions(0.2):
+        # 裁剪人物区域并填充到统一尺寸
+        padded, scale, pad = letterbox(img[ey1:ey2, ex1:ex2])
+        crops.append((padded, scale, pad, (ex1, ey1)))
     
-    try:
-        # 打开视频文件
-        cap = cv2.VideoCapture(temp_file_path)
-        if not cap.isOpened():
-            return {"error": "无法打开视频文件"}
+    warnings = []
+    for start in range(0, len(crops), BEHAVIOR_MAX_BATCH):
+        batch = crops[start:start + BEHAVIOR_MAX_BATCH]
         
-        frame_count = 0
-        all_warnings = []
+        # 行为检测（整批一次前向推理，可与其他摄像头的裁剪合批）
+        behavior_results = infer(
+            'behavior', [item[0] for item in batch], imgsz=BEHAVIOR_INPUT_SIZE, verbose=False
+        )
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # 每隔sample_interval帧处理一次
-            if frame_count % sample_interval == 0:
-                # 将帧转换为字节
-                _, buffer = cv2.imencode('.jpg', frame)
-                frame_bytes = buffer.tobytes()
+        # 分析行为结果，并将边界框映射回原图坐标
+        for (_, scale, (pad_x, pad_y), (ox, oy)), b_result in zip(batch, behavior_results):
+            for b_box in b_result.boxes:
+                cls_id = int(b_box.cls[0].item())
+                conf = b_box.conf[0].item()
+                if conf <= 0.5 or cls_id not in (0, 1):
+                    continue
                 
-                # 处理帧
-                result = process_image(frame_bytes)
-                if "error" not in result and result["has_warning"]:
-                    # 记录帧号和警告
-                    frame_warnings = {
-                        "frame": frame_count,
-                        "time": frame_count / cap.get(cv2.CAP_PROP_FPS),
-                        "warnings": result["warnings"]
-                    }
-                    all_warnings.append(frame_warnings)
-            
-            frame_count += 1
-        
-        cap.release()
-        
-        # 清理临时文件
-        os.unlink(temp_file_path)
-        
-        return {
-            "has_warning": len(all_warnings) > 0,
-            "total_frames": frame_count,
-            "warning_frames": len(all_warnings),
-            "warnings": all_warnings
-        }
+                bx1, by1, bx2, by2 = b_box.xyxy[0].tolist()
+                bbox = [
+                    int((bx1 - pad_x) / scale + ox),
+                    int((by1 - pad_y) / scale + oy),
+                    int((bx2 - pad_x) / scale + ox),
+                    int((by2 - pad_y) / scale + oy),
+                ]
+                
+                # 类别0是phone(手机)，类别1是smoke(吸烟)
+                warning_type = "phone" if cls_id == 0 else "smoke"
+                warnings.append({"type": warning_type, "confidence": conf, "bbox": bbox})
     
-    except Exception as e:
-        # 确保清理临时文件
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
-        return {"error": str(e)}
+    return {
+        "has_warning": len(warnings) > 0,
+        "warnings": warnings
+    }
 
-# 处理垃圾检测图像
-def process_rubbish_image(image_data):
-    """处理单张图像，检测垃圾物品"""
+# 处理单帧图像
+def process_image(image_data, camera_id=None):
+    """处理单张图像，检测人物和行为"""
     if not is_models_loaded():
         return {"error": "模型未成功加载"}
     
-    # 获取垃圾检测模型
-    rubbish_model = get_rubbish_model()
-    
     # 转换为OpenCV格式
-    nparr = np.frombuffer(image_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    img = decode_image(image_data)
+    if img is None:
+        return {"error": "无法解码图像"}
     
+    return detect_single("behavior", img, camera_id)
+
+# 处理视频
+def process_video(video_data, sample_interval=30):
+    """处理视频文件，每隔sample_interval帧采样一次"""
+    result = process_multi_video(video_data, ["behavior"], sample_interval)
+    if "error" in result:
+        return result
+    return result["results"]["behavior"]
+
+# 在已解码图像上检测垃圾
+def detect_rubbish(img):
+    """检测垃圾物品"""
     # 垃圾检测
-    rubbish_results = rubbish_model(img)
+    rubbish_results = infer('rubbish', [img])
     
     detections = []
     for result in rubbish_results:
@@ -177,83 +198,32 @@ def process_rubbish_image(image_data):
         "count": len(detections)
     }
 
-# 处理垃圾检测视频
-def process_rubbish_video(video_data, sample_interval=30):
-    """处理视频文件，检测垃圾物品"""
-    if not is_models_loaded():
-        return {"error": "模型未成功加载"}
-    
-    # 创建临时文件保存视频数据
-    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-        temp_file.write(video_data)
-        temp_file_path = temp_file.name
-    
-    try:
-        # 打开视频文件
-        cap = cv2.VideoCapture(temp_file_path)
-        if not cap.isOpened():
-            return {"error": "无法打开视频文件"}
-        
-        frame_count = 0
-        all_detections = []
-        
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # 每隔sample_interval帧处理一次
-            if frame_count % sample_interval == 0:
-                # 将帧转换为字节
-                _, buffer = cv2.imencode('.jpg', frame)
-                frame_bytes = buffer.tobytes()
-                
-                # 处理帧
-                result = process_rubbish_image(frame_bytes)
-                if "error" not in result and result["has_rubbish"]:
-                    # 记录帧号和检测结果
-                    frame_detections = {
-                        "frame": frame_count,
-                        "time": frame_count / cap.get(cv2.CAP_PROP_FPS),
-                        "detections": result["detections"]
-                    }
-                    all_detections.append(frame_detections)
-            
-            frame_count += 1
-        
-        cap.release()
-        
-        # 清理临时文件
-        os.unlink(temp_file_path)
-        
-        return {
-            "has_rubbish": len(all_detections) > 0,
-            "total_frames": frame_count,
-            "detection_frames": len(all_detections),
-            "detections": all_detections
-        }
-    
-    except Exception as e:
-        # 确保清理临时文件
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
-        return {"error": str(e)}
-
-# 处理烟火检测图像
-def process_firesmoke_image(image_data):
-    """处理单张图像，检测烟火"""
+# 处理垃圾检测图像
+def process_rubbish_image(image_data, camera_id=None):
+    """处理单张图像，检测垃圾物品"""
     if not is_models_loaded():
         return {"error": "模型未成功加载"}
     
-    # 获取烟火检测模型
-    firesmoke_model = get_firesmoke_model()
-    
     # 转换为OpenCV格式
-    nparr = np.frombuffer(image_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    img = decode_image(image_data)
+    if img is None:
+        return {"error": "无法解码图像"}
     
+    return detect_single("rubbish", img, camera_id)
+
+# 处理垃圾检测视频
+def process_rubbish_video(video_data, sample_interval=30):
+    """处理视频文件，检测垃圾物品"""
+    result = process_multi_video(video_data, ["rubbish"], sample_interval)
+    if "error" in result:
+        return result
+    return result["results"]["rubbish"]
+
+# 在已解码图像上检测烟火
+def detect_firesmoke(img):
+    """检测烟火"""
     # 烟火检测
-    firesmoke_results = firesmoke_model(img)
+    firesmoke_results = infer('firesmoke', [img])
     
     detections = []
     for result in firesmoke_results:
@@ -280,164 +250,376 @@ def process_firesmoke_image(image_data):
         "count": len(detections)
     }
 
-# 处理烟火检测视频
-def process_firesmoke_video(video_data, sample_interval=30):
-    """处理视频文件，检测烟火"""
+# 处理烟火检测图像
+def process_firesmoke_image(image_data, camera_id=None):
+    """处理单张图像，检测烟火"""
     if not is_models_loaded():
         return {"error": "模型未成功加载"}
     
-    # 创建临时文件保存视频数据
-    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-        temp_file.write(video_data)
-        temp_file_path = temp_file.name
+    # 转换为OpenCV格式
+    img = decode_image(image_data)
+    if img is None:
+        return {"error": "无法解码图像"}
     
-    try:
-        # 打开视频文件
-        cap = cv2.VideoCapture(temp_file_path)
-        if not cap.isOpened():
-            return {"error": "无法打开视频文件"}
-        
-        frame_count = 0
-        all_detections = []
+    return detect_single("firesmoke", img, camera_id)
+
+# 处理烟火检测视频
+def process_firesmoke_video(video_data, sample_interval=30):
+    """处理视频文件，检测烟火"""
+    result = process_multi_video(video_data, ["firesmoke"], sample_interval)
+    if "error" in result:
+        return result
+    return result["results"]["firesmoke"]
+
+# 翻越检测时人物区域的扩展比例（保留护栏等周边环境）
+CROSS_REGION_EXPAND = 0.5
+
+# 在已解码图像上检测翻越
+def detect_cross(img, ctx=None):
+    """只在人物所在区域内检测翻越行为，画面中无人时不推理"""
+    ctx = ctx or FrameContext(img)
+    regions = ctx.person_regions(CROSS_REGION_EXPAND)
+    
+    detections = []
+    if regions:
+        # 取所有人物区域的外接矩形作为检测范围
+        rx1 = min(r[0] for r in regions)
+        ry1 = min(r[1] for r in regions)
+        rx2 = max(r[2] for r in regions)
+        ry2 = max(r[3] for r in regions)
+        cross_results = infer('cross', [img[ry1:ry2, rx1:rx2]])
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # 每隔sample_interval帧处理一次
-            if frame_count % sample_interval == 0:
-                # 将帧转换为字节
-                _, buffer = cv2.imencode('.jpg', frame)
-                frame_bytes = buffer.tobytes()
+        for result in cross_results:
+            boxes = result.boxes
+            for box in boxes:
+                # 获取边界框坐标并映射回原图
+                x1, y1, x2, y2 = box.xyxy[0].tolist()
+                conf = box.conf[0].item()
                 
-                # 处理帧
-                result = process_firesmoke_image(frame_bytes)
-                if "error" not in result and result["has_firesmoke"]:
-                    # 记录帧号和检测结果
-                    frame_detections = {
-                        "frame": frame_count,
-                        "time": frame_count / cap.get(cv2.CAP_PROP_FPS),
-                        "detections": result["detections"]
-                    }
-                    all_detections.append(frame_detections)
-            
-            frame_count += 1
-        
-        cap.release()
-        
-        # 清理临时文件
-        os.unlink(temp_file_path)
-        
-        return {
-            "has_firesmoke": len(all_detections) > 0,
-            "total_frames": frame_count,
-            "detection_frames": len(all_detections),
-            "detections": all_detections
-        }
+                # 只有当置信度大于0.5时才记录
+                if conf > 0.5:
+                    detections.append({
+                        "type": "crossover",
+                        "confidence": conf,
+                        "bbox": [int(x1) + rx1, int(y1) + ry1, int(x2) + rx1, int(y2) + ry1]
+                    })
     
-    except Exception as e:
-        # 确保清理临时文件
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
-        return {"error": str(e)}
+    return {
+        "has_cross": len(detections) > 0,
+        "detections": detections,
+        "count": len(detections)
+    }
 
 # 处理翻越检测图像
-def process_cross_image(image_data):
+def process_cross_image(image_data, camera_id=None):
     """处理单张图像，检测翻越行为"""
     if not is_models_loaded():
         return {"error": "模型未成功加载"}
     
-    # 获取翻越检测模型
-    cross_model = get_cross_model()
-    
     # 转换为OpenCV格式
-    nparr = np.frombuffer(image_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    # 直接进行翻越检测
-    cross_results = cross_model(img)
+    img = decode_image(image_data)
+    if img is None:
+        return {"error": "无法解码图像"}
     
-    detections = []
-    for result in cross_results:
-        boxes = result.boxes
-        for box in boxes:
-            # 获取边界框坐标
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            conf = box.conf[0].item()
-            
-            # 只有当置信度大于0.5时才记录
-            if conf > 0.5:
-                detections.append({
-                    "type": "crossover",
-                    "confidence": conf,
-                    "bbox": [int(x1), int(y1), int(x2), int(y2)]
-                })
-    
-    return {
-        "has_cross": len(detections) > 0,
-        "detections": detections,
-        "count": len(detections)
-    }
+    return detect_single("cross", img, camera_id)
 
 # 处理翻越检测视频
 def process_cross_video(video_data, sample_interval=30):
     """处理视频文件，检测翻越行为"""
+    result = process_multi_video(video_data, ["cross"], sample_interval)
+    if "error" in result:
+        return result
+    return result["results"]["cross"]
+
+# 检测器注册表：名称 -> 图像检测函数及其结果字段（命中标记、明细列表、视频命中帧数）
+# requires 为 "person" 的检测器依赖共享的人物检测结果，画面中无人时整体跳过
+DETECTORS = {
+    "behavior": {"detect": detect_behavior, "flag": "has_warning", "items": "warnings", "frames": "warning_frames",
+                 "requires": "person"},
+    "firesmoke": {"detect": detect_firesmoke, "flag": "has_firesmoke", "items": "detections", "frames": "detection_frames",
+                  "requires": None},
+    "rubbish": {"detect": detect_rubbish, "flag": "has_rubbish", "items": "detections", "frames": "detection_frames",
+                "requires": None},
+    "cross": {"detect": detect_cross, "flag": "has_cross", "items": "detections", "frames": "detection_frames",
+              "requires": "person"},
+}
+
+def _skipped_result(name, reason):
+    """被跳过的检测器返回的空结果（字段与正常结果一致）"""
+    spec = DETECTORS[name]
+    result = {spec["flag"]: False, spec["items"]: [], "skipped": reason}
+    if spec["items"] == "detections":
+        result["count"] = 0
+    return result
+
+def parse_detectors(detectors=None):
+    """解析检测器列表（逗号分隔字符串或列表），为空时返回全部检测器"""
+    if not detectors:
+        return list(DETECTORS)
+    if isinstance(detectors, str):
+        detectors = [name.strip() for name in detectors.split(',') if name.strip()]
+    
+    unknown = [name for name in detectors if name not in DETECTORS]
+    if unknown:
+        raise ValueError(f"未知的检测器: {', '.join(unknown)}")
+    
+    # 去重并保持顺序
+    return list(dict.fromkeys(detectors))
+
+def validate_rois(roi_config):
+    """校验检测区域配置：检测器名称有效，每个多边形至少3个点且坐标在0~1之间；返回规范化后的配置"""
+    if not roi_config:
+        return {}
+    if not isinstance(roi_config, dict):
+        raise ValueError("检测区域配置必须是 检测器 -> 多边形列表 的字典")
+    
+    normalized = {}
+    for name, polygons in roi_config.items():
+        if name not in DETECTORS:
+            raise ValueError(f"未知的检测器: {name}")
+        if not polygons:
+            continue
+        cleaned = []
+        for polygon in polygons:
+            if len(polygon) < 3:
+                raise ValueError(f"检测器 {name} 的多边形至少需要3个点")
+            points = []
+            for point in polygon:
+                x, y = float(point[0]), float(point[1])
+                if not (0 <= x <= 1 and 0 <= y <= 1):
+                    raise ValueError(f"检测器 {name} 的坐标必须是0~1之间的归一化值")
+                points.append([x, y])
+            cleaned.append(points)
+        normalized[name] = cleaned
+    return normalized
+
+def _roi_polygons(polygons, width, height):
+    """归一化多边形 -> 像素坐标的 int32 轮廓列表"""
+    return [
+        np.array([[round(x * width), round(y * height)] for x, y in polygon], dtype=np.int32)
+        for polygon in polygons
+    ]
+
+def _detect(name, img, ctx):
+    spec = DETECTORS[name]
+    if spec["requires"] == "person" and not ctx.has_person:
+        return _skipped_result(name, "no_person")
+    return spec["detect"](img, ctx) if spec["requires"] else spec["detect"](img)
+
+# 在检测区域内运行检测器
+def _detect_in_roi(name, img, ctx, polygons):
+    """裁剪到所有ROI多边形的外接矩形后推理，结果映射回原图并去掉中心点不在多边形内的目标"""
+    contours = _roi_polygons(polygons, ctx.width, ctx.height)
+    x, y, w, h = cv2.boundingRect(np.concatenate(contours))
+    x1, y1 = max(0, x), max(0, y)
+    x2, y2 = min(ctx.width, x + w), min(ctx.height, y + h)
+    if x2 <= x1 or y2 <= y1:
+        return _skipped_result(name, "empty_roi")
+    
+    sub_ctx = ctx.crop(x1, y1, x2, y2)
+    result = _detect(name, sub_ctx.img, sub_ctx)
+    if "skipped" in result:
+        return result
+    
+    spec = DETECTORS[name]
+    kept = []
+    for item in result[spec["items"]]:
+        bx1, by1, bx2, by2 = item["bbox"]
+        bbox = [bx1 + x1, by1 + y1, bx2 + x1, by2 + y1]
+        center = ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
+        if any(cv2.pointPolygonTest(contour, center, False) >= 0 for contour in contours):
+            kept.append(dict(item, bbox=bbox))
+    
+    result[spec["items"]] = kept
+    result[spec["flag"]] = len(kept) > 0
+    if "count" in result:
+        result["count"] = len(kept)
+    return result
+
+# 运行单个检测器（带结果缓存）
+def _run_detector(name, img, ctx, camera_id=None, phash=None, polygons=None):
+    """指定摄像头时先按感知哈希查缓存，命中则直接返回上次的结果；配置了检测区域时只在区域内推理"""
+    if phash is not None:
+        cached = result_cache.get(camera_id, name, phash)
+        if cached is not None:
+            return cached
+    
+    if polygons:
+        result = _detect_in_roi(name, img, ctx, polygons)
+    else:
+        result = _detect(name, img, ctx)
+    
+    if phash is not None:
+        result_cache.put(camera_id, name, phash, result)
+    return result
+
+def _frame_hash(img, camera_id):
+    """只有来自摄像头的帧才参与结果缓存"""
+    if camera_id is None or not result_cache.enabled:
+        return None
+    return perceptual_hash(img)
+
+# 在已解码图像上运行单个检测器
+def detect_single(name, img, camera_id=None):
+    """运行单个检测器，camera_id 不为空时使用结果缓存"""
+    return _run_detector(name, img, FrameContext(img), camera_id, _frame_hash(img, camera_id))
+
+# 在已解码图像上运行多个检测器
+def run_detections(img, detectors=None, camera_id=None, rois=None):
+    """对同一帧运行所选检测器，返回合并后的结果
+    
+    人物检测作为共享阶段每帧最多运行一次；画面中无人时跳过所有依赖人物的检测器；
+    camera_id 不为空时按 (摄像头, 检测器, 感知哈希) 复用近似帧的检测结果；
+    rois 为 检测器 -> 归一化多边形列表，配置了区域的检测器只在区域内推理和报警
+    """
+    names = parse_detectors(detectors)
+    ctx = FrameContext(img)
+    phash = _frame_hash(img, camera_id)
+    rois = rois or {}
+    
+    results = {}
+    for name in names:
+        try:
+            results[name] = _run_detector(name, img, ctx, camera_id, phash, rois.get(name))
+        except Exception as e:
+            results[name] = {"error": str(e)}
+    
+    return {
+        "has_detection": any(results[name].get(DETECTORS[name]["flag"], False) for name in names),
+        "detectors": names,
+        "results": results
+    }
+
+# 处理单张图像（多检测器）
+def process_multi_image(image_data, detectors=None, camera_id=None):
+    """解码一次图像并运行所选检测器"""
     if not is_models_loaded():
         return {"error": "模型未成功加载"}
     
-    # 创建临时文件保存视频数据
-    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
-        temp_file.write(video_data)
-        temp_file_path = temp_file.name
+    try:
+        names = parse_detectors(detectors)
+    except ValueError as e:
+        return {"error": str(e)}
+    
+    # 转换为OpenCV格式
+    img = decode_image(image_data)
+    if img is None:
+        return {"error": "无法解码图像"}
+    
+    return run_detections(img, names, camera_id)
+
+# 视频采样
+class VideoFrameSampler:
+    """单次遍历视频：非采样帧只grab()不取出，采样帧才retrieve()，迭代生成 (帧号, 帧图像)"""
+    
+    def __init__(self, cap, sample_interval=30):
+        self.cap = cap
+        self.sample_interval = max(1, int(sample_interval))
+        self.frames_read = 0  # 已遍历的帧数
+    
+    def __iter__(self):
+        while self.cap.grab():
+            frame_index = self.frames_read
+            self.frames_read += 1
+            if frame_index % self.sample_interval == 0:
+                ret, frame = self.cap.retrieve()
+                if ret and frame is not None:
+                    yield frame_index, frame
+
+# 处理视频文件（多检测器）
+def process_multi_video_file(video_path, detectors=None, sample_interval=30,
+                             progress_callback=None, cancel_event=None):
+    """处理磁盘上的视频：只解码一遍，每个采样帧上运行所选检测器
+    
+    progress_callback(frames_done, total_frames, frame_hits) 在每个采样帧后调用；
+    cancel_event 被设置时提前结束，返回已完成部分的结果并标记 cancelled
+    """
+    if not is_models_loaded():
+        return {"error": "模型未成功加载"}
     
+    try:
+        names = parse_detectors(detectors)
+    except ValueError as e:
+        return {"error": str(e)}
+    
+    cap = None
     try:
         # 打开视频文件
-        cap = cv2.VideoCapture(temp_file_path)
+        cap = cv2.VideoCapture(video_path)
         if not cap.isOpened():
             return {"error": "无法打开视频文件"}
         
-        frame_count = 0
-        all_detections = []
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+        frame_hits = {name: [] for name in names}
+        cancelled = False
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
+        sampler = VideoFrameSampler(cap, sample_interval)
+        for frame_index, frame in sampler:
+            if cancel_event is not None and cancel_event.is_set():
+                cancelled = True
                 break
             
-            # 每隔sample_interval帧处理一次
-            if frame_count % sample_interval == 0:
-                # 将帧转换为字节
-                _, buffer = cv2.imencode('.jpg', frame)
-                frame_bytes = buffer.tobytes()
-                
-                # 处理帧
-                result = process_cross_image(frame_bytes)
-                if "error" not in result and result["has_cross"]:
+            frame_result = run_detections(frame, names)["results"]
+            for name in names:
+                spec = DETECTORS[name]
+                result = frame_result[name]
+                if "error" in result:
+                    # 检测器异常（模型缺失、加载或推理失败）不能当作"无检测"返回
+                    return {"error": f"检测器 {name} 在第 {frame_index} 帧运行失败: {result['error']}"}
+                if result[spec["flag"]]:
                     # 记录帧号和检测结果
-                    frame_detections = {
-                        "frame": frame_count,
-                        "time": frame_count / cap.get(cv2.CAP_PROP_FPS),
-                        "detections": result["detections"]
-                    }
-                    all_detections.append(frame_detections)
+                    frame_hits[name].append({
+                        "frame": frame_index,
+                        "time": frame_index / fps if fps else 0,
+                        spec["items"]: result[spec["items"]]
+                    })
             
-            frame_count += 1
-        
-        cap.release()
+            if progress_callback is not None:
+                progress_callback(sampler.frames_read, total_frames, frame_hits)
+        frame_count = sampler.frames_read
         
-        # 清理临时文件
-        os.unlink(temp_file_path)
+        results = {}
+        for name in names:
+            spec = DETECTORS[name]
+            results[name] = {
+                spec["flag"]: len(frame_hits[name]) > 0,
+                "total_frames": frame_count,
+                spec["frames"]: len(frame_hits[name]),
+                spec["items"]: frame_hits[name]
+            }
         
-        return {
-            "has_cross": len(all_detections) > 0,
+        response = {
+            "has_detection": any(len(frame_hits[name]) > 0 for name in names),
             "total_frames": frame_count,
-            "detection_frames": len(all_detections),
-            "detections": all_detections
+            "detectors": names,
+            "results": results
         }
+        if cancelled:
+            response["cancelled"] = True
+        return response
     
     except Exception as e:
-        # 确保清理临时文件
+        return {"error": str(e)}
+    
+    finally:
+        if cap is not None:
+            cap.release()
+
+# 处理视频（多检测器）
+def process_multi_video(video_data, detectors=None, sample_interval=30):
+    """处理视频数据：写入临时文件后只解码一遍，每个采样帧上运行所选检测器"""
+    if not is_models_loaded():
+        return {"error": "模型未成功加载"}
+    
+    # 创建临时文件保存视频数据
+    with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as temp_file:
+        temp_file.write(video_data)
+        temp_file_path = temp_file.name
+    
+    try:
+        return process_multi_video_file(temp_file_path, detectors, sample_interval)
+    finally:
+        # 清理临时文件
         if os.path.exists(temp_file_path):
             os.unlink(temp_file_path)
-        return {"error": str(e)}
\ No newline at end of file
@@ -0,0 +1,321 @@
+# api/inference_pool.py
+"""
+多进程模型副本推理池
+- 每个工作进程持有自己的一份模型副本，绕开GIL，也避免多线程共享同一个YOLO实例
+- 调用方通过任务队列提交推理，立即得到Future；结果由收集线程分发
+- 工作进程只回传轻量的检测框数组，不回传原图
+"""
+import os
+import queue
+import threading
+import time
+import logging
+import itertools
+import multiprocessing
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+WORKER_CHECK_INTERVAL = 1.0  # 工作进程存活巡检间隔（秒）
+
+
+def _default_workers():
+    """INFERENCE_WORKERS: 0 关闭（进程内推理），auto 按CPU核数"""
+    value = os.environ.get('INFERENCE_WORKERS', '0').strip().lower()
+    if value == 'auto':
+        return max(1, (os.cpu_count() or 2) // 2)
+    return max(0, int(value or 0))
+
+
+class _LiteBoxes:
+    """与ultralytics Boxes读取方式兼容的轻量检测框：box.xyxy[0]、box.conf[0]、box.cls[0]"""
+
+    def __init__(self, data):
+        self.data = data  # N x 6: x1, y1, x2, y2, conf, cls
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        for row in self.data:
+            yield _LiteBoxes(row[None, :])
+
+    @property
+    def xyxy(self):
+        return self.data[:, :4]
+
+    @property
+    def conf(self):
+        return self.data[:, 4]
+
+    @property
+    def cls(self):
+        return self.data[:, 5]
+
+
+class LiteResult:
+    """可跨进程传递的推理结果，只保留检测框"""
+
+    def __init__(self, data):
+        self.boxes = _LiteBoxes(data)
+
+    @classmethod
+    def from_ultralytics(cls, result):
+        boxes = result.boxes
+        if boxes is None or len(boxes) == 0:
+            return cls(np.zeros((0, 6), dtype=np.float32))
+        return cls(boxes.data[:, :6].cpu().numpy().astype(np.float32))
+
+
+def _worker_main(worker_id, task_queue, result_queue, torch_threads):
+    """工作进程入口：加载模型副本后循环处理任务"""
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except Exception:
+        pass
+
+    started = time.monotonic()
+    try:
+        from .models_loader import get_model, get_models_status, warmup_models
+        # 工作进程专用于推理，启动时即加载并预热全部模型，完成后回报加载结果
+        ok = warmup_models()
+        models = get_models_status()
+        load_error = None
+    except Exception as e:
+        get_model = None
+        ok, models = False, {}
+        load_error = f"{type(e).__name__}: {e}"
+    loaded = {'ok': ok, 'models': models, 'error': load_error, 'pid': os.getpid()}
+    result_queue.put(('loaded', None, worker_id, loaded, time.monotonic() - started))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        task_id, model_name, images, kwargs = task
+        result_queue.put(('start', task_id, worker_id, None, 0.0))
+        started = time.monotonic()
+        try:
+            if get_model is None:
+                raise RuntimeError(f"模型加载失败: {load_error}")
+            model = get_model(model_name)
+            if model is None:
+                raise RuntimeError(f"模型 {model_name} 未成功加载")
+            payload = [LiteResult.from_ultralytics(r) for r in model(images, **kwargs)]
+            kind = 'done'
+        except Exception as e:
+            payload = f"{type(e).__name__}: {e}"
+            kind = 'error'
+        result_queue.put((kind, task_id, worker_id, payload, time.monotonic() - started))
+
+
+class InferencePool:
+    """多进程推理池"""
+
+    def __init__(self, num_workers=None):
+        self.num_workers = _default_workers() if num_workers is None else num_workers
+        self._ctx = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count(1)
+        self._futures = {}  # {task_id: Future}
+        self._queued = set()  # 已提交、尚未被工作进程开始处理的task_id
+        self._assigned = {}  # {task_id: worker_id}
+        self._workers = {}  # {worker_id: Process}
+        self._worker_stats = {}  # {worker_id: {'tasks': int, 'busy': float, 'started_at': float, 'state': str, ...}}
+        self._task_queue = None
+        self._result_queue = None
+        self._collector = None
+
+    @property
+    def enabled(self):
+        return self.num_workers > 0
+
+    def start(self):
+        """启动工作进程与结果收集线程（重复调用无副作用）"""
+        with self._lock:
+            if self._collector is not None:
+                return
+            self._task_queue = self._ctx.Queue()
+            self._result_queue = self._ctx.Queue()
+            for worker_id in range(self.num_workers):
+                self._spawn_worker(worker_id)
+            self._collector = threading.Thread(target=self._collect_loop, daemon=True)
+            self._collector.start()
+            logger.info(f"推理池已启动，工作进程数: {self.num_workers}")
+
+    def _spawn_worker(self, worker_id):
+        torch_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self._task_queue, self._result_queue, torch_threads),
+            daemon=True
+        )
+        process.start()
+        self._workers[worker_id] = process
+        # state: loading（预热中）/ ready / failed，由工作进程预热结束后的 'loaded' 消息更新
+        self._worker_stats[worker_id] = {'tasks': 0, 'busy': 0.0, 'started_at': time.monotonic(),
+                                         'state': 'loading', 'models': {}, 'error': None}
+
+    def submit(self, model_name, images, **kwargs):
+        """提交一批图像，返回Future（结果为与输入一一对应的LiteResult列表）"""
+        if self._collector is None:
+            self.start()
+
+        future = Future()
+        task_id = next(self._task_ids)
+        with self._lock:
+            self._futures[task_id] = future
+            self._queued.add(task_id)
+        self._task_queue.put((task_id, model_name, list(images), kwargs))
+        return future
+
+    def _collect_loop(self):
+        """接收工作进程回传的结果，并按固定间隔巡检工作进程存活状态（与结果流量无关）"""
+        next_check = time.monotonic() + WORKER_CHECK_INTERVAL
+        while True:
+            timeout = max(0.0, next_check - time.monotonic())
+            try:
+                kind, task_id, worker_id, payload, elapsed = self._result_queue.get(timeout=timeout)
+            except queue.Empty:
+                kind = None
+
+            if time.monotonic() >= next_check:
+                self._check_workers()
+                next_check = time.monotonic() + WORKER_CHECK_INTERVAL
+            if kind is None:
+                continue
+
+            with self._lock:
+                if kind == 'loaded':
+                    self._on_worker_loaded(worker_id, payload, elapsed)
+                    continue
+                if kind == 'start':
+                    self._queued.discard(task_id)
+                    if task_id in self._futures:
+                        self._assigned[task_id] = worker_id
+                    continue
+                future = self._futures.pop(task_id, None)
+                self._queued.discard(task_id)
+                self._assigned.pop(task_id, None)
+                stats = self._worker_stats.get(worker_id)
+                if stats is not None:
+                    stats['tasks'] += 1
+                    stats['busy'] += elapsed
+
+            if future is None:
+                continue
+            if kind == 'done':
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _on_worker_loaded(self, worker_id, payload, elapsed):
+        """记录工作进程的模型加载结果（调用方持有锁）"""
+        stats = self._worker_stats.get(worker_id)
+        if stats is None or self._workers[worker_id].pid != payload['pid']:
+            # 已被重启替换的旧进程的迟到消息
+            return
+        stats['state'] = 'ready' if payload['ok'] else 'failed'
+        stats['models'] = payload['models']
+        stats['error'] = payload['error']
+        if payload['ok']:
+            logger.info(f"推理工作进程 {worker_id} 模型加载完成 ({elapsed:.2f}s)")
+        else:
+            logger.error(f"推理工作进程 {worker_id} 模型加载失败: {payload['error'] or '部分模型未成功加载'}")
+
+    def get_models_status(self, names):
+        """汇总各工作进程回报的模型状态：某模型在所有工作进程上都就绪才算 ready，否则取最差的状态；
+        尚未回报（仍在预热）的工作进程上的模型视为 loading"""
+        rank = {'failed': 0, 'unloaded': 1, 'loading': 2, 'ready': 3}
+        with self._lock:
+            reports = [stats['models'] if stats['state'] != 'loading' else {}
+                       for stats in self._worker_stats.values()]
+        merged = {}
+        for name in names:
+            states = [models.get(name, {'state': 'loading'}) for models in reports] or [{'state': 'unloaded'}]
+            merged[name] = dict(min(states, key=lambda state: rank.get(state['state'], 0)))
+        return merged
+
+    def is_ready(self):
+        """推理池已启动，且所有工作进程都存活并已回报模型加载成功"""
+        with self._lock:
+            if self._collector is None or not self._workers:
+                return False
+            return all(
+                self._workers[worker_id].is_alive() and stats['state'] == 'ready'
+                for worker_id, stats in self._worker_stats.items()
+            )
+
+    def _check_workers(self):
+        """重启意外退出的工作进程，并让其正在处理的任务失败
+
+        工作进程可能在从队列取出任务、但还没回报 'start' 时退出，无法确定是哪一个任务丢失，
+        因此尚未开始的任务也一并失败（仍在队列中的任务之后即使被执行，结果也会被丢弃）
+        """
+        failed = []
+        with self._lock:
+            for worker_id, process in list(self._workers.items()):
+                if process.is_alive():
+                    continue
+                logger.error(f"推理工作进程 {worker_id} 意外退出 (exitcode={process.exitcode})，正在重启")
+                error = RuntimeError(f"推理工作进程 {worker_id} 意外退出")
+                lost = [task_id for task_id, assigned in self._assigned.items() if assigned == worker_id]
+                lost.extend(self._queued)
+                self._queued.clear()
+                for task_id in lost:
+                    self._assigned.pop(task_id, None)
+                    future = self._futures.pop(task_id, None)
+                    if future is not None:
+                        failed.append((future, error))
+                self._spawn_worker(worker_id)
+        # 在锁外设置结果，回调（如微批调度器的结果分发）不会与推理池互相阻塞
+        for future, error in failed:
+            future.set_exception(error)
+
+    def get_stats(self):
+        """获取队列深度与各工作进程利用率"""
+        with self._lock:
+            in_flight = len(self._futures)
+            queued = len(self._queued)
+            now = time.monotonic()
+            workers = {
+                worker_id: {
+                    'alive': self._workers[worker_id].is_alive(),
+                    'pid': self._workers[worker_id].pid,
+                    'busy': worker_id in self._assigned.values(),
+                    'state': stats['state'],
+                    'tasks': stats['tasks'],
+                    'utilization': stats['busy'] / max(now - stats['started_at'], 1e-6),
+                }
+                for worker_id, stats in self._worker_stats.items()
+            }
+        return {
+            'enabled': self.enabled,
+            'started': self._collector is not None,
+            'num_workers': self.num_workers,
+            'queue_depth': queued,
+            'in_flight': in_flight,
+            'workers': workers,
+        }
+
+    def shutdown(self):
+        """停止所有工作进程"""
+        with self._lock:
+            if self._task_queue is None:
+                return
+            for _ in self._workers:
+                self._task_queue.put(None)
+            for process in self._workers.values():
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+            self._workers.clear()
+            self._worker_stats.clear()
+
+
+# 全局实例
+inference_pool = InferencePool()
@@ -0,0 +1,170 @@
+# api/inference_scheduler.py
+"""
+跨摄像头动态微批推理调度器
+- 各调用方（摄像头线程、HTTP请求）提交单张图像，立即得到Future
+- 每个模型一个调度线程：收到首个请求后在短时间窗口内继续收集，窗口到期或达到批量上限即执行一次批量推理
+- 推理结果通过Future逐一分发回调用方
+- 启用多进程推理池（INFERENCE_WORKERS）时，合好的批次交给推理池执行，调度线程不阻塞
+"""
+import os
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+from .models_loader import get_model
+from .inference_pool import inference_pool
+
+logger = logging.getLogger(__name__)
+
+# 调度参数：窗口为0时关闭微批，直接调用模型
+BATCH_WINDOW_MS = float(os.environ.get('INFERENCE_BATCH_WINDOW_MS', 30))
+MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH', 16))
+INFERENCE_TIMEOUT = float(os.environ.get('INFERENCE_TIMEOUT', 60))  # 调用方等待推理结果的最长秒数
+
+
+class InferenceScheduler:
+    """动态微批推理调度器"""
+
+    def __init__(self, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH_SIZE):
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self._lock = threading.Lock()
+        self._queues = {}  # {model_name: Queue}
+        self._workers = {}  # {model_name: Thread}
+        self._stats = {}  # {model_name: {'batches': int, 'images': int, 'max_batch': int}}
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def submit(self, model_name, img, **kwargs):
+        """提交单张图像，返回Future（结果为该图像的推理结果）"""
+        future = Future()
+        self._get_queue(model_name).put((img, kwargs, future))
+        return future
+
+    def predict(self, model_name, images, **kwargs):
+        """提交一组图像并等待结果，返回与输入一一对应的结果列表；超时抛出 TimeoutError"""
+        futures = [self.submit(model_name, img, **kwargs) for img in images]
+        deadline = time.monotonic() + INFERENCE_TIMEOUT
+        return [future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures]
+
+    def _get_queue(self, model_name):
+        """获取模型对应的请求队列，首次使用时启动调度线程"""
+        with self._lock:
+            if model_name not in self._queues:
+                q = queue.Queue()
+                self._queues[model_name] = q
+                self._stats[model_name] = {'batches': 0, 'images': 0, 'max_batch': 0}
+                worker = threading.Thread(
+                    target=self._dispatch_loop,
+                    args=(model_name, q),
+                    daemon=True
+                )
+                self._workers[model_name] = worker
+                worker.start()
+                logger.info(f"启动模型 {model_name} 的微批调度线程")
+            return self._queues[model_name]
+
+    def _dispatch_loop(self, model_name, q):
+        """收集窗口内的请求并执行批量推理"""
+        while True:
+            batch = [q.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._run_batch(model_name, batch)
+
+    def _run_batch(self, model_name, batch):
+        """按推理参数分组后执行批量推理，并分发结果"""
+        # 推理参数不同的请求不能合并到同一次前向推理
+        groups = {}
+        for item in batch:
+            key = repr(sorted(item[1].items()))
+            groups.setdefault(key, []).append(item)
+
+        for items in groups.values():
+            kwargs = items[0][1]
+            futures = [item[2] for item in items]
+            if inference_pool.enabled:
+                # 交给推理池异步执行，完成后分发结果
+                pool_future = inference_pool.submit(model_name, [item[0] for item in items], **kwargs)
+                pool_future.add_done_callback(
+                    lambda done, futures=futures: self._fan_out(model_name, done, futures)
+                )
+                continue
+
+            model = get_model(model_name)
+            try:
+                if model is None:
+                    raise RuntimeError(f"模型 {model_name} 未成功加载")
+                results = model([item[0] for item in items], **kwargs)
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"模型 {model_name} 批量推理失败: {str(e)}")
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+
+        stats = self._stats[model_name]
+        stats['batches'] += 1
+        stats['images'] += len(batch)
+        stats['max_batch'] = max(stats['max_batch'], len(batch))
+
+    def _fan_out(self, model_name, pool_future, futures):
+        """将推理池返回的批量结果分发给各调用方"""
+        try:
+            results = pool_future.result()
+        except Exception as e:
+            logger.error(f"模型 {model_name} 批量推理失败: {str(e)}")
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    def get_stats(self):
+        """获取各模型的队列深度与合批统计"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'window_ms': self.window * 1000,
+                'max_batch': self.max_batch,
+                'models': {
+                    name: {
+                        'queue_depth': self._queues[name].qsize(),
+                        'batches': stats['batches'],
+                        'images': stats['images'],
+                        'avg_batch': stats['images'] / stats['batches'] if stats['batches'] else 0,
+                        'max_batch': stats['max_batch'],
+                    }
+                    for name, stats in self._stats.items()
+                }
+            }
+
+
+# 全局实例
+inference_scheduler = InferenceScheduler()
+
+
+def infer(model_name, images, **kwargs):
+    """对一组图像推理，返回与输入一一对应的结果列表；启用微批时与其他调用方合批执行"""
+    if inference_scheduler.enabled:
+        return inference_scheduler.predict(model_name, images, **kwargs)
+    if inference_pool.enabled:
+        return inference_pool.submit(model_name, images, **kwargs).result(timeout=INFERENCE_TIMEOUT)
+
+    model = get_model(model_name)
+    if model is None:
+        raise RuntimeError(f"模型 {model_name} 未成功加载")
+    return list(model(images, **kwargs))
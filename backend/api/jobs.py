@@ -0,0 +1,158 @@
+# api/jobs.py
+"""
+视频检测异步任务
+- 上传文件分块写入磁盘，不整体读入内存
+- 任务在后台线程池中执行，可查询进度（已处理帧数/总帧数）与部分结果，并支持取消
+"""
+import os
+import time
+import uuid
+import tempfile
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .detection_utils import process_multi_video_file
+
+logger = logging.getLogger(__name__)
+
+VIDEO_JOB_WORKERS = int(os.environ.get('VIDEO_JOB_WORKERS', 2))
+JOB_RETENTION_SECONDS = 3600  # 已结束任务保留1小时
+
+
+def save_upload(file, suffix=None):
+    """将上传文件分块写入临时文件，返回文件路径"""
+    if suffix is None:
+        suffix = os.path.splitext(file.name or '')[1] or '.mp4'
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
+        for chunk in file.chunks():
+            temp_file.write(chunk)
+        return temp_file.name
+
+
+class VideoJob:
+    """视频检测任务"""
+
+    def __init__(self, video_path, detectors, sample_interval, filename=None):
+        self.id = uuid.uuid4().hex
+        self.video_path = video_path
+        self.detectors = detectors
+        self.sample_interval = sample_interval
+        self.filename = filename
+        self.status = 'queued'  # queued / running / completed / failed / cancelled
+        self.frames_done = 0
+        self.total_frames = None
+        self.partial = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    def _on_progress(self, frames_done, total_frames, frame_hits):
+        self.frames_done = frames_done
+        self.total_frames = total_frames
+        # 命中列表只会追加，每次只复制新增部分，长视频的总开销保持线性
+        for name, hits in frame_hits.items():
+            partial = self.partial.setdefault(name, [])
+            if len(hits) > len(partial):
+                partial.extend(hits[len(partial):])
+
+    def run(self):
+        if self.cancel_event.is_set():
+            self._finish('cancelled')
+            return
+
+        self.status = 'running'
+        try:
+            result = process_multi_video_file(
+                self.video_path, self.detectors, self.sample_interval,
+                progress_callback=self._on_progress,
+                cancel_event=self.cancel_event
+            )
+            if "error" in result:
+                self.error = result["error"]
+                self._finish('failed')
+            else:
+                self.result = result
+                self._finish('cancelled' if result.get('cancelled') else 'completed')
+        except Exception as e:
+            logger.error(f"视频检测任务 {self.id} 失败: {str(e)}")
+            self.error = str(e)
+            self._finish('failed')
+
+    def _finish(self, status):
+        self.status = status
+        self.finished_at = time.time()
+        # 清理临时文件
+        if self.video_path and os.path.exists(self.video_path):
+            os.unlink(self.video_path)
+
+    @property
+    def finished(self):
+        return self.status in ('completed', 'failed', 'cancelled')
+
+    def to_dict(self):
+        progress = None
+        if self.total_frames:
+            progress = min(1.0, self.frames_done / self.total_frames)
+        elif self.status == 'completed':
+            progress = 1.0
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "detectors": self.detectors,
+            "frames_done": self.frames_done,
+            "total_frames": self.total_frames,
+            "progress": progress,
+            "partial_results": None if self.finished else {name: list(hits) for name, hits in self.partial.items()},
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """视频检测任务管理器"""
+
+    def __init__(self, max_workers=VIDEO_JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='video-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, video_path, detectors=None, sample_interval=30, filename=None):
+        """提交视频检测任务，立即返回任务对象"""
+        self._prune()
+        job = VideoJob(video_path, detectors, sample_interval, filename)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(job.run)
+        logger.info(f"提交视频检测任务 {job.id}: {filename}")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """请求取消任务；排队中的任务不会再执行，运行中的任务在下一个采样帧结束"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if not job.finished:
+            job.cancel_event.set()
+        return job
+
+    def _prune(self):
+        """清理过期的已结束任务"""
+        now = time.time()
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.finished and now - job.finished_at > JOB_RETENTION_SECONDS:
+                    del self._jobs[job_id]
+
+
+# 全局实例
+job_manager = JobManager()
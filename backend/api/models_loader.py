@@ -1,10 +1,15 @@
 # api/models_loader.py
 import os
-import torch
-from ultralytics import YOLO
+import time
+import shutil
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
 
-# 模块级变量，在导入时初始化
-print("正在加载YOLOv8模型...")
+import numpy as np
+
+logger = logging.getLogger(__name__)
 
 # 模型路径配置
 MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'models')
@@ -14,57 +19,215 @@ RUBBISH_MODEL_PATH = os.path.join(MODELS_DIR, 'rubbish.pt')  # 垃圾检测模
 FIRESMOKE_MODEL_PATH = os.path.join(MODELS_DIR, 'firesmoke.pt')  # 烟火检测模型路径
 CROSS_MODEL_PATH = os.path.join(MODELS_DIR, 'cross.pt')  # 翻越检测模型路径
 
-# 模型实例作为模块级变量
-try:
-    # 检查CUDA可用性
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    print(f"使用设备: {device}")
-    
-    # 加载人物检测模型
-    person_model = YOLO(PERSON_MODEL_PATH)
-    print("人物检测模型加载成功")
-    
-    # 加载行为检测模型
-    behavior_model = YOLO(BEHAVIOR_MODEL_PATH)
-    print("行为检测模型加载成功")
-    
-    # 加载垃圾检测模型
-    rubbish_model = YOLO(RUBBISH_MODEL_PATH)
-    print("垃圾检测模型加载成功")
-    
-    # 加载烟火检测模型
-    firesmoke_model = YOLO(FIRESMOKE_MODEL_PATH)
-    print("烟火检测模型加载成功")
-    
-    # 加载翻越检测模型
-    cross_model = YOLO(CROSS_MODEL_PATH)
-    print("翻越检测模型加载成功")
-    
-    MODELS_LOADED = True
-except Exception as e:
-    print(f"模型加载失败: {str(e)}")
-    person_model = None
-    behavior_model = None
-    rubbish_model = None
-    firesmoke_model = None
-    cross_model = None
-    MODELS_LOADED = False
+MODEL_PATHS = {
+    'person': PERSON_MODEL_PATH,
+    'behavior': BEHAVIOR_MODEL_PATH,
+    'rubbish': RUBBISH_MODEL_PATH,
+    'firesmoke': FIRESMOKE_MODEL_PATH,
+    'cross': CROSS_MODEL_PATH,
+}
+
+# 预热使用的输入尺寸
+WARMUP_IMAGE_SIZE = 640
+
+# 推理后端：torch（直接运行.pt权重）/ onnx（ONNX Runtime）/ openvino
+# 非torch后端在首次加载时从.pt导出，产物缓存在权重文件旁；MODEL_INT8=1 时使用int8量化版本
+SUPPORTED_BACKENDS = ('torch', 'onnx', 'openvino')
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'torch').strip().lower()
+MODEL_INT8 = os.environ.get('MODEL_INT8', '0') == '1'
+MODEL_INT8_DATA = os.environ.get('MODEL_INT8_DATA')  # OpenVINO int8 校准数据集 yaml（可选）
+
+# 模型按需加载：首次使用时加载，或由后台线程预热
+_models = {}
+_states = {
+    name: {
+        'state': 'unloaded', 'error': None, 'load_seconds': None, 'warmup_seconds': None,
+        'backend': None, 'weights': None
+    }
+    for name in MODEL_PATHS
+}
+_load_locks = {name: threading.Lock() for name in MODEL_PATHS}
+_warmup_thread = None
+device = None
+
+def _get_device():
+    """检查CUDA可用性"""
+    global device
+    if device is None:
+        import torch
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        logger.info(f"使用设备: {device}")
+    return device
+
+def _is_fresh(artifact, source):
+    """导出产物存在、非空且不早于源权重（产物以原子替换写入，不会出现写了一半的文件）"""
+    return (os.path.exists(artifact) and os.path.getsize(artifact) > 0
+            and os.path.getmtime(artifact) >= os.path.getmtime(source))
+
+@contextmanager
+def _export_lock(stem):
+    """跨进程的导出锁：多个推理工作进程同时预热时，同一模型只由一个进程导出，其余等待后直接使用产物"""
+    try:
+        import fcntl
+    except ImportError:  # Windows 下没有 fcntl，退化为不加锁
+        yield
+        return
+    with open(f'{stem}.export.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _export_to(pt_path, target, **export_args):
+    """在临时目录中对.pt副本导出，完成后再用 os.replace 原子地放到 target（文件或目录）"""
+    from ultralytics import YOLO
+    tmp_dir = tempfile.mkdtemp(prefix='.export-', dir=os.path.dirname(pt_path))
+    try:
+        tmp_pt = os.path.join(tmp_dir, os.path.basename(pt_path))
+        shutil.copy2(pt_path, tmp_pt)
+        exported = YOLO(tmp_pt).export(**export_args)
+        if os.path.isdir(exported):
+            # 目录无法原子覆盖：先移走旧目录再替换，读取方同样持有导出锁，不会看到中间状态
+            shutil.rmtree(target, ignore_errors=True)
+        os.replace(exported, target)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def export_weights(name, backend=None, int8=None):
+    """返回指定后端可直接加载的权重路径，必要时从.pt导出并缓存
+
+    检查与导出都在跨进程的文件锁内完成，产物先写到临时位置再原子替换
+    """
+    backend = backend or MODEL_BACKEND
+    int8 = MODEL_INT8 if int8 is None else int8
+    if backend not in SUPPORTED_BACKENDS:
+        raise ValueError(f"不支持的推理后端: {backend}")
+
+    pt_path = MODEL_PATHS[name]
+    if backend == 'torch':
+        return pt_path
+
+    stem = os.path.splitext(pt_path)[0]
+
+    with _export_lock(stem):
+        if backend == 'onnx':
+            onnx_path = f'{stem}.onnx'
+            if not _is_fresh(onnx_path, pt_path):
+                logger.info(f"导出模型 {name} 为ONNX...")
+                _export_to(pt_path, onnx_path, format='onnx', imgsz=WARMUP_IMAGE_SIZE, dynamic=True, simplify=True)
+            if not int8:
+                return onnx_path
+
+            int8_path = f'{stem}_int8.onnx'
+            if not _is_fresh(int8_path, onnx_path):
+                logger.info(f"量化模型 {name} 为int8 ONNX...")
+                from onnxruntime.quantization import quantize_dynamic, QuantType
+                tmp_path = f'{stem}_int8.tmp.onnx'
+                try:
+                    quantize_dynamic(onnx_path, tmp_path, weight_type=QuantType.QUInt8)
+                    os.replace(tmp_path, int8_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            return int8_path
+
+        # openvino：导出产物为目录
+        ov_dir = f'{stem}_int8_openvino_model' if int8 else f'{stem}_openvino_model'
+        if not _is_fresh(os.path.join(ov_dir, 'metadata.yaml'), pt_path):
+            logger.info(f"导出模型 {name} 为OpenVINO{'(int8)' if int8 else ''}...")
+            export_args = {'format': 'openvino', 'imgsz': WARMUP_IMAGE_SIZE, 'dynamic': True, 'int8': int8}
+            if int8 and MODEL_INT8_DATA:
+                export_args['data'] = MODEL_INT8_DATA
+            _export_to(pt_path, ov_dir, **export_args)
+        return ov_dir
+
+def load_model_variant(name, backend=None, int8=None):
+    """按指定后端加载模型（不缓存），供加载流程与后端对比使用"""
+    from ultralytics import YOLO
+    weights = export_weights(name, backend, int8)
+    return YOLO(weights, task='detect'), weights
+
+def _load_model(name):
+    """加载并预热单个模型（同一模型只加载一次）"""
+    with _load_locks[name]:
+        state = _states[name]
+        if state['state'] in ('ready', 'failed'):
+            return _models.get(name)
+
+        state['state'] = 'loading'
+        try:
+            _get_device()
+
+            started = time.monotonic()
+            model, weights = load_model_variant(name)
+            state['load_seconds'] = time.monotonic() - started
+            state['backend'] = MODEL_BACKEND + ('-int8' if MODEL_INT8 and MODEL_BACKEND != 'torch' else '')
+            state['weights'] = os.path.basename(weights)
+
+            # 用空白图像跑一次推理，完成权重初始化
+            started = time.monotonic()
+            model(np.zeros((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), dtype=np.uint8), verbose=False)
+            state['warmup_seconds'] = time.monotonic() - started
+
+            _models[name] = model
+            state['state'] = 'ready'
+            logger.info(f"模型 {name} 加载成功 ({state['load_seconds']:.2f}s, 预热 {state['warmup_seconds']:.2f}s)")
+        except Exception as e:
+            state['state'] = 'failed'
+            state['error'] = str(e)
+            logger.error(f"模型 {name} 加载失败: {str(e)}")
+
+        return _models.get(name)
+
+def warmup_models(names=None):
+    """同步加载并预热模型，返回是否全部成功"""
+    names = names or list(MODEL_PATHS)
+    return all(_load_model(name) is not None for name in names)
+
+def start_background_warmup(names=None):
+    """在后台线程中加载并预热模型（重复调用无副作用）"""
+    global _warmup_thread
+    if _warmup_thread is not None and _warmup_thread.is_alive():
+        return _warmup_thread
+    _warmup_thread = threading.Thread(target=warmup_models, args=(names,), daemon=True)
+    _warmup_thread.start()
+    logger.info("模型后台预热线程已启动")
+    return _warmup_thread
+
+def get_models_status():
+    """获取各模型的加载状态：unloaded / loading / ready / failed"""
+    return {name: dict(state) for name, state in _states.items()}
 
 # 提供获取模型的函数
+def get_model(name):
+    """按名称获取模型：person/behavior/rubbish/firesmoke/cross，首次调用时加载"""
+    if name not in MODEL_PATHS:
+        return None
+    model = _models.get(name)
+    if model is None:
+        model = _load_model(name)
+    return model
+
 def get_person_model():
-    return person_model
+    return get_model('person')
 
 def get_behavior_model():
-    return behavior_model
+    return get_model('behavior')
 
 def get_rubbish_model():
-    return rubbish_model
+    return get_model('rubbish')
 
 def get_firesmoke_model():
-    return firesmoke_model
+    return get_model('firesmoke')
 
 def get_cross_model():
-    return cross_model
+    return get_model('cross')
 
-def is_models_loaded():
-    return MODELS_LOADED
\ No newline at end of file
+def is_models_loaded(*names):
+    """模型是否可用：权重文件存在且未加载失败（不会触发加载）"""
+    names = names or list(MODEL_PATHS)
+    return all(
+        _states[name]['state'] != 'failed' and os.path.exists(MODEL_PATHS[name])
+        for name in names
+    )
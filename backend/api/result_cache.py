@@ -0,0 +1,140 @@
+# api/result_cache.py
+"""
+检测结果缓存
+静止或画面冻结的摄像头会持续产生几乎相同的帧，按 (摄像头, 检测器, 感知哈希) 缓存检测结果：
+- 感知哈希：32x32灰度图做DCT，取左上8x8低频分量与中值比较得到64位哈希
+- 汉明距离不超过容差即视为命中，直接返回上次的检测结果
+- 条目有TTL，总数超过上限时按LRU淘汰
+"""
+import os
+import copy
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def perceptual_hash(img):
+    """计算图像的64位感知哈希（pHash）"""
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # 直流分量不参与中值计算
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class DetectionResultCache:
+    """按 (摄像头, 检测器) 分组的感知哈希结果缓存"""
+
+    def __init__(self, enabled=None, max_distance=None, ttl=None, max_size=None):
+        if enabled is None:
+            enabled = os.environ.get('RESULT_CACHE_ENABLED', '1') == '1'
+        if max_distance is None:
+            max_distance = int(os.environ.get('RESULT_CACHE_HAMMING', 4))
+        if ttl is None:
+            ttl = float(os.environ.get('RESULT_CACHE_TTL', 60))
+        if max_size is None:
+            max_size = int(os.environ.get('RESULT_CACHE_SIZE', 1024))
+
+        self.enabled = enabled
+        self.max_distance = max_distance  # 允许的最大汉明距离
+        self.ttl = ttl  # 条目有效期（秒）
+        self.max_size = max_size  # 条目总数上限
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (camera, detector, hash) -> (结果, 写入时间)，按最近使用排序
+        self._groups = {}  # (camera, detector) -> {hash, ...}
+        self._stats = {}  # detector -> {hits, misses}
+        self._evictions = 0
+        self._expired = 0
+
+    def _count(self, detector, field):
+        counts = self._stats.setdefault(detector, {'hits': 0, 'misses': 0})
+        counts[field] += 1
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        group = self._groups.get(key[:2])
+        if group is not None:
+            group.discard(key[2])
+            if not group:
+                del self._groups[key[:2]]
+
+    def get(self, camera_id, detector, phash):
+        """查找汉明距离在容差内的有效结果，未命中返回None"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            best_key = None
+            best_distance = self.max_distance + 1
+            for cached_hash in list(self._groups.get((camera_id, detector), ())):
+                key = (camera_id, detector, cached_hash)
+                if now - self._entries[key][1] > self.ttl:
+                    self._remove(key)
+                    self._expired += 1
+                    continue
+                distance = hamming_distance(phash, cached_hash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+
+            if best_key is None:
+                self._count(detector, 'misses')
+                return None
+
+            self._entries.move_to_end(best_key)
+            self._count(detector, 'hits')
+            return copy.deepcopy(self._entries[best_key][0])
+
+    def put(self, camera_id, detector, phash, result):
+        if not self.enabled:
+            return
+
+        key = (camera_id, detector, phash)
+        with self._lock:
+            self._entries[key] = (copy.deepcopy(result), time.time())
+            self._entries.move_to_end(key)
+            self._groups.setdefault(key[:2], set()).add(phash)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def invalidate(self, camera_id=None):
+        """清除指定摄像头（或全部）的缓存条目"""
+        with self._lock:
+            for key in [k for k in self._entries if camera_id is None or k[0] == camera_id]:
+                self._remove(key)
+
+    def get_stats(self):
+        """命中/未命中计数"""
+        with self._lock:
+            hits = sum(c['hits'] for c in self._stats.values())
+            misses = sum(c['misses'] for c in self._stats.values())
+            return {
+                'enabled': self.enabled,
+                'max_distance': self.max_distance,
+                'ttl': self.ttl,
+                'max_size': self.max_size,
+                'size': len(self._entries),
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': hits / (hits + misses) if hits + misses else 0,
+                'evictions': self._evictions,
+                'expired': self._expired,
+                'detectors': {name: dict(counts) for name, counts in self._stats.items()},
+            }
+
+
+# 全局实例
+result_cache = DetectionResultCache()
@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from . import detection_utils
+
+
+def _write_video(path, frames=12, size=(64, 48)):
+    """生成一段纯色测试视频"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, size)
+    for _ in range(frames):
+        writer.write(np.zeros((size[1], size[0], 3), dtype=np.uint8))
+    writer.release()
+
+
+class ProcessMultiVideoFileTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.video_path = tempfile.mkstemp(suffix='.avi')
+        os.close(fd)
+        _write_video(self.video_path)
+        patcher = mock.patch.object(detection_utils, 'is_models_loaded', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(os.unlink, self.video_path)
+
+    def test_detector_error_is_returned(self):
+        """检测器抛出异常时返回错误，而不是"无检测"的正常结果"""
+        with mock.patch.object(detection_utils, '_run_detector', side_effect=RuntimeError('模型加载失败')):
+            result = detection_utils.process_multi_video_file(self.video_path, ['firesmoke'], sample_interval=1)
+
+        self.assertIn('error', result)
+        self.assertIn('模型加载失败', result['error'])
+        self.assertNotIn('has_detection', result)
+
+    def test_no_detection(self):
+        empty = {'has_firesmoke': False, 'detections': [], 'count': 0}
+        with mock.patch.object(detection_utils, '_run_detector', return_value=empty):
+            result = detection_utils.process_multi_video_file(self.video_path, ['firesmoke'], sample_interval=1)
+
+        self.assertNotIn('error', result)
+        self.assertFalse(result['has_detection'])
+        self.assertEqual(result['total_frames'], 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,11 +7,22 @@ from django.conf import settings
 from django.conf.urls.static import static
 from ops.api import api as ops_api
 from api.api import api
+from ops.stable_video_stream import mjpeg_stream
+from ops.frame_views import get_frame_jpeg, frame_events
+from ops.camera_wall import camera_wall_jpeg, camera_wall_mjpeg
+from ops.stream_converter import hls_playlist, hls_segment
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api2/', ops_api.urls),
     path('api/', api.urls),
+    path('stream/<int:camera_id>/mjpeg/', mjpeg_stream, name='mjpeg_stream'),
+    path('stream/<int:camera_id>/frame.jpg', get_frame_jpeg, name='frame_jpeg'),
+    path('stream/<int:camera_id>/events', frame_events, name='frame_events'),
+    path('stream/wall.jpg', camera_wall_jpeg, name='camera_wall_jpeg'),
+    path('stream/wall.mjpeg', camera_wall_mjpeg, name='camera_wall_mjpeg'),
+    path('hls/<int:camera_id>/playlist.m3u8', hls_playlist, name='hls_playlist'),
+    path('hls/<int:camera_id>/<str:segment>', hls_segment, name='hls_segment'),
 ]
 
 # 开发环境下提供媒体文件访问
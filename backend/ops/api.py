@@ -1813,13 +1813,50 @@ def list_alarm_events(request,
 def get_video_analysis_status(request):
     """获取视频分析服务状态"""
     from .video_analysis_service import video_analysis_service
+    from .ingest_hub import ingest_hub
+    from .mjpeg_broadcaster import mjpeg_broadcaster
+    from .camera_wall import camera_wall
+    from .stream_converter import stream_converter
     
     return {
         "success": True,
         "running": video_analysis_service.running,
-        "cameras_count": len(video_analysis_service.cameras)
+        "cameras_count": len(video_analysis_service.cameras),
+        "motion_gate": video_analysis_service.motion_gate.get_stats(),
+        "capture_scheduler": video_analysis_service.capture_scheduler.get_stats(),
+        "ingest": ingest_hub.get_stats(),
+        "mjpeg": mjpeg_broadcaster.get_stats(),
+        "camera_wall": camera_wall.get_stats(),
+        "hls": stream_converter.get_stats()
     }
 
+class CameraROISchema(Schema):
+    rois: dict
+
+@api.get("/cameras/{camera_id}/roi")
+def get_camera_roi(request, camera_id: int):
+    """获取摄像头各检测器的检测区域（归一化多边形）"""
+    camera = get_object_or_404(Camera, id=camera_id)
+    return {"success": True, "camera_id": camera.id, "rois": camera.roi_config or {}}
+
+@api.put("/cameras/{camera_id}/roi")
+def update_camera_roi(request, camera_id: int, data: CameraROISchema):
+    """设置摄像头各检测器的检测区域，rois 为空字典时恢复整帧检测"""
+    from api.detection_utils import validate_rois
+    from api.result_cache import result_cache
+    
+    camera = get_object_or_404(Camera, id=camera_id)
+    try:
+        rois = validate_rois(data.rois)
+    except (ValueError, TypeError, IndexError) as e:
+        return {"success": False, "error": str(e)}
+    
+    camera.roi_config = rois or None
+    camera.save(update_fields=['roi_config', 'updated_at'])
+    # 区域变化后旧的缓存结果不再有效
+    result_cache.invalidate(camera.id)
+    return {"success": True, "camera_id": camera.id, "rois": rois}
+
 @api.post("/video-analysis/start")
 def start_video_analysis(request):
     """启动视频分析服务"""
@@ -38,9 +38,9 @@ def start_rtsp_socket_server():
             logger.info(f"RTSP Socket服务 {host}:{port} 已在运行，跳过启动")
             return
 
-        # 确保模型已加载（导入即触发加载）
+        # 确保模型可用（模型按需加载，此处只检查权重文件与加载状态）
         logger.info("检查模型加载状态...")
-        from api.models_loader import is_models_loaded  # 导入会触发模型加载
+        from api.models_loader import is_models_loaded
         if not is_models_loaded():
             logger.warning("模型未成功加载，RTSP Socket服务暂不启动")
             return
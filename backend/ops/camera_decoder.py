@@ -0,0 +1,448 @@
+"""
+常驻RTSP解码器
+每路流保持一个长连接的解码线程，持续读取并只保留最新一帧；断线后按指数退避重连。
+解码方式：
+- opencv：cv2.VideoCapture 解码为BGR图像
+- ffmpeg_mjpeg：FFmpeg子进程输出MJPEG，帧以JPEG字节保存，图像在首次使用时才解码
+- ffmpeg_raw：FFmpeg子进程按固定分析分辨率输出bgr24原始帧，readinto到预分配的NumPy缓冲池，
+  检测直接使用，不经过JPEG编解码；JPEG仅在预览或报警截图需要时生成
+解码器由 IngestHub 按RTSP地址统一管理，不直接创建
+"""
+import os
+import time
+import weakref
+import threading
+import subprocess
+import logging
+from collections import deque
+
+import cv2
+import numpy as np
+
+from .mjpeg_demuxer import MJPEGDemuxer
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_MAX_FRAME_AGE = float(os.environ.get('CAPTURE_MAX_FRAME_AGE', 5))  # 最新帧超过该时长视为失效（秒）
+DEFAULT_JPEG_QUALITY = 80
+
+DECODER_MODES = ('opencv', 'ffmpeg_mjpeg', 'ffmpeg_raw')
+
+# 同一次解码输出的多档画面：名称 -> (最大宽度, JPEG质量)，None 表示原始分辨率/默认质量
+# 每档只在有人请求时才缩放编码，并随帧缓存，多个客户端共用
+RENDITIONS = {
+    'thumb': (160, 60),     # 摄像头墙缩略图
+    'preview': (640, 75),   # 预览窗口
+    'full': (None, None),   # 原始分辨率
+}
+DEFAULT_RENDITION = 'full'
+
+
+def parse_rendition(name, default=DEFAULT_RENDITION):
+    """校验客户端请求的画面档位，未知档位回退为默认值"""
+    return name if name in RENDITIONS else default
+
+# ffmpeg_raw 模式的输出分辨率与缓冲池大小
+INGEST_RAW_SIZE = os.environ.get('INGEST_RAW_SIZE', '1280x720')
+INGEST_RAW_POOL = int(os.environ.get('INGEST_RAW_POOL', 4))
+INGEST_RAW_POOL_MAX = 16
+
+# FFmpeg读取RTSP的I/O超时（秒）；看门狗在超过两倍该时长没有输出时杀掉进程，阻塞的管道读取随即返回并触发重连
+INGEST_IO_TIMEOUT = float(os.environ.get('INGEST_IO_TIMEOUT', 5))
+
+
+class FramePool:
+    """预分配的原始帧缓冲池（显式租约）
+
+    acquire() 借出一个空闲缓冲区，返回以它为底层内存的新数组；该数组及其所有切片、视图都释放后，
+    缓冲区经 weakref.finalize 自动归还，不依赖引用计数的具体数值。
+    全部借出时扩容（不超过上限），达到上限则返回None
+    """
+
+    def __init__(self, shape, size=INGEST_RAW_POOL, max_size=INGEST_RAW_POOL_MAX):
+        self.shape = shape
+        self.max_size = max(size, max_size)
+        self._nbytes = int(np.prod(shape))
+        # deque 的 append/popleft 是原子操作：归还可能发生在任意线程的垃圾回收中，不能在这里加锁
+        self._free = deque(bytearray(self._nbytes) for _ in range(size))
+        self._allocated = size
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """借出一个可写入的缓冲区，没有空闲且已达上限时返回None"""
+        try:
+            raw = self._free.popleft()
+        except IndexError:
+            with self._lock:
+                if self._allocated >= self.max_size:
+                    return None
+                self._allocated += 1
+            raw = bytearray(self._nbytes)
+        lease = np.frombuffer(raw, dtype=np.uint8)
+        # 切片和视图的 base 都指向 lease，最后一个引用消失时才归还
+        weakref.finalize(lease, self._free.append, raw)
+        return lease.reshape(self.shape)
+
+    @property
+    def size(self):
+        return self._allocated
+
+    @property
+    def in_use(self):
+        return self._allocated - len(self._free)
+
+
+def _read_exactly(stream, view):
+    """将数据读满 view，流结束时返回False"""
+    filled = 0
+    total = len(view)
+    while filled < total:
+        n = stream.readinto(view[filled:])
+        if not n:
+            return False
+        filled += n
+    return True
+
+class DecodedFrame:
+    """解码后的一帧；图像与JPEG互相按需转换并缓存"""
+
+    def __init__(self, image=None, timestamp=None, seq=0, jpeg=None):
+        self._image = image
+        self._source_jpeg = jpeg  # 解码器直接输出的JPEG（ffmpeg_mjpeg模式）
+        self.timestamp = timestamp or time.time()  # time.time()
+        self.seq = seq
+        self._jpeg = {}
+        self._scaled = {}  # max_width -> 缩放后的图像
+        self._lock = threading.Lock()
+
+    @property
+    def age(self):
+        return time.time() - self.timestamp
+
+    @property
+    def image(self):
+        """BGR图像，仅有JPEG时首次访问才解码"""
+        if self._image is None and self._source_jpeg is not None:
+            with self._lock:
+                if self._image is None:
+                    self._image = cv2.imdecode(np.frombuffer(self._source_jpeg, np.uint8), cv2.IMREAD_COLOR)
+        return self._image
+
+    def scaled(self, max_width):
+        """等比缩放到不超过 max_width 的图像并缓存；从已缓存的最小且足够大的图像缩放，缩略图不必每次从原图缩放"""
+        image = self.image
+        if image is None or max_width is None or image.shape[1] <= max_width:
+            return image
+        with self._lock:
+            cached = self._scaled.get(max_width)
+            if cached is not None:
+                return cached
+            sources = [img for width, img in self._scaled.items() if width > max_width]
+        source = min(sources, key=lambda img: img.shape[1]) if sources else image
+        h, w = source.shape[:2]
+        resized = cv2.resize(source, (max_width, max(1, int(h * max_width / w))), interpolation=cv2.INTER_AREA)
+        with self._lock:
+            return self._scaled.setdefault(max_width, resized)
+
+    def rendition(self, name):
+        """按档位名称（thumb / preview / full）返回JPEG"""
+        max_width, quality = RENDITIONS[parse_rendition(name)]
+        return self.jpeg(quality=quality, max_width=max_width)
+
+    def jpeg(self, quality=None, max_width=None):
+        """返回该帧的JPEG字节，同一参数只编码一次
+
+        quality 为空且不缩放时优先使用解码器输出的原始JPEG；max_width 限制输出宽度（等比缩放）
+        """
+        image = None
+        if max_width is not None:
+            image = self.image
+            if image is None:
+                return None
+            if image.shape[1] <= max_width:
+                max_width = None
+
+        if quality is None:
+            if max_width is None and self._source_jpeg is not None:
+                return self._source_jpeg
+            quality = DEFAULT_JPEG_QUALITY
+
+        key = (quality, max_width)
+        with self._lock:
+            data = self._jpeg.get(key)
+        if data is None:
+            image = image if image is not None else self.image
+            if image is None:
+                return None
+            if max_width is not None:
+                image = self.scaled(max_width)
+            ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ok:
+                return None
+            with self._lock:
+                data = self._jpeg.setdefault(key, buffer.tobytes())
+        return data
+
+
+class CameraDecoder:
+    """单路RTSP流的常驻解码线程"""
+
+    def __init__(self, rtsp_url, mode='opencv', label=None, min_backoff=1.0, max_backoff=30.0):
+        if mode not in DECODER_MODES:
+            raise ValueError(f"不支持的解码方式: {mode}")
+        self.rtsp_url = rtsp_url
+        self.mode = mode
+        self.label = label or rtsp_url
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._latest = None
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._process = None
+        self._pool = None
+        self._last_output = 0.0  # FFmpeg最近一次输出数据的时间（time.monotonic）
+        self.dropped = 0
+        self.connected = False
+        self.reconnects = 0
+        self.frames_decoded = 0
+        self.last_error = None
+        self.started_at = None
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f'camera-decoder-{self.label}')
+        self._thread.start()
+        logger.info(f"{self.label} 解码线程启动（{self.mode}）")
+        return self
+
+    def stop(self):
+        self._running = False
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+        with self._cond:
+            self._cond.notify_all()
+
+    @property
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _publish(self, image=None, jpeg=None):
+        with self._cond:
+            self._seq += 1
+            self._latest = DecodedFrame(image, time.time(), self._seq, jpeg)
+            self.frames_decoded += 1
+            self._cond.notify_all()
+
+    def _read_opencv(self):
+        cap = cv2.VideoCapture(self.rtsp_url)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # 减小缓冲
+        cap.set(cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, 3000)  # 3秒超时
+        cap.set(cv2.CAP_PROP_READ_TIMEOUT_MSEC, 3000)  # 3秒读取超时
+        try:
+            if not cap.isOpened():
+                raise ConnectionError("无法打开RTSP流")
+            self._on_connected()
+
+            while self._running:
+                ret, frame = cap.read()
+                if not ret or frame is None:
+                    raise ConnectionError("读取帧失败")
+                # 跳过损坏或尺寸异常的帧
+                if frame.shape[0] <= 100 or frame.shape[1] <= 100:
+                    continue
+                self._publish(image=frame)
+        finally:
+            cap.release()
+
+    def _start_ffmpeg(self, cmd, **kwargs):
+        """启动FFmpeg子进程并附带看门狗线程"""
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, **kwargs)
+        self._last_output = time.monotonic()
+        threading.Thread(target=self._watchdog, args=(process,), daemon=True,
+                         name=f'camera-decoder-watchdog-{self.label}').start()
+        return process
+
+    def _watchdog(self, process):
+        """源流卡住时 -timeout 未必生效（如连接仍在但不再发送数据），超时无输出则杀掉进程"""
+        stall_timeout = INGEST_IO_TIMEOUT * 2
+        while process.poll() is None:
+            idle = time.monotonic() - self._last_output
+            if idle > stall_timeout:
+                logger.warning(f"{self.label} FFmpeg {idle:.0f}秒无输出，终止进程")
+                process.kill()
+                return
+            time.sleep(min(1.0, stall_timeout - idle))
+
+    def _read_ffmpeg_mjpeg(self):
+        cmd = [
+            'ffmpeg',
+            '-loglevel', 'error',
+            '-rtsp_transport', 'tcp',
+            '-timeout', str(int(INGEST_IO_TIMEOUT * 1000000)),  # 套接字I/O超时（微秒）
+            '-i', self.rtsp_url,
+            '-an',
+            '-f', 'image2pipe',
+            '-vcodec', 'mjpeg',
+            '-q:v', '5',
+            '-'
+        ]
+        self._process = self._start_ffmpeg(cmd)
+        try:
+            demuxer = MJPEGDemuxer(self._process.stdout)
+            connected = False
+            while self._running:
+                frames = demuxer.read()
+                if frames is None:
+                    raise ConnectionError("FFmpeg进程已退出")
+                self._last_output = time.monotonic()
+                if not frames:
+                    continue
+
+                if not connected:
+                    self._on_connected()
+                    connected = True
+                # 一次读取到多帧时只发布最后一帧，只有它需要复制出缓冲区
+                self._publish(jpeg=bytes(frames[-1]))
+        finally:
+            if self._process.poll() is None:
+                self._process.terminate()
+                try:
+                    self._process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+            self._process = None
+
+    def _read_ffmpeg_raw(self):
+        width, height = (int(v) for v in INGEST_RAW_SIZE.lower().split('x'))
+        if self._pool is None:
+            self._pool = FramePool((height, width, 3))
+        cmd = [
+            'ffmpeg',
+            '-loglevel', 'error',
+            '-rtsp_transport', 'tcp',
+            '-timeout', str(int(INGEST_IO_TIMEOUT * 1000000)),  # 套接字I/O超时（微秒）
+            '-i', self.rtsp_url,
+            '-an',
+            '-vf', f'scale={width}:{height}',
+            '-pix_fmt', 'bgr24',
+            '-f', 'rawvideo',
+            '-'
+        ]
+        frame_bytes = width * height * 3
+        self._process = self._start_ffmpeg(cmd, bufsize=frame_bytes)
+        scratch = None  # 缓冲池耗尽时读入并丢弃的临时区
+        try:
+            connected = False
+            while self._running:
+                buffer = self._pool.acquire()
+                if buffer is None:
+                    # 所有缓冲区仍被使用，读出并丢弃本帧以免管道阻塞
+                    if scratch is None:
+                        scratch = bytearray(frame_bytes)
+                    if not _read_exactly(self._process.stdout, memoryview(scratch)):
+                        raise ConnectionError("FFmpeg进程已退出")
+                    self._last_output = time.monotonic()
+                    self.dropped += 1
+                    continue
+
+                if not _read_exactly(self._process.stdout, memoryview(buffer).cast('B')):
+                    raise ConnectionError("FFmpeg进程已退出")
+                self._last_output = time.monotonic()
+                # 帧在订阅者之间共享，发布后设为只读
+                buffer.flags.writeable = False
+
+                if not connected:
+                    self._on_connected()
+                    connected = True
+                self._publish(image=buffer)
+                del buffer
+        finally:
+            if self._process.poll() is None:
+                self._process.terminate()
+                try:
+                    self._process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+            self._process = None
+
+    def _on_connected(self):
+        self.connected = True
+        logger.info(f"{self.label} RTSP连接成功")
+
+    def _run(self):
+        backoff = self.min_backoff
+        while self._running:
+            frames_before = self.frames_decoded
+            try:
+                if self.mode == 'ffmpeg_mjpeg':
+                    self._read_ffmpeg_mjpeg()
+                elif self.mode == 'ffmpeg_raw':
+                    self._read_ffmpeg_raw()
+                else:
+                    self._read_opencv()
+            except Exception as e:
+                self.last_error = str(e)
+                if self._running:
+                    logger.warning(f"{self.label} 解码中断: {str(e)}，{backoff:.0f}秒后重连")
+            finally:
+                self.connected = False
+
+            if not self._running:
+                break
+            # 本次连接收到过帧则从最小间隔重新退避
+            if self.frames_decoded > frames_before:
+                backoff = self.min_backoff
+            self.reconnects += 1
+            with self._cond:
+                self._cond.wait(backoff)
+            backoff = min(self.max_backoff, backoff * 2)
+
+        logger.info(f"{self.label} 解码线程退出")
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def latest(self, max_age=CAPTURE_MAX_FRAME_AGE):
+        """最新的有效帧，超过 max_age 秒未更新时返回None（max_age为None时不检查）"""
+        frame = self._latest
+        if frame is None or (max_age is not None and frame.age > max_age):
+            return None
+        return frame
+
+    def wait_for_frame(self, after_seq=0, timeout=3.0, max_age=CAPTURE_MAX_FRAME_AGE):
+        """等待序号大于 after_seq 的新帧，超时返回None"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._running:
+                frame = self.latest(max_age)
+                if frame is not None and frame.seq > after_seq:
+                    return frame
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return None
+
+    def get_stats(self):
+        frame = self._latest
+        uptime = time.time() - self.started_at if self.started_at else 0
+        return {
+            'mode': self.mode,
+            'alive': self.alive,
+            'connected': self.connected,
+            'frames_decoded': self.frames_decoded,
+            'decode_fps': self.frames_decoded / uptime if uptime > 0 else 0,
+            'reconnects': self.reconnects,
+            'dropped': self.dropped,
+            'pool_size': self._pool.size if self._pool is not None else None,
+            'pool_in_use': self._pool.in_use if self._pool is not None else None,
+            'last_frame_age': frame.age if frame is not None else None,
+            'last_error': self.last_error,
+        }
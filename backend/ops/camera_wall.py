@@ -0,0 +1,319 @@
+"""
+摄像头墙
+把一组摄像头的最新帧拼成一张网格图，替代前端对每路摄像头分别轮询：
+- 同一布局（摄像头列表 + 列数 + 格子尺寸）每个节拍最多拼接、编码一次，所有观看者共用结果
+- 画面没有任何变化时沿用上一节拍的结果，不重新编码
+- 格子缩放复用 DecodedFrame 的缩放缓存（与 thumb/preview 档位共用）
+- 布局持有各摄像头在接入中心的订阅，一段时间无人访问后释放
+接口：
+- GET /stream/wall.jpg?cameras=1,2,3&cols=3&tile=320x180    单张拼接图（ETag 为布局的拼接序号）
+- GET /stream/wall.mjpeg?cameras=1,2,3&cols=3&tile=320x180  按节拍推送的MJPEG流
+"""
+import os
+import math
+import time
+import threading
+import logging
+
+import cv2
+import numpy as np
+
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.views.decorators.http import require_http_methods
+
+from .ingest_hub import ingest_hub
+from .mjpeg_broadcaster import multipart_chunk, MJPEG_BOUNDARY
+
+logger = logging.getLogger(__name__)
+
+CAMERA_WALL_FPS = float(os.environ.get('CAMERA_WALL_FPS', 2))  # 拼接节拍
+CAMERA_WALL_IDLE_SECONDS = float(os.environ.get('CAMERA_WALL_IDLE_SECONDS', 30))  # 布局无人访问后释放的时长
+CAMERA_WALL_MAX_CAMERAS = 64
+CAMERA_WALL_MAX_PIXELS = 3840 * 2160  # 整张拼接图的像素上限（画布内存约24MB）
+CAMERA_WALL_MAX_LAYOUTS = int(os.environ.get('CAMERA_WALL_MAX_LAYOUTS', 8))  # 同时存在的布局数上限
+CAMERA_WALL_JPEG_QUALITY = 70
+CAMERA_WALL_STALE_SECONDS = 10  # 超过该时长没有新帧的格子标记为无信号
+CAMERA_WALL_KEEPALIVE_SECONDS = 5  # 画面无变化时MJPEG流重发上一帧的间隔，用于及时发现已断开的客户端
+DEFAULT_TILE_SIZE = (320, 180)
+
+
+def parse_layout(camera_ids, cols=None, tile=None):
+    """校验并规范化布局参数，返回 (camera_ids, cols, (tile_w, tile_h))；参数非法时抛出 ValueError"""
+    ids = []
+    for value in camera_ids:
+        camera_id = int(value)
+        if camera_id not in ids:
+            ids.append(camera_id)
+    if not ids:
+        raise ValueError('至少需要一个摄像头')
+    if len(ids) > CAMERA_WALL_MAX_CAMERAS:
+        raise ValueError(f'摄像头数量不能超过 {CAMERA_WALL_MAX_CAMERAS}')
+
+    cols = int(cols) if cols else math.ceil(math.sqrt(len(ids)))
+    cols = max(1, min(cols, len(ids)))
+
+    if tile:
+        tile_w, tile_h = (int(v) for v in str(tile).lower().split('x'))
+    else:
+        tile_w, tile_h = DEFAULT_TILE_SIZE
+    if not (32 <= tile_w <= 1920 and 32 <= tile_h <= 1080):
+        raise ValueError('格子尺寸超出范围')
+    rows = math.ceil(len(ids) / cols)
+    if rows * tile_h * cols * tile_w > CAMERA_WALL_MAX_PIXELS:
+        raise ValueError(f'拼接图尺寸 {cols * tile_w}x{rows * tile_h} 超过上限，请减小格子尺寸')
+    return tuple(ids), cols, (tile_w, tile_h)
+
+
+class WallLayout:
+    """一个布局的订阅、画布与最近一次拼接结果"""
+
+    def __init__(self, key, cameras):
+        self.key = key
+        camera_ids, self.cols, (self.tile_w, self.tile_h) = key
+        self.camera_ids = camera_ids
+        self.rows = math.ceil(len(camera_ids) / self.cols)
+        self.subscriptions = {
+            camera_id: ingest_hub.subscribe(rtsp_url, f'wall:{camera_id}')
+            for camera_id, rtsp_url in cameras.items()
+        }
+        # 画布预分配并在每个节拍中复用
+        self.canvas = np.zeros((self.rows * self.tile_h, self.cols * self.tile_w, 3), dtype=np.uint8)
+        self.lock = threading.Lock()
+        self.jpeg = None
+        self.seq = 0
+        self.composed_at = 0.0
+        self.last_access = time.monotonic()
+        self._tile_state = None
+        self.compose_count = 0
+
+    def close(self):
+        for subscription in self.subscriptions.values():
+            subscription.close()
+        self.subscriptions = {}
+
+    def _draw_placeholder(self, tile, text):
+        tile.fill(40)
+        cv2.putText(tile, text, (8, self.tile_h - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
+
+    def _place(self, tile, image):
+        """等比缩放后居中放入格子"""
+        h, w = image.shape[:2]
+        scale = min(self.tile_w / w, self.tile_h / h)
+        dw, dh = max(1, int(w * scale)), max(1, int(h * scale))
+        if (dw, dh) != (w, h):
+            image = cv2.resize(image, (dw, dh), interpolation=cv2.INTER_AREA)
+        x, y = (self.tile_w - dw) // 2, (self.tile_h - dh) // 2
+        if dw != self.tile_w or dh != self.tile_h:
+            tile.fill(0)
+        tile[y:y + dh, x:x + dw] = image
+
+    def compose(self):
+        """拼接一次；所有格子的帧都没有变化时直接返回False"""
+        frames = {}
+        for camera_id, subscription in self.subscriptions.items():
+            frame = subscription.latest(max_age=None)
+            stale = frame is None or frame.age > CAMERA_WALL_STALE_SECONDS
+            frames[camera_id] = (None if stale else frame)
+        state = tuple((camera_id, frame.seq if frame else None) for camera_id, frame in frames.items())
+        if state == self._tile_state and self.jpeg is not None:
+            return False
+
+        for index, camera_id in enumerate(self.camera_ids):
+            row, col = divmod(index, self.cols)
+            tile = self.canvas[row * self.tile_h:(row + 1) * self.tile_h, col * self.tile_w:(col + 1) * self.tile_w]
+            frame = frames.get(camera_id)
+            image = None
+            if frame is not None:
+                # 先按格子宽度取缓存的缩放图，避免每个节拍都从原图缩放
+                image = frame.scaled(self.tile_w)
+            if image is None:
+                # cv2.putText 不支持中文，占位文字只显示摄像头ID
+                self._draw_placeholder(tile, f'#{camera_id} No Signal' if camera_id in self.subscriptions else f'#{camera_id} N/A')
+            else:
+                self._place(tile, image)
+
+        ok, buffer = cv2.imencode('.jpg', self.canvas, [cv2.IMWRITE_JPEG_QUALITY, CAMERA_WALL_JPEG_QUALITY])
+        if not ok:
+            return False
+        self.jpeg = buffer.tobytes()
+        self._tile_state = state
+        self.seq += 1
+        self.compose_count += 1
+        return True
+
+
+class CameraWall:
+    """按布局缓存拼接结果，供所有观看者共享"""
+
+    def __init__(self, fps=CAMERA_WALL_FPS, idle_seconds=CAMERA_WALL_IDLE_SECONDS):
+        self.fps = fps
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._layouts = {}
+        self._reaper = None
+
+    @property
+    def tick(self):
+        return 1.0 / self.fps if self.fps > 0 else 1.0
+
+    def _evict_for_new_layout(self):
+        """布局数达到上限时移出最久未访问且已无人观看的布局（调用方持有锁），没有可移出的则抛出 ValueError"""
+        if len(self._layouts) < CAMERA_WALL_MAX_LAYOUTS:
+            return None
+        key, layout = min(self._layouts.items(), key=lambda item: item[1].last_access)
+        # MJPEG观看者至少每 CAMERA_WALL_KEEPALIVE_SECONDS 刷新一次访问时间
+        if time.monotonic() - layout.last_access < CAMERA_WALL_KEEPALIVE_SECONDS * 2:
+            raise ValueError(f'摄像头墙布局数已达上限 {CAMERA_WALL_MAX_LAYOUTS}')
+        return self._layouts.pop(key)
+
+    def _get_layout(self, key, touch=True):
+        evicted = None
+        with self._lock:
+            layout = self._layouts.get(key)
+            if layout is None:
+                evicted = self._evict_for_new_layout()
+                from .models import Camera
+                cameras = dict(Camera.objects.filter(id__in=key[0]).values_list('id', 'rtsp_url'))
+                layout = self._layouts[key] = WallLayout(key, cameras)
+                logger.info(f"创建摄像头墙布局：{len(key[0])} 路，{key[1]} 列，格子 {key[2][0]}x{key[2][1]}")
+                self._ensure_reaper()
+            if touch:
+                layout.last_access = time.monotonic()
+        if evicted is not None:
+            evicted.close()
+            logger.info(f"摄像头墙布局数达到上限，移出最久未访问的布局（{len(evicted.camera_ids)} 路）")
+        return layout
+
+    def _touch(self, key):
+        with self._lock:
+            layout = self._layouts.get(key)
+            if layout is not None:
+                layout.last_access = time.monotonic()
+
+    def get_frame(self, key, touch=True):
+        """返回布局当前节拍的 (seq, jpeg)；同一节拍内的并发请求只会拼接一次
+        布局数已达上限且无法移出时抛出 ValueError
+
+        touch=False 时不刷新布局的访问时间（MJPEG流在成功写出后才刷新）
+        """
+        layout = self._get_layout(key, touch)
+        with layout.lock:
+            if layout.jpeg is None or time.monotonic() - layout.composed_at >= self.tick:
+                layout.compose()
+                layout.composed_at = time.monotonic()
+            return layout.seq, layout.jpeg
+
+    def stream(self, key):
+        """MJPEG生成器：画面变化时每个节拍输出一次；画面不变时每隔几秒重发上一帧
+
+        客户端断开只有在写出时才能发现，重发保证摄像头全部离线或画面冻结时生成器也能及时结束；
+        布局访问时间只在成功写出后刷新，断开的客户端不会让布局一直无法回收
+        """
+        last_seq = None
+        last_sent = 0.0
+        while True:
+            started = time.monotonic()
+            try:
+                seq, jpeg = self.get_frame(key, touch=False)
+            except ValueError as e:
+                # 布局被回收后无法重建（布局数已满），结束该流
+                logger.warning(f"摄像头墙MJPEG流结束: {str(e)}")
+                return
+            if jpeg and (seq != last_seq or started - last_sent >= CAMERA_WALL_KEEPALIVE_SECONDS):
+                last_seq = seq
+                last_sent = started
+                yield multipart_chunk(jpeg)
+                self._touch(key)
+            elapsed = time.monotonic() - started
+            if elapsed < self.tick:
+                time.sleep(self.tick - elapsed)
+
+    def _ensure_reaper(self):
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reap_loop, name='camera-wall-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(1.0, self.idle_seconds / 2))
+            now = time.monotonic()
+            with self._lock:
+                idle = [key for key, layout in self._layouts.items() if now - layout.last_access > self.idle_seconds]
+                layouts = [self._layouts.pop(key) for key in idle]
+                empty = not self._layouts
+            for layout in layouts:
+                layout.close()
+                logger.info(f"摄像头墙布局（{len(layout.camera_ids)} 路）无人访问，释放订阅")
+            if empty:
+                with self._lock:
+                    if not self._layouts:
+                        self._reaper = None
+                        return
+
+    def get_stats(self):
+        with self._lock:
+            layouts = list(self._layouts.values())
+        return [
+            {
+                'cameras': list(layout.camera_ids),
+                'cols': layout.cols,
+                'tile': f'{layout.tile_w}x{layout.tile_h}',
+                'seq': layout.seq,
+                'compose_count': layout.compose_count,
+                'idle': round(time.monotonic() - layout.last_access, 1),
+            }
+            for layout in layouts
+        ]
+
+
+# 全局实例
+camera_wall = CameraWall()
+
+
+def _layout_from_request(request):
+    cameras = [v for v in request.GET.get('cameras', '').split(',') if v.strip()]
+    return parse_layout(cameras, request.GET.get('cols'), request.GET.get('tile'))
+
+
+@require_http_methods(["GET"])
+def camera_wall_jpeg(request):
+    """摄像头墙单张拼接图，同一布局在一个节拍内的所有请求共用同一次拼接结果"""
+    try:
+        key = _layout_from_request(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(f'布局参数错误: {str(e)}')
+
+    try:
+        seq, jpeg = camera_wall.get_frame(key)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    etag = f'"wall-{seq}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(jpeg, content_type='image/jpeg')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@require_http_methods(["GET"])
+def camera_wall_mjpeg(request):
+    """摄像头墙MJPEG流，整面墙只占一个连接"""
+    try:
+        key = _layout_from_request(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(f'布局参数错误: {str(e)}')
+
+    try:
+        # 先建立布局，超出布局数上限时直接返回400，而不是返回一个立即结束的流
+        camera_wall.get_frame(key)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    response = StreamingHttpResponse(
+        camera_wall.stream(key),
+        content_type=f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}'
+    )
+    response['Cache-Control'] = 'no-cache, no-store'
+    return response
@@ -0,0 +1,186 @@
+"""
+截图检测调度器
+- 每个摄像头的截图间隔自适应：最近有检测命中时缩短，长时间无命中时逐步拉长
+- 可选的全局推理帧率预算（令牌桶，INFERENCE_FPS_BUDGET，默认0表示不限制），摄像头增多时总负载保持平稳；
+  预算不足以满足各摄像头的目标间隔时记录告警
+- 多个摄像头同时到期时，逾期最久的先获得令牌
+"""
+import os
+import time
+import threading
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+UTILIZATION_WINDOW = 60  # 预算利用率统计窗口（秒），也是预算不足告警的最小间隔
+
+
+def _setting(value, name, default):
+    """参数显式传入（包括0）时优先，否则读取环境变量"""
+    return float(value if value is not None else os.environ.get(name, default))
+
+
+class CaptureScheduler:
+    """自适应截图间隔 + 全局推理预算"""
+
+    def __init__(self, min_interval=None, base_interval=None, max_interval=None,
+                 recent_seconds=None, quiet_seconds=None, fps_budget=None):
+        self.min_interval = _setting(min_interval, 'CAPTURE_MIN_INTERVAL', 3)  # 最近有命中时的间隔
+        self.base_interval = _setting(base_interval, 'CAPTURE_BASE_INTERVAL', 10)  # 常规间隔
+        self.max_interval = _setting(max_interval, 'CAPTURE_MAX_INTERVAL', 60)  # 长时间无命中时的最大间隔
+        self.recent_seconds = _setting(recent_seconds, 'CAPTURE_RECENT_SECONDS', 60)  # 命中后保持短间隔的时长
+        self.quiet_seconds = _setting(quiet_seconds, 'CAPTURE_QUIET_SECONDS', 300)  # 无命中超过该时长开始拉长间隔
+        self.fps_budget = _setting(fps_budget, 'INFERENCE_FPS_BUDGET', 0)  # 所有摄像头合计每秒最多送检帧数，0为不限制
+
+        self._cond = threading.Condition()
+        self._cameras = {}
+        self._tokens = max(1.0, self.fps_budget)
+        self._capacity = max(1.0, self.fps_budget)
+        self._refill_time = time.monotonic()
+        self._grants = deque()  # 最近发放令牌的时间
+        self._throttled = 0  # 已到期但因预算不足而等待的次数
+        self._throttle_logged = None  # 上次记录预算不足告警的时间
+
+    def register(self, camera_id):
+        now = time.monotonic()
+        with self._cond:
+            self._cameras[camera_id] = {
+                'next_due': now,
+                'interval': self.base_interval,
+                'last_detection': None,
+                'registered': now,
+                'last_grant': None,
+                'effective_interval': None,
+                'captures': 0,
+                'detections': 0,
+            }
+            self._cond.notify_all()
+
+    def unregister(self, camera_id):
+        with self._cond:
+            self._cameras.pop(camera_id, None)
+            self._cond.notify_all()
+
+    @property
+    def budget_enabled(self):
+        return self.fps_budget > 0
+
+    def _refill(self, now):
+        self._tokens = min(self._capacity, self._tokens + (now - self._refill_time) * self.fps_budget)
+        self._refill_time = now
+
+    def _is_next(self, camera_id, now):
+        """是否为已到期摄像头中逾期最久的一个"""
+        due = [(state['next_due'], cid) for cid, state in self._cameras.items() if state['next_due'] <= now]
+        return bool(due) and min(due, key=lambda item: item[0])[1] == camera_id
+
+    def acquire(self, camera_id, timeout=1.0):
+        """等待本摄像头到期并取得推理令牌；超时或摄像头已注销时返回False"""
+        deadline = time.monotonic() + timeout
+        throttled = False
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                state = self._cameras.get(camera_id)
+                if state is None:
+                    return False
+
+                self._refill(now)
+                due = state['next_due'] <= now
+                if due and (not self.budget_enabled or self._tokens >= 1) and self._is_next(camera_id, now):
+                    if self.budget_enabled:
+                        self._tokens -= 1
+                    self._grants.append(now)
+                    if state['last_grant'] is not None:
+                        gap = now - state['last_grant']
+                        previous = state['effective_interval']
+                        state['effective_interval'] = gap if previous is None else previous * 0.7 + gap * 0.3
+                    state['last_grant'] = now
+                    state['captures'] += 1
+                    state['next_due'] = float('inf')  # 截图检测进行中，完成后由 report 重新排期
+                    return True
+
+                if now >= deadline:
+                    return False
+                if not due:
+                    wait = state['next_due'] - now
+                elif self.budget_enabled and self._tokens < 1:
+                    if not throttled:
+                        throttled = True
+                        self._on_throttled(now)
+                    wait = (1 - self._tokens) / self.fps_budget
+                else:
+                    wait = 0.05  # 等待逾期更久的摄像头先取令牌
+                self._cond.wait(min(wait, deadline - now))
+
+    def _on_throttled(self, now):
+        """摄像头已到期但令牌不足：实际间隔将超过配置的间隔，按统计窗口限频记录告警"""
+        self._throttled += 1
+        if self._throttle_logged is None or now - self._throttle_logged >= UTILIZATION_WINDOW:
+            self._throttle_logged = now
+            logger.warning(
+                f"推理预算 {self.fps_budget:g} fps 不足以满足 {len(self._cameras)} 个摄像头的截图间隔，"
+                f"实际间隔将被拉长（可调大 INFERENCE_FPS_BUDGET，设为0不限制）"
+            )
+
+    def _next_interval(self, state, now):
+        if state['last_detection'] is not None and now - state['last_detection'] < self.recent_seconds:
+            return self.min_interval
+        quiet = now - (state['last_detection'] if state['last_detection'] is not None else state['registered'])
+        if quiet < self.quiet_seconds:
+            return self.base_interval
+        # 超过安静时长后线性拉长，再经过一个安静时长达到上限
+        ramp = min(1.0, (quiet - self.quiet_seconds) / self.quiet_seconds)
+        return self.base_interval + (self.max_interval - self.base_interval) * ramp
+
+    def report(self, camera_id, detected=False, inferred=True):
+        """上报本次截图结果并安排下一次；未实际推理（截图失败、门控跳过）时退还令牌"""
+        now = time.monotonic()
+        with self._cond:
+            state = self._cameras.get(camera_id)
+            if state is None:
+                return
+            if detected:
+                state['last_detection'] = now
+                state['detections'] += 1
+            if not inferred and self.budget_enabled:
+                self._refill(now)
+                self._tokens = min(self._capacity, self._tokens + 1)
+                if self._grants:
+                    self._grants.pop()
+            state['interval'] = self._next_interval(state, now)
+            state['next_due'] = now + state['interval']
+            self._cond.notify_all()
+
+    def get_stats(self):
+        """各摄像头的目标/实际间隔及全局预算利用率"""
+        now = time.monotonic()
+        with self._cond:
+            while self._grants and now - self._grants[0] > UTILIZATION_WINDOW:
+                self._grants.popleft()
+            window = min(UTILIZATION_WINDOW, max(1.0, now - min(
+                (state['registered'] for state in self._cameras.values()), default=now)))
+            granted_fps = len(self._grants) / window
+            return {
+                'fps_budget': self.fps_budget,
+                'granted_fps': granted_fps,
+                'budget_utilization': min(1.0, granted_fps / self.fps_budget) if self.budget_enabled else 0,
+                'throttled': self._throttled,
+                'intervals': {
+                    'min': self.min_interval,
+                    'base': self.base_interval,
+                    'max': self.max_interval,
+                },
+                'cameras': {
+                    camera_id: {
+                        'interval': state['interval'],
+                        'effective_interval': state['effective_interval'],
+                        'in_progress': state['next_due'] == float('inf'),
+                        'seconds_since_detection': now - state['last_detection'] if state['last_detection'] is not None else None,
+                        'captures': state['captures'],
+                        'detections': state['detections'],
+                    }
+                    for camera_id, state in self._cameras.items()
+                }
+            }
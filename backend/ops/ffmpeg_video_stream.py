@@ -1,21 +1,24 @@
 """
 基于FFmpeg的视频流处理器
-使用FFmpeg将RTSP流转换为HTTP流，供前端播放
+帧来自接入中心的共享解码器（INGEST_DECODER=ffmpeg_mjpeg 时由FFmpeg解码并直接输出JPEG），供前端播放
 """
-import subprocess
-import threading
 import time
 import logging
-import os
 import base64
 from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
+from .ingest_hub import ingest_hub
+from .camera_decoder import parse_rendition
+
 logger = logging.getLogger(__name__)
 
+# 客户端未指定时的画面档位：preview（宽640），与原先固定 -s 640x480 的输出相当，避免默认推送原始分辨率
+FFMPEG_STREAM_RENDITION = 'preview'
+
 class FFmpegVideoStream:
-    """基于FFmpeg的视频流处理器"""
+    """基于FFmpeg的视频流处理器（接入中心的订阅者）"""
     
     def __init__(self):
         self.cameras = {}
@@ -24,58 +27,15 @@ class FFmpegVideoStream:
     def start_camera(self, camera_id, rtsp_url):
         """启动摄像头"""
         try:
-            # 先停止现有的连接
+            # 先停止现有的订阅
             if camera_id in self.cameras:
                 self.stop_camera(camera_id)
             
-            # 创建输出目录
-            output_dir = f"media/streams/{camera_id}"
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # 使用FFmpeg将RTSP流转换为MJPEG流
-            cmd = [
-                'ffmpeg',
-                '-rtsp_transport', 'tcp',
-                '-analyzeduration', '2000000',
-                '-probesize', '2000000',
-                '-i', rtsp_url,
-                '-c:v', 'mjpeg',
-                '-q:v', '5',
-                '-f', 'mjpeg',
-                '-r', '5',  # 5fps
-                '-s', '640x480',  # 固定分辨率
-                '-y',
-                f'{output_dir}/stream.mjpg'
-            ]
-            
-            # 启动FFmpeg进程
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                preexec_fn=os.setsid if os.name != 'nt' else None
-            )
-            
             self.cameras[camera_id] = {
-                'process': process,
+                'subscription': ingest_hub.subscribe(rtsp_url, f'ffmpeg:{camera_id}'),
                 'rtsp_url': rtsp_url,
-                'output_dir': output_dir,
-                'stream_file': f'{output_dir}/stream.mjpg',
-                'last_frame': None,
-                'last_time': 0,
-                'frame_count': 0,
-                'error_count': 0,
-                'running': True
             }
             
-            # 启动读取线程
-            thread = threading.Thread(
-                target=self._read_stream,
-                args=(camera_id,),
-                daemon=True
-            )
-            thread.start()
-            
             logger.info(f"启动摄像头 {camera_id} 的FFmpeg流处理")
             return True
             
@@ -83,60 +43,14 @@ class FFmpegVideoStream:
             logger.error(f"启动摄像头 {camera_id} 失败: {str(e)}")
             return False
     
-    def _read_stream(self, camera_id):
-        """读取流数据"""
-        while camera_id in self.cameras and self.cameras[camera_id]['running']:
-            try:
-                camera = self.cameras[camera_id]
-                stream_file = camera['stream_file']
-                
-                if os.path.exists(stream_file):
-                    # 读取最新的帧
-                    with open(stream_file, 'rb') as f:
-                        data = f.read()
-                        if data:
-                            # 查找最后一个JPEG帧
-                            frames = self._extract_jpeg_frames(data)
-                            if frames:
-                                camera['last_frame'] = frames[-1]
-                                camera['last_time'] = time.time()
-                                camera['frame_count'] += 1
-                                camera['error_count'] = 0
-                
-                time.sleep(0.2)  # 5fps
-                
-            except Exception as e:
-                logger.error(f"读取流数据失败: {str(e)}")
-                time.sleep(1)
-    
-    def _extract_jpeg_frames(self, data):
-        """从MJPEG流中提取JPEG帧"""
-        frames = []
-        start_marker = b'\xff\xd8'
-        end_marker = b'\xff\xd9'
-        
-        start = 0
-        while True:
-            start_pos = data.find(start_marker, start)
-            if start_pos == -1:
-                break
-            
-            end_pos = data.find(end_marker, start_pos)
-            if end_pos == -1:
-                break
-            
-            frame = data[start_pos:end_pos + 2]
-            frames.append(frame)
-            start = end_pos + 2
-        
-        return frames
-    
-    def get_latest_frame(self, camera_id):
-        """获取最新帧"""
+    def get_latest_frame(self, camera_id, rendition=FFMPEG_STREAM_RENDITION):
+        """获取最新帧（指定画面档位）"""
         if camera_id in self.cameras:
-            camera = self.cameras[camera_id]
-            if camera['last_frame'] and time.time() - camera['last_time'] < 10:
-                return camera['last_frame']
+            frame = self.cameras[camera_id]['subscription'].latest(max_age=10)
+            if frame is not None:
+                data = frame.rendition(rendition)
+                if data:
+                    return data
         return self._create_placeholder_frame()
     
     def _create_placeholder_frame(self):
@@ -148,26 +62,24 @@ class FFmpegVideoStream:
     def get_camera_info(self, camera_id):
         """获取摄像头信息"""
         if camera_id in self.cameras:
-            camera = self.cameras[camera_id]
-            current_time = time.time()
+            subscription = self.cameras[camera_id]['subscription']
+            stats = subscription.get_stats()
+            last_frame = subscription.latest(max_age=None)
             return {
-                'connected': True,
-                'frame_count': camera['frame_count'],
-                'error_count': camera['error_count'],
-                'last_frame_time': camera['last_time'],
-                'is_active': current_time - camera['last_time'] < 10,
-                'process_running': camera['process'].poll() is None
+                'connected': stats['connected'],
+                'frame_count': stats['frames_decoded'],
+                'error_count': stats['reconnects'],
+                'last_frame_time': last_frame.timestamp if last_frame else 0,
+                'is_active': last_frame is not None and last_frame.age < 10,
+                'process_running': stats['alive']
             }
         return {'connected': False}
     
     def stop_camera(self, camera_id):
         """停止摄像头"""
-        if camera_id in self.cameras:
-            camera = self.cameras[camera_id]
-            camera['running'] = False
-            camera['process'].terminate()
-            camera['process'].wait(timeout=5)
-            del self.cameras[camera_id]
+        camera = self.cameras.pop(camera_id, None)
+        if camera is not None:
+            camera['subscription'].close()
             logger.info(f"停止摄像头 {camera_id}")
 
 # 全局实例
@@ -178,7 +90,8 @@ ffmpeg_video_stream = FFmpegVideoStream()
 def get_ffmpeg_video_frame(request, camera_id):
     """获取FFmpeg视频帧"""
     try:
-        frame = ffmpeg_video_stream.get_latest_frame(camera_id)
+        rendition = parse_rendition(request.GET.get('rendition'), FFMPEG_STREAM_RENDITION)
+        frame = ffmpeg_video_stream.get_latest_frame(camera_id, rendition)
         frame_base64 = base64.b64encode(frame).decode('utf-8')
         return JsonResponse({
             'success': True,
@@ -0,0 +1,136 @@
+"""
+二进制帧接口
+替代 base64 JSON 轮询：
+- GET /stream/<camera_id>/frame.jpg          直接返回 image/jpeg，ETag 为帧序号
+  带 If-None-Match 且画面未更新时返回 304；加 ?wait=秒数 时改为长轮询，直到有新帧或超时
+  ?rendition=thumb|preview|full 选择画面档位（默认 full）
+- GET /stream/<camera_id>/events             Server-Sent Events，每有新帧推送一次序号与取图地址
+帧来自接入中心，短时间内的重复请求共用同一个解码器（空闲宽限期内不会断开）
+"""
+import os
+import json
+import time
+import logging
+
+from django.http import HttpResponse, HttpResponseNotFound, StreamingHttpResponse
+from django.views.decorators.http import require_http_methods
+
+from .ingest_hub import ingest_hub
+from .camera_decoder import parse_rendition
+
+logger = logging.getLogger(__name__)
+
+FRAME_LONG_POLL_MAX = float(os.environ.get('FRAME_LONG_POLL_MAX', 30))  # 长轮询最长等待秒数
+FRAME_SSE_FPS = float(os.environ.get('FRAME_SSE_FPS', 10))  # SSE推送频率上限
+FRAME_SSE_KEEPALIVE = 15  # SSE无新帧时的心跳间隔
+
+
+def frame_etag(frame, rendition=''):
+    """帧的ETag：序号 + 时间戳（+ 档位），解码器重启后序号归零也不会与旧帧冲突"""
+    suffix = f'-{rendition}' if rendition else ''
+    return f'"{frame.seq}-{int(frame.timestamp * 1000):x}{suffix}"'
+
+
+def _get_camera(camera_id):
+    from .models import Camera
+    return Camera.objects.filter(id=camera_id).first()
+
+
+def _parse_wait(request):
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        return 0
+    return max(0.0, min(wait, FRAME_LONG_POLL_MAX))
+
+
+def _jpeg_response(frame, data, rendition):
+    response = HttpResponse(data, content_type='image/jpeg')
+    response['ETag'] = frame_etag(frame, rendition)
+    response['X-Frame-Seq'] = str(frame.seq)
+    response['X-Frame-Timestamp'] = f'{frame.timestamp:.3f}'
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _not_modified(frame, rendition):
+    response = HttpResponse(status=304)
+    response['ETag'] = frame_etag(frame, rendition)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@require_http_methods(["GET"])
+def get_frame_jpeg(request, camera_id):
+    """返回最新帧的JPEG；If-None-Match 命中时返回304，或在 wait>0 时等待新帧"""
+    camera = _get_camera(camera_id)
+    if camera is None:
+        return HttpResponseNotFound('摄像头不存在')
+
+    wait = _parse_wait(request)
+    rendition = parse_rendition(request.GET.get('rendition'))
+    subscription = ingest_hub.subscribe(camera.rtsp_url, f'frame:{camera_id}')
+    try:
+        frame = subscription.wait_for_frame(timeout=3.0, max_age=None)
+        if frame is None:
+            return HttpResponse('暂无视频帧', status=503, content_type='text/plain; charset=utf-8')
+
+        if request.headers.get('If-None-Match') == frame_etag(frame, rendition):
+            if wait <= 0:
+                return _not_modified(frame, rendition)
+            newer = subscription.decoder.wait_for_frame(frame.seq, timeout=wait, max_age=None)
+            if newer is None:
+                return _not_modified(frame, rendition)
+            frame = newer
+
+        # 只编码请求的档位，结果随帧缓存，同档位的其他请求直接复用
+        data = frame.rendition(rendition)
+        if not data:
+            return HttpResponse('帧编码失败', status=503, content_type='text/plain; charset=utf-8')
+        return _jpeg_response(frame, data, rendition)
+    finally:
+        subscription.close()
+
+
+@require_http_methods(["GET"])
+def frame_events(request, camera_id):
+    """SSE：每有新帧推送 {seq, timestamp, url}，客户端再以 ETag 条件请求取图"""
+    camera = _get_camera(camera_id)
+    if camera is None:
+        return HttpResponseNotFound('摄像头不存在')
+
+    rendition = parse_rendition(request.GET.get('rendition'))
+    frame_url = request.build_absolute_uri(f'/stream/{camera_id}/frame.jpg?rendition={rendition}')
+    min_interval = 1.0 / FRAME_SSE_FPS if FRAME_SSE_FPS > 0 else 0
+
+    def generate():
+        subscription = ingest_hub.subscribe(camera.rtsp_url, f'sse:{camera_id}')
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                started = time.monotonic()
+                frame = subscription.next_frame(timeout=FRAME_SSE_KEEPALIVE)
+                if frame is None:
+                    yield ': keepalive\n\n'
+                    continue
+                payload = json.dumps({
+                    'seq': frame.seq,
+                    'timestamp': frame.timestamp,
+                    'etag': frame_etag(frame, rendition),
+                    'url': frame_url,
+                })
+                yield f'id: {frame.seq}\nevent: frame\ndata: {payload}\n\n'
+
+                elapsed = time.monotonic() - started
+                if elapsed < min_interval:
+                    time.sleep(min_interval - elapsed)
+        except Exception as e:
+            logger.error(f"摄像头 {camera_id} 的SSE推送失败: {str(e)}")
+        finally:
+            # 客户端断开时生成器被关闭，释放订阅
+            subscription.close()
+
+    response = StreamingHttpResponse(generate(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,135 @@
+"""
+摄像头接入中心
+每个进程内同一RTSP地址只建立一个连接和一个解码器，按引用计数分发给所有订阅者：
+视频分析、各类预览流、Socket推帧、HLS转换都只是订阅者。
+最后一个订阅者离开后（经过短暂的空闲宽限期）关闭连接
+"""
+import os
+import threading
+import logging
+from urllib.parse import urlsplit, urlunsplit
+
+from .camera_decoder import CameraDecoder, CAPTURE_MAX_FRAME_AGE
+
+logger = logging.getLogger(__name__)
+
+INGEST_DECODER = os.environ.get('INGEST_DECODER', 'opencv')  # opencv / ffmpeg_mjpeg / ffmpeg_raw
+INGEST_IDLE_SECONDS = float(os.environ.get('INGEST_IDLE_SECONDS', 5))  # 无订阅者后保持连接的时长
+
+
+def mask_credentials(url):
+    """隐藏RTSP地址中的用户名密码，用于日志与状态展示"""
+    parts = urlsplit(url)
+    if '@' not in parts.netloc:
+        return url
+    return urlunsplit(parts._replace(netloc='***@' + parts.netloc.rsplit('@', 1)[1]))
+
+
+class Subscription:
+    """对某路流的一次订阅，使用完毕后必须 close()"""
+
+    def __init__(self, hub, key, decoder, consumer):
+        self._hub = hub
+        self.key = key
+        self.decoder = decoder
+        self.consumer = consumer
+        self.last_seq = 0
+        self.closed = False
+
+    def latest(self, max_age=CAPTURE_MAX_FRAME_AGE):
+        """最新帧（不区分是否已取过）"""
+        return self.decoder.latest(max_age)
+
+    def wait_for_frame(self, timeout=3.0, max_age=CAPTURE_MAX_FRAME_AGE):
+        """最新帧，没有可用帧时最多等待 timeout 秒"""
+        return self.decoder.latest(max_age) or self.decoder.wait_for_frame(0, timeout, max_age)
+
+    def next_frame(self, timeout=1.0, max_age=CAPTURE_MAX_FRAME_AGE):
+        """比上次取到的更新的一帧（中间帧丢弃，只取最新），超时返回None"""
+        frame = self.decoder.wait_for_frame(self.last_seq, timeout, max_age)
+        if frame is not None:
+            self.last_seq = frame.seq
+        return frame
+
+    def get_stats(self):
+        return self.decoder.get_stats()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._hub._release(self)
+
+
+class IngestHub:
+    """按RTSP地址管理共享解码器与订阅引用计数"""
+
+    def __init__(self, mode=INGEST_DECODER, idle_seconds=INGEST_IDLE_SECONDS):
+        self.mode = mode
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._sources = {}  # rtsp_url -> {'decoder', 'subscribers': {id: consumer}, 'idle_timer'}
+
+    def subscribe(self, rtsp_url, consumer='unknown'):
+        """订阅一路流，必要时启动解码器；consumer 仅用于统计展示"""
+        with self._lock:
+            source = self._sources.get(rtsp_url)
+            if source is not None and not source['decoder'].alive:
+                source['decoder'].stop()
+                source = None
+            if source is None:
+                decoder = CameraDecoder(rtsp_url, mode=self.mode, label=mask_credentials(rtsp_url)).start()
+                source = self._sources[rtsp_url] = {'decoder': decoder, 'subscribers': {}, 'idle_timer': None}
+
+            if source['idle_timer'] is not None:
+                source['idle_timer'].cancel()
+                source['idle_timer'] = None
+
+            subscription = Subscription(self, rtsp_url, source['decoder'], consumer)
+            source['subscribers'][id(subscription)] = consumer
+            logger.info(f"{consumer} 订阅 {mask_credentials(rtsp_url)}（当前订阅数 {len(source['subscribers'])}）")
+            return subscription
+
+    def _release(self, subscription):
+        with self._lock:
+            source = self._sources.get(subscription.key)
+            if source is None or source['decoder'] is not subscription.decoder:
+                return
+            source['subscribers'].pop(id(subscription), None)
+            logger.info(f"{subscription.consumer} 退订 {mask_credentials(subscription.key)}（剩余订阅数 {len(source['subscribers'])}）")
+            if source['subscribers']:
+                return
+
+            if self.idle_seconds > 0:
+                timer = threading.Timer(self.idle_seconds, self._close_if_idle, args=(subscription.key, source['decoder']))
+                timer.daemon = True
+                source['idle_timer'] = timer
+                timer.start()
+            else:
+                self._close(subscription.key)
+
+    def _close_if_idle(self, key, decoder):
+        with self._lock:
+            source = self._sources.get(key)
+            if source is not None and source['decoder'] is decoder and not source['subscribers']:
+                self._close(key)
+
+    def _close(self, key):
+        source = self._sources.pop(key)
+        source['decoder'].stop()
+        logger.info(f"{mask_credentials(key)} 已无订阅者，关闭连接")
+
+    def get_stats(self):
+        """各路流的解码状态与订阅者"""
+        with self._lock:
+            return {
+                mask_credentials(key): dict(
+                    source['decoder'].get_stats(),
+                    subscribers=sorted(source['subscribers'].values()),
+                    idle=not source['subscribers'],
+                )
+                for key, source in self._sources.items()
+            }
+
+
+# 全局实例
+ingest_hub = IngestHub()
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ops', '0004_alter_camera_options_alter_dog_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='camera',
+            name='roi_config',
+            field=models.JSONField(blank=True, null=True, verbose_name='检测区域配置'),
+        ),
+    ]
@@ -0,0 +1,248 @@
+"""
+MJPEG广播器
+每路摄像头每个画面档位只有一个取帧线程：从接入中心订阅、每帧只编码一次，
+再把multipart分片推送给所有已连接的 StreamingHttpResponse 生成器。
+- 每个客户端一个有界队列，队列满时丢弃最旧的帧，慢客户端不会拖慢其他客户端
+- 最后一个客户端断开后经过空闲宽限期才停止取帧线程并退订
+"""
+import os
+import queue
+import threading
+import time
+import logging
+
+import cv2
+import numpy as np
+
+from .ingest_hub import ingest_hub
+from .camera_decoder import parse_rendition
+
+logger = logging.getLogger(__name__)
+
+MJPEG_FPS = float(os.environ.get('MJPEG_FPS', 10))  # 推送帧率上限
+MJPEG_RENDITION = os.environ.get('MJPEG_RENDITION', 'preview')  # 客户端未指定时的画面档位
+MJPEG_CLIENT_QUEUE = int(os.environ.get('MJPEG_CLIENT_QUEUE', 2))  # 每个客户端最多缓存的帧数
+MJPEG_IDLE_SECONDS = float(os.environ.get('MJPEG_IDLE_SECONDS', 10))  # 无客户端后保持取帧的时长
+
+MJPEG_BOUNDARY = 'frame'
+
+
+def multipart_chunk(jpeg):
+    """把一帧JPEG封装为multipart分片"""
+    return (b'--' + MJPEG_BOUNDARY.encode() + b'\r\n'
+            b'Content-Type: image/jpeg\r\n'
+            b'Content-Length: ' + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+
+
+_placeholder_chunk = None
+
+
+def placeholder_chunk():
+    """无信号占位帧的multipart分片（只生成一次）"""
+    global _placeholder_chunk
+    if _placeholder_chunk is None:
+        placeholder = np.full((120, 160, 3), 50, dtype=np.uint8)
+        cv2.putText(placeholder, 'No Signal', (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+        _, buffer = cv2.imencode('.jpg', placeholder, [cv2.IMWRITE_JPEG_QUALITY, 50])
+        _placeholder_chunk = multipart_chunk(buffer.tobytes())
+    return _placeholder_chunk
+
+
+class MJPEGClient:
+    """一个已连接的HTTP客户端"""
+
+    def __init__(self, channel, name, maxsize=MJPEG_CLIENT_QUEUE):
+        self.channel = channel
+        self.name = name
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.connected_at = time.time()
+        self.sent = 0
+        self.dropped = 0
+
+    def offer(self, chunk):
+        """非阻塞入队，队列满时丢弃最旧的一帧"""
+        while True:
+            try:
+                self.queue.put_nowait(chunk)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def stream(self, timeout=5.0):
+        """供 StreamingHttpResponse 使用的生成器，客户端断开时生成器被关闭并自动注销
+
+        超时没有新帧（摄像头卡住或离线）时重发最近一帧或占位帧：
+        客户端断开只有在写出时才能发现，否则已离开的客户端永远不会注销，通道也就无法空闲回收
+        """
+        try:
+            while True:
+                try:
+                    chunk = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    yield self.channel.last_chunk or placeholder_chunk()
+                    continue
+                if chunk is None:  # 广播器已停止
+                    return
+                self.sent += 1
+                yield chunk
+        finally:
+            self.channel.remove_client(self)
+
+
+class MJPEGChannel:
+    """单路摄像头的广播通道"""
+
+    def __init__(self, broadcaster, camera_id, rtsp_url, rendition):
+        self.broadcaster = broadcaster
+        self.camera_id = camera_id
+        self.rtsp_url = rtsp_url
+        self.rendition = rendition
+        self._lock = threading.Lock()
+        self._clients = []
+        self._idle_since = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.frames_sent = 0
+        self.last_chunk = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'mjpeg-{self.camera_id}-{self.rendition}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._stop_event.set()
+            clients, self._clients = self._clients, []
+        for client in clients:
+            client.offer(None)
+
+    def add_client(self, name):
+        """注册客户端；通道已停止（例如刚刚空闲超时）时返回None"""
+        client = MJPEGClient(self, name)
+        with self._lock:
+            if self._stop_event.is_set():
+                return None
+            self._clients.append(client)
+            self._idle_since = None
+            # 新客户端立即拿到最近一帧，不必等下一帧
+            if self.last_chunk is not None:
+                client.offer(self.last_chunk)
+        logger.info(f"MJPEG客户端 {name} 连接摄像头 {self.camera_id}（当前 {len(self._clients)} 个）")
+        return client
+
+    def remove_client(self, client):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+                if not self._clients:
+                    self._idle_since = time.monotonic()
+            remaining = len(self._clients)
+        logger.info(f"MJPEG客户端 {client.name} 断开摄像头 {self.camera_id}（剩余 {remaining} 个）")
+
+    def _idle_expired(self):
+        """空闲超时则在锁内标记停止，之后不再接受新客户端"""
+        with self._lock:
+            expired = (not self._clients and self._idle_since is not None
+                       and time.monotonic() - self._idle_since >= self.broadcaster.idle_seconds)
+            if expired:
+                self._stop_event.set()
+            return expired
+
+    def _run(self):
+        frame_interval = 1.0 / self.broadcaster.fps if self.broadcaster.fps > 0 else 0
+        subscription = ingest_hub.subscribe(self.rtsp_url, f'mjpeg:{self.camera_id}')
+        try:
+            while not self._stop_event.is_set():
+                if self._idle_expired():
+                    logger.info(f"摄像头 {self.camera_id} 的MJPEG广播空闲超时，停止")
+                    break
+
+                started = time.monotonic()
+                frame = subscription.next_frame(timeout=1.0)
+                if frame is None:
+                    continue
+                jpeg = frame.rendition(self.rendition)
+                if not jpeg:
+                    continue
+
+                chunk = multipart_chunk(jpeg)
+                with self._lock:
+                    self.last_chunk = chunk
+                    clients = list(self._clients)
+                for client in clients:
+                    client.offer(chunk)
+                self.frames_sent += 1
+
+                elapsed = time.monotonic() - started
+                if elapsed < frame_interval:
+                    self._stop_event.wait(frame_interval - elapsed)
+        except Exception as e:
+            logger.error(f"摄像头 {self.camera_id} 的MJPEG广播异常: {str(e)}")
+        finally:
+            subscription.close()
+            self.broadcaster._discard(self)
+            self.stop()
+
+    def get_stats(self):
+        with self._lock:
+            clients = list(self._clients)
+        return {
+            'frames_sent': self.frames_sent,
+            'clients': [
+                {'name': c.name, 'sent': c.sent, 'dropped': c.dropped, 'queued': c.queue.qsize()}
+                for c in clients
+            ],
+        }
+
+
+class MJPEGBroadcaster:
+    """按摄像头管理广播通道"""
+
+    def __init__(self, fps=MJPEG_FPS, default_rendition=MJPEG_RENDITION, idle_seconds=MJPEG_IDLE_SECONDS):
+        self.fps = fps
+        self.default_rendition = parse_rendition(default_rendition, 'preview')
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def connect(self, camera_id, rtsp_url, name='unknown', rendition=None):
+        """为一个HTTP客户端注册并返回 MJPEGClient，调用方使用 client.stream() 输出；同摄像头同档位的客户端共用通道"""
+        rendition = parse_rendition(rendition, self.default_rendition)
+        key = (camera_id, rendition)
+        with self._lock:
+            channel = self._channels.get(key)
+            client = None
+            if channel is not None and channel.rtsp_url == rtsp_url:
+                client = channel.add_client(name)
+            if client is None:
+                if channel is not None:
+                    channel.stop()
+                channel = self._channels[key] = MJPEGChannel(self, camera_id, rtsp_url, rendition).start()
+                client = channel.add_client(name)
+            return client
+
+    def _discard(self, channel):
+        with self._lock:
+            key = (channel.camera_id, channel.rendition)
+            if self._channels.get(key) is channel:
+                del self._channels[key]
+
+    def stop_all(self):
+        with self._lock:
+            channels, self._channels = list(self._channels.values()), {}
+        for channel in channels:
+            channel.stop()
+
+    def get_stats(self):
+        with self._lock:
+            channels = dict(self._channels)
+        return {f'{camera_id}:{rendition}': channel.get_stats() for (camera_id, rendition), channel in channels.items()}
+
+
+# 全局实例
+mjpeg_broadcaster = MJPEGBroadcaster()
@@ -0,0 +1,102 @@
+"""
+MJPEG分帧器
+从FFmpeg image2pipe / mjpeg 输出中切分JPEG帧：
+- 每次读取一大块数据到预分配的 bytearray（readinto，不产生中间bytes对象）
+- 从上次扫描位置继续查找 SOI/EOI 标记，不重复扫描已检查过的数据
+- 完整帧以 memoryview 切片返回，不复制；视图在下一次读取前有效，需要保留时调用 bytes(view)
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+
+
+class MJPEGDemuxer:
+    """增量式MJPEG分帧器"""
+
+    def __init__(self, stream, chunk_size=65536, initial_capacity=1024 * 1024, max_frame_size=10 * 1024 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_frame_size = max_frame_size  # 单帧超过该大小视为数据损坏并丢弃
+        self._buf = bytearray(max(initial_capacity, chunk_size * 2))
+        self._view = memoryview(self._buf)
+        self._len = 0  # 缓冲区中有效数据长度
+        self._pos = 0  # 下一次扫描的起始位置
+        self._frame_start = -1  # 当前未完成帧的起始位置
+        self._readinto = getattr(stream, 'readinto1', None) or stream.readinto
+        self.frames = 0
+        self.bytes_read = 0
+        self.dropped = 0
+
+    def _ensure_space(self):
+        """保证缓冲区尾部至少有 chunk_size 的空闲空间：先丢弃已处理数据，不够再扩容"""
+        if len(self._buf) - self._len >= self.chunk_size:
+            return
+
+        # 只保留未完成的帧（没有未完成帧时保留最后1字节，以防标记被分块截断）
+        keep_from = self._frame_start if self._frame_start >= 0 else max(0, self._len - 1)
+        if keep_from > 0:
+            remaining = self._len - keep_from
+            # 源与目标区域重叠，先取出未完成部分（通常远小于缓冲区）
+            self._buf[:remaining] = bytes(self._view[keep_from:self._len])
+            self._len = remaining
+            self._pos = max(self._pos - keep_from, 0)
+            if self._frame_start >= 0:
+                self._frame_start -= keep_from
+
+        if len(self._buf) - self._len < self.chunk_size:
+            # 已导出的memoryview不允许原地扩容，分配新缓冲区
+            new_buf = bytearray(len(self._buf) * 2)
+            new_buf[:self._len] = self._view[:self._len]
+            self._buf = new_buf
+            self._view = memoryview(new_buf)
+
+    def read(self):
+        """读取一块数据并返回其中所有完整帧的视图列表；流结束时返回None"""
+        self._ensure_space()
+        n = self._readinto(self._view[self._len:self._len + self.chunk_size])
+        if not n:
+            return None
+        self._len += n
+        self.bytes_read += n
+        return self._scan()
+
+    def _scan(self):
+        frames = []
+        buf = self._buf
+        while True:
+            if self._frame_start < 0:
+                start = buf.find(JPEG_SOI, self._pos, self._len)
+                if start == -1:
+                    self._pos = max(self._pos, self._len - 1)
+                    break
+                self._frame_start = start
+                self._pos = start + 2
+
+            end = buf.find(JPEG_EOI, self._pos, self._len)
+            if end == -1:
+                if self._len - self._frame_start > self.max_frame_size:
+                    logger.warning(f"MJPEG帧超过 {self.max_frame_size} 字节，丢弃")
+                    self.dropped += 1
+                    self._frame_start = -1
+                    self._pos = self._len - 1
+                else:
+                    # 标记可能被分块截断，下次从倒数第1字节继续
+                    self._pos = max(self._pos, self._len - 1)
+                break
+
+            frames.append(self._view[self._frame_start:end + 2])
+            self.frames += 1
+            self._frame_start = -1
+            self._pos = end + 2
+        return frames
+
+    def __iter__(self):
+        """逐帧迭代直到流结束"""
+        while True:
+            frames = self.read()
+            if frames is None:
+                return
+            yield from frames
@@ -470,6 +470,8 @@ class Camera(models.Model):
     resolution = models.CharField(max_length=20, default='1920x1080', verbose_name="分辨率")
     fps = models.IntegerField(default=25, verbose_name="帧率")
     description = models.TextField(blank=True, null=True, verbose_name="描述")
+    # 按检测器配置的检测区域：{"cross": [[[x, y], ...], ...], "rubbish": [...]}，坐标为0~1的归一化值
+    roi_config = models.JSONField(blank=True, null=True, verbose_name="检测区域配置")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
     
@@ -0,0 +1,104 @@
+"""
+运动门控
+按摄像头保存上一次送检帧的缩略灰度图，新帧与其差分：
+画面无明显变化时跳过YOLO推理，指定的检测器（如烟火）始终运行
+"""
+import os
+import time
+import threading
+import logging
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MotionGate:
+    """基于缩略图帧差的场景变化门控"""
+
+    def __init__(self, enabled=None, change_ratio=None, pixel_threshold=25,
+                 size=(64, 36), always_run=None, max_skip_seconds=300):
+        if enabled is None:
+            enabled = os.environ.get('MOTION_GATE_ENABLED', '1') == '1'
+        if change_ratio is None:
+            change_ratio = float(os.environ.get('MOTION_GATE_RATIO', 0.01))
+        if always_run is None:
+            always_run = os.environ.get('MOTION_ALWAYS_RUN', 'firesmoke').split(',')
+
+        self.enabled = enabled
+        self.change_ratio = change_ratio  # 变化像素占比达到该值视为有变化
+        self.pixel_threshold = pixel_threshold  # 单像素灰度差阈值
+        self.size = size  # 差分使用的缩略图尺寸 (宽, 高)
+        self.always_run = {name.strip() for name in always_run if name.strip()}
+        self.max_skip_seconds = max_skip_seconds  # 连续跳过的最长时间，超过后强制送检一次
+        self._lock = threading.Lock()
+        self._cameras = {}
+
+    def _thumbnail(self, frame):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(gray, (3, 3), 0)
+
+    def select_detectors(self, camera_id, frame, detectors):
+        """返回本帧需要运行的检测器；画面有变化时更新参考帧"""
+        if not self.enabled:
+            return list(detectors)
+
+        thumb = self._thumbnail(frame)
+        now = time.time()
+        with self._lock:
+            state = self._cameras.setdefault(camera_id, {
+                'reference': None,
+                'reference_time': 0,
+                'checked': 0,
+                'analyzed': 0,
+                'last_change_ratio': None,
+                'detectors': {},
+            })
+            state['checked'] += 1
+
+            if state['reference'] is None or now - state['reference_time'] >= self.max_skip_seconds:
+                changed = True
+            else:
+                diff = cv2.absdiff(thumb, state['reference'])
+                ratio = float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+                state['last_change_ratio'] = ratio
+                changed = ratio >= self.change_ratio
+
+            if changed:
+                state['reference'] = thumb
+                state['reference_time'] = now
+                state['analyzed'] += 1
+
+            selected = [name for name in detectors if changed or name in self.always_run]
+            for name in detectors:
+                counts = state['detectors'].setdefault(name, {'run': 0, 'skipped': 0})
+                counts['run' if name in selected else 'skipped'] += 1
+
+        if not changed:
+            logger.debug(f"摄像头 {camera_id} 画面无变化，跳过: {[n for n in detectors if n not in selected]}")
+        return selected
+
+    def reset(self, camera_id):
+        with self._lock:
+            self._cameras.pop(camera_id, None)
+
+    def get_stats(self):
+        """各摄像头的跳过比例"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'change_ratio': self.change_ratio,
+                'always_run': sorted(self.always_run),
+                'cameras': {
+                    camera_id: {
+                        'checked': state['checked'],
+                        'analyzed': state['analyzed'],
+                        'skip_ratio': 1 - state['analyzed'] / state['checked'] if state['checked'] else 0,
+                        'last_change_ratio': state['last_change_ratio'],
+                        'detectors': {name: dict(counts) for name, counts in state['detectors'].items()},
+                    }
+                    for camera_id, state in self._cameras.items()
+                }
+            }
@@ -1,27 +1,82 @@
 import os
 import threading
 import time
-from typing import Dict, Optional
+from collections import deque
+from typing import Deque, Dict, Optional
 
-import cv2
+from .ingest_hub import ingest_hub
+
+FRAME_RING_SIZE = int(os.environ.get('RTSP_FRAME_RING_SIZE', 20))
+
+# Delivery tiers, best first: (jpeg quality, max width, max fps). Lagging clients are stepped down.
+QUALITY_TIERS = [
+    (80, 1280, 20),
+    (65, 960, 10),
+    (50, 640, 5),
+]
+
+
+class RingFrame:
+    """
+    One entry of the in-memory ring.
+    JPEGs are encoded lazily per tier; only the newest entries keep their decoded image,
+    older entries can only serve tiers that were already encoded.
+    """
+    __slots__ = ('seq', 'ts_ms', '_decoded', '_jpegs', '_lock')
+
+    def __init__(self, seq: int, ts_ms: int, decoded):
+        self.seq = seq
+        self.ts_ms = ts_ms
+        self._decoded = decoded
+        self._jpegs: Dict[int, bytes] = {}
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            self._decoded = None
+
+    def jpeg(self, tier: int = 0) -> Optional[bytes]:
+        """JPEG bytes for the tier (clamped to the valid range), encoded at most once."""
+        tier = max(0, min(tier, len(QUALITY_TIERS) - 1))
+        with self._lock:
+            data = self._jpegs.get(tier)
+            decoded = self._decoded
+        if data is not None:
+            return data
+        if decoded is None:
+            # Image already released: fall back to the closest tier that was encoded
+            with self._lock:
+                if not self._jpegs:
+                    return None
+                return self._jpegs[min(self._jpegs, key=lambda t: abs(t - tier))]
+        quality, max_width, _ = QUALITY_TIERS[tier]
+        try:
+            data = decoded.jpeg(quality=quality, max_width=max_width)
+        except Exception:
+            data = None
+        if data:
+            with self._lock:
+                data = self._jpegs.setdefault(tier, data)
+        return data
 
 
 class FrameStreamer:
     """
-    Per-robot RTSP frame streamer using OpenCV.
-    - Reads frames from RTSP.
-    - Saves into a ring buffer of 20 JPEG files under media/rtsp_frames/<robotId>/.
-    - Notifies a callback per frame with the public URL.
+    Per-robot RTSP frame streamer.
+    - Takes frames from the shared ingest hub (one RTSP session per camera).
+    - Keeps the last FRAME_RING_SIZE frames per robot in an in-memory ring (nothing is written to disk).
+    - Notifies a callback only when a new frame was decoded; repeated frames are never re-sent or re-encoded.
     """
 
-    def __init__(self, media_root: str, on_frame_cb):
-        self.media_root = media_root
-        self.on_frame_cb = on_frame_cb  # callable(robot_id: str, url: str, ts_ms: int)
+    def __init__(self, on_frame_cb, ring_size: int = FRAME_RING_SIZE):
+        self.on_frame_cb = on_frame_cb  # callable(robot_id: str, frame: RingFrame)
+        self.ring_size = ring_size
         self._lock = threading.Lock()
         self._workers: Dict[str, threading.Thread] = {}
         self._stops: Dict[str, threading.Event] = {}
         self._subscribers: Dict[str, int] = {}
         self._rtsp_urls: Dict[str, str] = {}
+        self._rings: Dict[str, Deque[RingFrame]] = {}
 
     def ensure_started(self, robot_id: str, rtsp_url: str):
         with self._lock:
@@ -44,83 +99,63 @@ class FrameStreamer:
                     if robot_id in self._stops:
                         self._stops[robot_id].set()
 
+    def get_frame(self, robot_id: str, seq: Optional[int] = None) -> Optional[RingFrame]:
+        """Return a frame from the ring; the newest frame when seq is None."""
+        with self._lock:
+            ring = self._rings.get(robot_id)
+            if not ring:
+                return None
+            if seq is None:
+                return ring[-1]
+            for item in reversed(ring):
+                if item.seq == seq:
+                    return item
+        return None
+
+    def _push(self, robot_id: str, frame: RingFrame):
+        with self._lock:
+            ring = self._rings.get(robot_id)
+            if ring is None:
+                ring = self._rings[robot_id] = deque(maxlen=self.ring_size)
+            ring.append(frame)
+            stale = ring[-3] if len(ring) >= 3 else None
+        if stale is not None:
+            # Only the two newest frames hold on to their decoded image (an emit may still be encoding the previous one)
+            stale.release()
+
     def _run_stream(self, robot_id: str, stop_evt: threading.Event):
         rtsp_url = self._rtsp_urls.get(robot_id)
         if not rtsp_url:
             return
 
-        # Prepare directory
-        out_dir = os.path.join(self.media_root, 'rtsp_frames', robot_id)
-        os.makedirs(out_dir, exist_ok=True)
-
-        cap: Optional[cv2.VideoCapture] = None
-        frame_idx = 0
-        last_frame = None
-        target_interval_ms = 50  # ~20 fps
-
-        def open_capture() -> Optional[cv2.VideoCapture]:
-            try:
-                return cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
-            except Exception:
-                return cv2.VideoCapture(rtsp_url)
+        # Frames come from the shared ingest hub, so this worker does not open its own RTSP session
+        subscription = ingest_hub.subscribe(rtsp_url, f'socket:{robot_id}')
+        seq = 0
+        min_interval = 1.0 / QUALITY_TIERS[0][2]
 
-        backoff_ms = 500
         while not stop_evt.is_set():
-            if cap is None or not cap.isOpened():
-                cap = open_capture()
-                if cap is None or not cap.isOpened():
-                    time.sleep(backoff_ms / 1000.0)
-                    backoff_ms = min(backoff_ms * 2, 10000)
-                    continue
-                backoff_ms = 500
-
-            start_ms = int(time.time() * 1000)
-            ret, frame = cap.read()
-            if not ret or frame is None:
-                # Repeat last frame to maintain cadence
-                if last_frame is None:
-                    time.sleep(target_interval_ms / 1000.0)
-                    continue
-                img = last_frame
-            else:
-                img = frame
-                last_frame = frame
-
-            # Optional resize for performance: clamp width to 1280
+            started = time.monotonic()
+            decoded = subscription.next_frame(timeout=1.0)
+            if decoded is None:
+                # No new frame: nothing to send, clients keep showing the last one
+                continue
+
+            seq += 1
+            frame = RingFrame(seq, int(time.time() * 1000), decoded)
+            self._push(robot_id, frame)
             try:
-                h, w = img.shape[:2]
-                if w > 1280:
-                    scale = 1280 / float(w)
-                    img = cv2.resize(img, (int(w * scale), int(h * scale)))
+                self.on_frame_cb(robot_id, frame)
             except Exception:
+                # Keep streaming even if a notification fails
                 pass
 
-            # Encode JPEG with quality 80
-            try:
-                ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 80])
-                if ok:
-                    fname = f'frame_{frame_idx % 20}.jpg'
-                    fpath = os.path.join(out_dir, fname)
-                    with open(fpath, 'wb') as f:
-                        f.write(buf.tobytes())
-                    ts_ms = int(time.time() * 1000)
-                    # Construct public URL under /media
-                    url = f'/media/rtsp_frames/{robot_id}/{fname}?t={ts_ms}'
-                    self.on_frame_cb(robot_id, url, ts_ms)
-                    frame_idx += 1
-            except Exception:
-                # Silently skip encoding errors
-                pass
-
-            # pacing
-            elapsed_ms = int(time.time() * 1000) - start_ms
-            sleep_ms = max(0, target_interval_ms - elapsed_ms)
-            if sleep_ms > 0:
-                time.sleep(sleep_ms / 1000.0)
+            # pacing: never faster than the best tier
+            elapsed = time.monotonic() - started
+            if elapsed < min_interval:
+                stop_evt.wait(min_interval - elapsed)
 
         # Cleanup
-        try:
-            if cap is not None:
-                cap.release()
-        except Exception:
-            pass
\ No newline at end of file
+        subscription.close()
+        with self._lock:
+            if self._stops.get(robot_id) is stop_evt:
+                self._rings.pop(robot_id, None)
@@ -1,19 +1,19 @@
 """
 RTSP代理服务
-将RTSP流转换为HTTP流，供前端播放
+将RTSP流转换为HTTP流，供前端播放；帧来自接入中心的共享解码器
 """
-import cv2
-import threading
 import time
 import logging
 from django.http import StreamingHttpResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
+from .ingest_hub import ingest_hub
+
 logger = logging.getLogger(__name__)
 
 class RTSPProxy:
-    """RTSP代理"""
+    """RTSP代理（接入中心的订阅者）"""
     
     def __init__(self):
         self.cameras = {}
@@ -22,38 +22,11 @@ class RTSPProxy:
     def start_camera_stream(self, camera_id, rtsp_url):
         """启动摄像头流"""
         try:
-            cap = cv2.VideoCapture(rtsp_url)
-            
-            # 设置RTSP连接参数
-            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-            cap.set(cv2.CAP_PROP_FPS, 10)  # 设置帧率
-            cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)  # 降低分辨率
-            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-            
-            # 设置超时时间（30秒）
-            cap.set(cv2.CAP_PROP_TIMEOUT, 30000)
-            
-            if not cap.isOpened():
-                logger.error(f"无法打开摄像头 {camera_id} 的RTSP流")
-                return False
-            
             self.cameras[camera_id] = {
-                'cap': cap,
+                'subscription': ingest_hub.subscribe(rtsp_url, f'proxy:{camera_id}'),
                 'rtsp_url': rtsp_url,
-                'last_frame': None,
-                'last_time': 0,
-                'frame_count': 0,
-                'error_count': 0
             }
             
-            # 启动读取线程
-            thread = threading.Thread(
-                target=self._read_frames,
-                args=(camera_id,),
-                daemon=True
-            )
-            thread.start()
-            
             logger.info(f"启动摄像头 {camera_id} 的流代理")
             return True
             
@@ -61,88 +34,47 @@ class RTSPProxy:
             logger.error(f"启动摄像头 {camera_id} 流代理失败: {str(e)}")
             return False
     
-    def _read_frames(self, camera_id):
-        """读取视频帧"""
-        while camera_id in self.cameras:
-            try:
-                camera = self.cameras[camera_id]
-                cap = camera['cap']
-                
-                ret, frame = cap.read()
-                if ret:
-                    camera['frame_count'] += 1
-                    camera['error_count'] = 0  # 重置错误计数
-                    
-                    # 编码为JPEG，降低质量以减少传输量
-                    _, buffer = cv2.imencode('.jpg', frame, [
-                        cv2.IMWRITE_JPEG_QUALITY, 60,
-                        cv2.IMWRITE_JPEG_OPTIMIZE, 1
-                    ])
-                    camera['last_frame'] = buffer.tobytes()
-                    camera['last_time'] = time.time()
-                else:
-                    camera['error_count'] += 1
-                    if camera['error_count'] > 5:  # 减少重连阈值
-                        logger.warning(f"摄像头 {camera_id} 连续读取失败，尝试重新连接")
-                        # 重新连接
-                        cap.release()
-                        time.sleep(2)  # 等待2秒再重连
-                        cap = cv2.VideoCapture(camera['rtsp_url'])
-                        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-                        cap.set(cv2.CAP_PROP_FPS, 10)
-                        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-                        cap.set(cv2.CAP_PROP_TIMEOUT, 30000)
-                        camera['cap'] = cap
-                        camera['error_count'] = 0
-                    time.sleep(0.2)  # 增加等待时间
-                    
-            except Exception as e:
-                camera['error_count'] += 1
-                logger.error(f"摄像头 {camera_id} 读取帧异常: {str(e)}")
-                if camera['error_count'] > 5:
-                    time.sleep(2)
-                else:
-                    time.sleep(0.5)
-    
     def get_frame(self, camera_id):
         """获取最新帧"""
         if camera_id in self.cameras:
-            camera = self.cameras[camera_id]
-            # 检查帧是否新鲜（5秒内）
-            if camera['last_frame'] and time.time() - camera['last_time'] < 5:
-                return camera['last_frame']
+            subscription = self.cameras[camera_id]['subscription']
+            # 检查帧是否新鲜（5秒内），降低质量以减少传输量
+            frame = subscription.latest(max_age=5)
+            if frame is not None:
+                return frame.jpeg(quality=60)
             # 如果帧太旧，返回None
-            elif time.time() - camera['last_time'] > 10:
+            last_frame = subscription.latest(max_age=None)
+            if last_frame is not None and last_frame.age > 10:
                 logger.warning(f"摄像头 {camera_id} 帧数据过期")
         return None
     
     def get_camera_status(self, camera_id):
         """获取摄像头状态"""
         if camera_id in self.cameras:
-            camera = self.cameras[camera_id]
+            subscription = self.cameras[camera_id]['subscription']
+            stats = subscription.get_stats()
+            last_frame = subscription.latest(max_age=None)
             current_time = time.time()
-            last_frame_time = camera.get('last_time', 0)
+            last_frame_time = last_frame.timestamp if last_frame else 0
             
             return {
-                'connected': True,
-                'frame_count': camera.get('frame_count', 0),
-                'error_count': camera.get('error_count', 0),
+                'connected': stats['connected'],
+                'frame_count': stats['frames_decoded'],
+                'error_count': stats['reconnects'],
                 'last_frame_time': last_frame_time,
                 'is_active': current_time - last_frame_time < 10,  # 10秒内活跃
                 'time_since_last_frame': current_time - last_frame_time,
-                'health_score': max(0, 100 - camera.get('error_count', 0) * 10)
+                'health_score': max(0, 100 - stats['reconnects'] * 10)
             }
         return {'connected': False}
     
     def health_check(self):
         """健康检查，清理不活跃的摄像头"""
-        current_time = time.time()
         to_remove = []
         
         for camera_id, camera in self.cameras.items():
-            last_frame_time = camera.get('last_time', 0)
-            if current_time - last_frame_time > 60:  # 1分钟无活动
+            last_frame = camera['subscription'].latest(max_age=None)
+            if last_frame is None or last_frame.age > 60:  # 1分钟无活动
                 logger.warning(f"摄像头 {camera_id} 超过1分钟无活动，准备清理")
                 to_remove.append(camera_id)
         
@@ -151,10 +83,9 @@ class RTSPProxy:
     
     def stop_camera_stream(self, camera_id):
         """停止摄像头流"""
-        if camera_id in self.cameras:
-            camera = self.cameras[camera_id]
-            camera['cap'].release()
-            del self.cameras[camera_id]
+        camera = self.cameras.pop(camera_id, None)
+        if camera is not None:
+            camera['subscription'].close()
             logger.info(f"停止摄像头 {camera_id} 的流代理")
 
 # 全局代理实例
@@ -172,14 +103,14 @@ def generate_frames(camera_id):
             if frame:
                 yield (b'--frame\r\n'
                        b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-                last_frame_time = current_time
             else:
                 # 发送占位帧
                 placeholder = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x01\x00H\x00H\x00\x00\xff\xdb\x00C\x00\x08\x06\x06\x07\x06\x05\x08\x07\x07\x07\t\t\x08\n\x0c\x14\r\x0c\x0b\x0b\x0c\x19\x12\x13\x0f\x14\x1d\x1a\x1f\x1e\x1d\x1a\x1c\x1c $.\' ",#\x1c\x1c(7),01444\x1f\'9=82<.342\xff\xc0\x00\x11\x08\x00\x01\x00\x01\x01\x01\x11\x00\x02\x11\x01\x03\x11\x01\xff\xc4\x00\x14\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x08\xff\xc4\x00\x14\x10\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xda\x00\x0c\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00\xaa\xff\xd9'
                 yield (b'--frame\r\n'
                        b'Content-Type: image/jpeg\r\n\r\n' + placeholder + b'\r\n')
+            last_frame_time = current_time
         else:
-            time.sleep(0.01)  # 短暂休眠
+            time.sleep(frame_interval - (current_time - last_frame_time))  # 等到下一帧的发送时间
 
 @csrf_exempt
 @require_http_methods(["GET"])
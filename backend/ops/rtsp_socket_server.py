@@ -1,16 +1,26 @@
 import os
 import asyncio
-from typing import Dict, Optional
+import json
+from typing import Dict, Optional, Set
+from urllib.parse import unquote, parse_qs
 
 import socketio
-from .rtsp_frames_streamer import FrameStreamer
+from .rtsp_frames_streamer import FrameStreamer, RingFrame, QUALITY_TIERS
 
 
-MEDIA_ROOT = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'media')
+# Base URL for the in-memory frame handler; by default derived from the Host header of each socket connection
+FRAME_BASE_URL = os.environ.get('RTSP_FRAME_BASE_URL', '').rstrip('/')
+FRAME_PATH_PREFIX = '/rtsp_frames/'
+
+# Delivery lag (emit -> client ack, seconds) that steps a client down / up one quality tier
+LAG_STEP_DOWN = float(os.environ.get('RTSP_FRAME_LAG_DOWN', 0.5))
+LAG_STEP_UP = float(os.environ.get('RTSP_FRAME_LAG_UP', 0.15))
+ACK_TIMEOUT = 5.0
+STEP_UP_AFTER = 20  # consecutive fast deliveries before trying a better tier
+TIER_CHANGE_COOLDOWN = 2.0
 
 # Socket.IO server (ASGI)
 sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
-app = socketio.ASGIApp(sio)
 
 # Keep a map of latest frame ts to throttle if needed
 latest_ts: Dict[str, int] = {}
@@ -19,31 +29,245 @@ latest_ts: Dict[str, int] = {}
 sio_loop: Optional[asyncio.AbstractEventLoop] = None
 
 
-def _on_frame(robot_id: str, url: str, ts_ms: int):
-    """Thread-safe emit from OpenCV background thread to ASGI loop."""
+def _frame_url(base_url: str, robot_id: str, seq: int, tier: int = 0) -> str:
+    url = f'{base_url}{FRAME_PATH_PREFIX}{robot_id}/{seq}.jpg'
+    return f'{url}?tier={tier}' if tier else url
+
+
+class ClientState:
+    """Delivery state of one socket.io client."""
+
+    def __init__(self, sid: str, base_url: str):
+        self.sid = sid
+        self.base_url = base_url
+        self.robot_id: Optional[str] = None
+        self.binary = False
+        self.ack = False
+        self.tier = 0
+        self.lag = 0.0  # smoothed delivery lag in seconds (only measured for ack clients)
+        self.pending: Optional[RingFrame] = None
+        self.sending = False
+        self.last_sent = 0.0
+        self.tier_changed = 0.0
+        self.fast_streak = 0
+        self.sent = 0
+        self.coalesced = 0
+
+
+class FrameEmitter:
+    """
+    Latest-frame-wins delivery, one outstanding frame per client:
+    - a new frame replaces the client's pending one instead of queueing another emit
+    - each client is paced by its own tier's fps
+    - for clients that ack frames, the emit->ack lag steps fps/quality down when it grows and back up when it recovers
+    All methods run on the ASGI event loop.
+    """
+
+    def __init__(self):
+        self.clients: Dict[str, ClientState] = {}
+        self.robot_sids: Dict[str, Set[str]] = {}
+
+    def connect(self, sid: str, base_url: str):
+        self.clients[sid] = ClientState(sid, base_url)
+
+    def subscribe(self, sid: str, robot_id: str, binary: bool, ack: bool):
+        client = self.clients.get(sid)
+        if client is None:
+            client = self.clients[sid] = ClientState(sid, FRAME_BASE_URL)
+        if client.robot_id and client.robot_id != robot_id:
+            self.robot_sids.get(client.robot_id, set()).discard(sid)
+        client.robot_id = robot_id
+        client.binary = binary
+        client.ack = ack
+        self.robot_sids.setdefault(robot_id, set()).add(sid)
+
+    def unsubscribe(self, sid: str, robot_id: str):
+        self.robot_sids.get(robot_id, set()).discard(sid)
+        client = self.clients.get(sid)
+        if client is not None and client.robot_id == robot_id:
+            client.robot_id = None
+            client.pending = None
+
+    def disconnect(self, sid: str):
+        client = self.clients.pop(sid, None)
+        if client is not None and client.robot_id:
+            self.robot_sids.get(client.robot_id, set()).discard(sid)
+
+    def has_listeners(self, robot_id: str) -> bool:
+        return bool(self.robot_sids.get(robot_id))
+
+    def publish(self, robot_id: str, frame: RingFrame):
+        for sid in list(self.robot_sids.get(robot_id, ())):
+            client = self.clients.get(sid)
+            if client is None:
+                continue
+            if client.pending is not None:
+                client.coalesced += 1
+            client.pending = frame
+            if not client.sending:
+                client.sending = True
+                asyncio.ensure_future(self._drain(client))
+
+    async def _drain(self, client: ClientState):
+        loop = asyncio.get_running_loop()
+        try:
+            while client.pending is not None and client.sid in self.clients:
+                wait = client.last_sent + 1.0 / QUALITY_TIERS[client.tier][2] - loop.time()
+                if wait > 0:
+                    # Newer frames arriving meanwhile simply replace the pending one
+                    await asyncio.sleep(wait)
+                    continue
+
+                frame, client.pending = client.pending, None
+                robot_id = client.robot_id
+                payload = {'robotId': robot_id, 'seq': frame.seq, 'ts': frame.ts_ms, 'tier': client.tier,
+                           'url': _frame_url(client.base_url, robot_id, frame.seq, client.tier)}
+                if client.binary:
+                    # Encoding happens off the event loop and is shared by all clients on the same tier
+                    jpeg = await loop.run_in_executor(None, frame.jpeg, client.tier)
+                    if jpeg is None:
+                        continue
+                    # Sent as a binary attachment, no base64 and no follow-up HTTP request
+                    payload['jpeg'] = jpeg
+
+                client.last_sent = loop.time()
+                if client.ack:
+                    try:
+                        await sio.call('frame', payload, to=client.sid, timeout=ACK_TIMEOUT)
+                        lag = loop.time() - client.last_sent
+                    except socketio.exceptions.TimeoutError:
+                        lag = ACK_TIMEOUT
+                    self._adapt(client, lag, loop.time())
+                else:
+                    await sio.emit('frame', payload, to=client.sid)
+                client.sent += 1
+                latest_ts[robot_id] = frame.ts_ms
+        except Exception:
+            # Swallow errors to keep streaming robust (e.g. the client went away mid-emit)
+            pass
+        finally:
+            client.sending = False
+
+    def _adapt(self, client: ClientState, lag: float, now: float):
+        client.lag = lag if client.sent == 0 else 0.7 * client.lag + 0.3 * lag
+        client.fast_streak = client.fast_streak + 1 if lag < LAG_STEP_UP else 0
+        if now - client.tier_changed < TIER_CHANGE_COOLDOWN:
+            return
+        if client.lag > LAG_STEP_DOWN and client.tier < len(QUALITY_TIERS) - 1:
+            client.tier += 1
+            client.tier_changed = now
+            client.fast_streak = 0
+        elif client.fast_streak >= STEP_UP_AFTER and client.tier > 0:
+            client.tier -= 1
+            client.tier_changed = now
+            client.fast_streak = 0
+
+    def get_stats(self) -> dict:
+        return {
+            sid: {'robotId': c.robot_id, 'tier': c.tier, 'lag': round(c.lag, 3), 'sent': c.sent,
+                  'coalesced': c.coalesced, 'binary': c.binary, 'ack': c.ack}
+            for sid, c in self.clients.items()
+        }
+
+
+emitter = FrameEmitter()
+
+
+def _on_frame(robot_id: str, frame: RingFrame):
+    """Thread-safe hand-off from the streamer background thread to the ASGI loop."""
     global sio_loop
-    if sio_loop is None:
-        # No loop captured yet, skip emitting
+    if sio_loop is None or not emitter.has_listeners(robot_id):
+        # No loop captured yet or nobody listening, skip emitting
         return
     try:
-        fut = asyncio.run_coroutine_threadsafe(
-            sio.emit('frame', {'robotId': robot_id, 'url': url, 'ts': ts_ms}, room=robot_id),
-            sio_loop
-        )
-        # Optionally wait a tiny bit to surface errors
-        # fut.result(timeout=0.01)
-        latest_ts[robot_id] = ts_ms
+        sio_loop.call_soon_threadsafe(emitter.publish, robot_id, frame)
     except Exception:
         # Swallow errors to keep streaming robust
         pass
 
 
-streamer = FrameStreamer(media_root=MEDIA_ROOT, on_frame_cb=_on_frame)
+streamer = FrameStreamer(on_frame_cb=_on_frame)
+
+
+async def _send_response(send, status: int, body: bytes, content_type: str, extra_headers=()):
+    headers = [
+        (b'content-type', content_type.encode()),
+        (b'content-length', str(len(body)).encode()),
+        (b'access-control-allow-origin', b'*'),
+    ]
+    headers.extend(extra_headers)
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def frames_http_app(scope, receive, send):
+    """
+    Serves frames straight from the in-memory ring:
+      GET /rtsp_frames/<robotId>/<seq>.jpg[?tier=N]   a specific frame (immutable while it stays in the ring)
+      GET /rtsp_frames/<robotId>/latest.jpg[?tier=N]  the newest frame
+      GET /rtsp_frames/stats                          per-client delivery stats
+    """
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    path = scope.get('path', '')
+    parts = path[len(FRAME_PATH_PREFIX):].split('/') if path.startswith(FRAME_PATH_PREFIX) else []
+    if scope.get('method') == 'GET' and parts == ['stats']:
+        await _send_response(send, 200, json.dumps(emitter.get_stats()).encode(), 'application/json')
+        return
+    if scope.get('method') not in ('GET', 'HEAD') or len(parts) != 2 or not parts[1].endswith('.jpg'):
+        await _send_response(send, 404, b'not found', 'text/plain')
+        return
+
+    robot_id, name = unquote(parts[0]), parts[1][:-4]
+    if name == 'latest':
+        frame = streamer.get_frame(robot_id)
+        cache_control = b'no-cache'
+    else:
+        try:
+            frame = streamer.get_frame(robot_id, int(name))
+        except ValueError:
+            frame = None
+        cache_control = b'private, max-age=60, immutable'
+    query = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        tier = int(query.get('tier', ['0'])[0])
+    except ValueError:
+        tier = 0
+    jpeg = await asyncio.get_running_loop().run_in_executor(None, frame.jpeg, tier) if frame else None
+    if jpeg is None:
+        await _send_response(send, 404, b'frame not in ring', 'text/plain')
+        return
+
+    await _send_response(send, 200, jpeg, 'image/jpeg', [
+        (b'cache-control', cache_control),
+        (b'etag', f'"{frame.seq}-{frame.ts_ms}-{tier}"'.encode()),
+    ])
+
+
+app = socketio.ASGIApp(sio, other_asgi_app=frames_http_app)
+
+
+def _base_url(environ) -> str:
+    if FRAME_BASE_URL:
+        return FRAME_BASE_URL
+    host = environ.get('HTTP_HOST') or f"{environ.get('SERVER_NAME', 'localhost')}:{environ.get('SERVER_PORT', '5001')}"
+    scheme = environ.get('HTTP_X_FORWARDED_PROTO') or 'http'
+    return f'{scheme}://{host}'
 
 
 @sio.event
 async def connect(sid, environ):
     global sio_loop
+    emitter.connect(sid, _base_url(environ))
     try:
         sio_loop = asyncio.get_running_loop()
     except RuntimeError:
@@ -54,7 +278,9 @@ async def connect(sid, environ):
 @sio.event
 async def subscribe(sid, data):
     """
-    data: { robotId: str, rtsp: str }
+    data: { robotId: str, rtsp: str, binary?: bool, ack?: bool }
+    binary=true delivers the JPEG bytes inside the 'frame' event instead of only a URL.
+    ack=true means the client acknowledges each frame once drawn; the ack lag drives fps/quality adaptation.
     """
     robot_id = data.get('robotId')
     rtsp = data.get('rtsp')
@@ -63,6 +289,7 @@ async def subscribe(sid, data):
         return
     await sio.save_session(sid, {'robotId': robot_id})
     await sio.enter_room(sid, robot_id)
+    emitter.subscribe(sid, robot_id, bool(data.get('binary')), bool(data.get('ack')))
     streamer.ensure_started(robot_id, rtsp)
     await sio.emit('subscribed', {'robotId': robot_id}, to=sid)
 
@@ -71,6 +298,7 @@ async def subscribe(sid, data):
 async def unsubscribe(sid, data):
     robot_id = data.get('robotId')
     await sio.leave_room(sid, robot_id)
+    emitter.unsubscribe(sid, robot_id)
     streamer.unsubscribe(robot_id)
 
 
@@ -78,8 +306,9 @@ async def unsubscribe(sid, data):
 async def disconnect(sid):
     sess = await sio.get_session(sid)
     robot_id = sess.get('robotId') if sess else None
+    emitter.disconnect(sid)
     if robot_id:
         streamer.unsubscribe(robot_id)
 
 
-# Entrypoint to run: uvicorn backend.ops.rtsp_socket_server:app --port 5001
\ No newline at end of file
+# Entrypoint to run: uvicorn backend.ops.rtsp_socket_server:app --port 5001
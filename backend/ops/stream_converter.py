@@ -1,117 +1,483 @@
 """
 视频流转换服务
 将RTSP流转换为HLS格式，供前端播放
+- 先用ffprobe探测源编码：H.264 直接 -c:v copy 转封装（FFmpeg自行拉流，几乎不占CPU）；
+  其他编码或探测失败时，从接入中心取原始BGR帧写入FFmpeg标准输入重新编码，不再单独建立RTSP连接
+- 转换按需启动：首次请求播放列表时启动，超过空闲时长没有分片请求则自动停止
+- 每路转换统计FFmpeg进程CPU占用与输出码率
 """
 import subprocess
 import os
+import re
+import shutil
 import threading
 import time
 import logging
-from django.conf import settings
+from collections import deque
+
+import cv2
+from django.http import HttpResponse, HttpResponseNotFound, FileResponse
+from django.views.decorators.http import require_http_methods
+
+from .ingest_hub import ingest_hub, mask_credentials
 
 logger = logging.getLogger(__name__)
 
+HLS_INPUT_FPS = int(os.environ.get('HLS_INPUT_FPS', 15))  # 写入编码器的恒定帧率
+HLS_BASE_URL = os.environ.get('HLS_BASE_URL', '/hls/')  # 返回给前端的播放地址前缀
+HLS_ROOT = os.environ.get('HLS_ROOT', 'media/hls')  # 播放列表与分片的输出目录
+HLS_PASSTHROUGH = os.environ.get('HLS_PASSTHROUGH', '1') == '1'  # 源为H.264时直接转封装
+HLS_IDLE_SECONDS = float(os.environ.get('HLS_IDLE_SECONDS', 30))  # 无分片请求后停止转换的时长
+HLS_START_TIMEOUT = float(os.environ.get('HLS_START_TIMEOUT', 15))  # 首次请求等待播放列表生成的时长
+HLS_PROBE_TIMEOUT = 10
+HLS_SEGMENT_SECONDS = 2
+STDERR_TAIL_LINES = 20  # 保留的FFmpeg错误输出行数，用于启动失败时的报错
+
+PASSTHROUGH_CODECS = ('h264',)
+SEGMENT_PATTERN = re.compile(r'^segment_\d+\.ts$')
+
+
+def probe_video_codec(rtsp_url, timeout=HLS_PROBE_TIMEOUT):
+    """用ffprobe探测视频编码（如 h264 / hevc），失败返回None"""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-rtsp_transport', 'tcp',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        rtsp_url,
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"探测 {mask_credentials(rtsp_url)} 编码失败: {str(e)}")
+        return None
+    codec = result.stdout.decode('utf-8', 'ignore').strip().splitlines()
+    return codec[0].strip() if result.returncode == 0 and codec else None
+
+
+def _drain_stderr(camera_id, process, rtsp_url, tail):
+    """持续读取FFmpeg的stderr，避免长时间运行时管道写满导致进程阻塞；保留最后几行并写入日志"""
+    try:
+        for line in iter(process.stderr.readline, b''):
+            text = line.decode('utf-8', 'replace').rstrip()
+            if not text:
+                continue
+            text = text.replace(rtsp_url, mask_credentials(rtsp_url))
+            tail.append(text)
+            logger.warning(f"摄像头 {camera_id} FFmpeg: {text}")
+    except (OSError, ValueError):
+        pass
+    finally:
+        process.stderr.close()
+
+
+def _process_cpu_seconds(pid):
+    """进程累计CPU时间（秒），读取 /proc，不可用时返回None"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        # utime、stime 为 stat 的第14、15列（去掉前两列后的下标11、12）
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _playlist_bitrate(hls_dir):
+    """根据播放列表中各分片的时长与文件大小估算输出码率（kbps）"""
+    try:
+        with open(os.path.join(hls_dir, 'playlist.m3u8')) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    total_bytes = 0
+    total_seconds = 0.0
+    duration = None
+    for line in lines:
+        if line.startswith('#EXTINF:'):
+            try:
+                duration = float(line[8:].split(',')[0])
+            except ValueError:
+                duration = None
+        elif line and not line.startswith('#') and duration:
+            try:
+                total_bytes += os.path.getsize(os.path.join(hls_dir, line))
+                total_seconds += duration
+            except OSError:
+                pass
+            duration = None
+    if total_seconds <= 0:
+        return None
+    return round(total_bytes * 8 / total_seconds / 1000, 1)
+
+
 class StreamConverter:
     """视频流转换器"""
-    
-    def __init__(self):
-        self.converters = {}  # 存储转换进程
-        self.hls_base_url = "http://172.16.160.100:8003/hls/"
-        
+
+    def __init__(self, hls_base_url=HLS_BASE_URL, hls_root=HLS_ROOT, idle_seconds=HLS_IDLE_SECONDS):
+        self.converters = {}  # 存储转换进程、订阅与写帧线程
+        self.hls_base_url = hls_base_url if hls_base_url.endswith('/') else hls_base_url + '/'
+        self.hls_root = hls_root
+        self.idle_seconds = idle_seconds
+        self._codecs = {}  # rtsp_url -> 探测到的编码
+        self._lock = threading.Lock()
+        self._camera_locks = {}
+        self._reaper = None
+
+    def _camera_lock(self, camera_id):
+        with self._lock:
+            return self._camera_locks.setdefault(camera_id, threading.Lock())
+
+    def _hls_dir(self, camera_id):
+        return os.path.join(self.hls_root, str(camera_id))
+
+    def _hls_url(self, camera_id):
+        return f"{self.hls_base_url}{camera_id}/playlist.m3u8"
+
+    def _detect_codec(self, rtsp_url):
+        if rtsp_url not in self._codecs:
+            codec = probe_video_codec(rtsp_url)
+            if codec is None:
+                return None  # 探测失败不缓存，下次启动时重试
+            self._codecs[rtsp_url] = codec
+            logger.info(f"{mask_credentials(rtsp_url)} 视频编码: {codec}")
+        return self._codecs[rtsp_url]
+
+    def _hls_output_args(self, hls_dir):
+        return [
+            '-f', 'hls',                       # 输出格式为HLS
+            '-hls_time', str(HLS_SEGMENT_SECONDS),  # 每个片段2秒
+            '-hls_list_size', '3',             # 保持3个片段
+            '-hls_flags', 'delete_segments',   # 删除旧片段
+            '-hls_allow_cache', '0',           # 不允许缓存
+            '-hls_segment_filename', os.path.join(hls_dir, 'segment_%05d.ts'),
+            '-y',                              # 覆盖输出文件
+            os.path.join(hls_dir, 'playlist.m3u8'),
+        ]
+
+    def _start_passthrough(self, camera_id, rtsp_url, hls_dir):
+        """H.264源：FFmpeg直接拉流并转封装，不解码不编码"""
+        cmd = [
+            'ffmpeg',
+            '-loglevel', 'error',              # 只输出错误
+            '-rtsp_transport', 'tcp',
+            '-i', rtsp_url,
+            '-map', '0:v:0',
+            '-c:v', 'copy',                    # 直接复制视频流
+            '-an',                             # 禁用音频
+        ] + self._hls_output_args(hls_dir)
+
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            preexec_fn=os.setsid if os.name != 'nt' else None
+        )
+        return {'process': process, 'subscription': None, 'stop_event': threading.Event(), 'feeder': None}
+
+    def _start_transcode(self, camera_id, rtsp_url, hls_dir):
+        """其他编码：从接入中心取原始帧，以libx264重新编码"""
+        # 从接入中心订阅，等待首帧以确定分辨率
+        subscription = ingest_hub.subscribe(rtsp_url, f'hls:{camera_id}')
+        first_frame = subscription.wait_for_frame(timeout=10.0)
+        if first_frame is None or first_frame.image is None:
+            subscription.close()
+            raise RuntimeError('无法从RTSP流获取视频帧')
+        height, width = first_frame.image.shape[:2]
+
+        # FFmpeg命令：将原始帧编码为HLS
+        cmd = [
+            'ffmpeg',
+            '-loglevel', 'error',              # 只输出错误
+            '-f', 'rawvideo',                  # 输入为原始帧
+            '-pix_fmt', 'bgr24',
+            '-s', f'{width}x{height}',
+            '-r', str(HLS_INPUT_FPS),
+            '-i', '-',                         # 从标准输入读取
+            '-c:v', 'libx264',                 # 视频编码器
+            '-pix_fmt', 'yuv420p',
+            '-an',                             # 禁用音频
+            '-preset', 'ultrafast',            # 编码预设
+            '-tune', 'zerolatency',            # 零延迟调优
+        ] + self._hls_output_args(hls_dir)
+
+        # 启动转换进程
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            preexec_fn=os.setsid if os.name != 'nt' else None
+        )
+
+        stop_event = threading.Event()
+        feeder = threading.Thread(
+            target=self._feed_frames,
+            args=(camera_id, process, subscription, (width, height), stop_event),
+            daemon=True
+        )
+        feeder.start()
+        return {'process': process, 'subscription': subscription, 'stop_event': stop_event, 'feeder': feeder}
+
+    def _start(self, camera_id, rtsp_url):
+        """启动转换进程（调用方持有该摄像头的锁）"""
+        # 先停止该摄像头的现有转换
+        if camera_id in self.converters:
+            self.stop_conversion(camera_id)
+
+        # 创建HLS输出目录，清掉上次残留的分片
+        hls_dir = self._hls_dir(camera_id)
+        shutil.rmtree(hls_dir, ignore_errors=True)
+        os.makedirs(hls_dir, exist_ok=True)
+
+        codec = self._detect_codec(rtsp_url) if HLS_PASSTHROUGH else None
+        if codec in PASSTHROUGH_CODECS:
+            converter = self._start_passthrough(camera_id, rtsp_url, hls_dir)
+            mode = 'copy'
+        else:
+            converter = self._start_transcode(camera_id, rtsp_url, hls_dir)
+            mode = 'transcode'
+
+        # stderr由后台线程持续读取
+        stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        stderr_reader = threading.Thread(
+            target=_drain_stderr,
+            args=(camera_id, converter['process'], rtsp_url, stderr_tail),
+            daemon=True
+        )
+        stderr_reader.start()
+
+        now = time.monotonic()
+        converter.update({
+            'stderr_tail': stderr_tail,
+            'stderr_reader': stderr_reader,
+            'rtsp_url': rtsp_url,
+            'hls_dir': hls_dir,
+            'mode': mode,
+            'codec': codec,
+            'started_at': now,
+            'last_segment_fetch': now,
+            'segments_served': 0,
+            'bytes_served': 0,
+            'cpu_sample': None,
+        })
+        with self._lock:
+            self.converters[camera_id] = converter
+        self._ensure_reaper()
+        logger.info(f"启动摄像头 {camera_id} 的流转换（{mode}，编码 {codec or '未知'}），进程ID: {converter['process'].pid}")
+        return converter
+
     def start_conversion(self, camera_id, rtsp_url):
         """启动RTSP到HLS的转换"""
         try:
-            # 创建HLS输出目录
-            hls_dir = f"media/hls/{camera_id}"
-            os.makedirs(hls_dir, exist_ok=True)
-            
-            # HLS输出文件路径
-            playlist_path = f"{hls_dir}/playlist.m3u8"
-            
-            # 先停止该摄像头的现有转换
-            if camera_id in self.converters:
-                self.stop_conversion(camera_id)
-            
-            # FFmpeg命令：将RTSP流转换为HLS
-            cmd = [
-                'ffmpeg',
-                '-rtsp_transport', 'tcp',          # 使用TCP传输
-                '-analyzeduration', '2000000',     # 增加分析时间
-                '-probesize', '2000000',           # 增加探测大小
-                '-i', rtsp_url,                    # 输入RTSP流
-                '-c:v', 'libx264',                 # 视频编码器
-                '-an',                             # 禁用音频
-                '-preset', 'ultrafast',            # 编码预设
-                '-tune', 'zerolatency',            # 零延迟调优
-                '-f', 'hls',                       # 输出格式为HLS
-                '-hls_time', '2',                  # 每个片段2秒
-                '-hls_list_size', '3',             # 保持3个片段
-                '-hls_flags', 'delete_segments',   # 删除旧片段
-                '-hls_allow_cache', '0',           # 不允许缓存
-                '-y',                              # 覆盖输出文件
-                playlist_path
-            ]
-            
-            # 启动转换进程
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                preexec_fn=os.setsid if os.name != 'nt' else None
-            )
-            
-            self.converters[camera_id] = process
-            logger.info(f"启动摄像头 {camera_id} 的流转换，进程ID: {process.pid}")
-            
+            with self._camera_lock(camera_id):
+                converter = self._start(camera_id, rtsp_url)
+            process = converter['process']
+
             # 等待几秒检查进程是否正常运行
             time.sleep(3)
             if process.poll() is not None:
-                stdout, stderr = process.communicate()
-                error_msg = stderr.decode('utf-8') if stderr else '未知错误'
+                converter['stderr_reader'].join(timeout=1)
+                error_msg = '\n'.join(converter['stderr_tail']) or '未知错误'
                 logger.error(f"FFmpeg进程启动失败: {error_msg}")
+                self.stop_conversion(camera_id)
                 return {
                     'success': False,
                     'error': f'FFmpeg启动失败: {error_msg}'
                 }
-            
+
             return {
                 'success': True,
-                'hls_url': f"{self.hls_base_url}{camera_id}/playlist.m3u8",
-                'process_id': process.pid
+                'hls_url': self._hls_url(camera_id),
+                'process_id': process.pid,
+                'mode': converter['mode'],
             }
-            
+
         except Exception as e:
             logger.error(f"启动流转换失败: {str(e)}")
             return {'success': False, 'error': str(e)}
-    
+
+    def ensure_conversion(self, camera_id, rtsp_url):
+        """按需启动：转换未运行（或进程已退出）时启动，并等待播放列表生成；返回播放列表路径，失败返回None"""
+        with self._camera_lock(camera_id):
+            converter = self.converters.get(camera_id)
+            if converter is None or converter['process'].poll() is not None:
+                try:
+                    converter = self._start(camera_id, rtsp_url)
+                except Exception as e:
+                    logger.error(f"按需启动摄像头 {camera_id} 的流转换失败: {str(e)}")
+                    return None
+
+        playlist_path = os.path.join(converter['hls_dir'], 'playlist.m3u8')
+        deadline = time.monotonic() + HLS_START_TIMEOUT
+        while not os.path.exists(playlist_path):
+            if converter['process'].poll() is not None or time.monotonic() > deadline:
+                return None
+            time.sleep(0.2)
+        return playlist_path
+
+    def touch_segment(self, camera_id, size):
+        """记录一次分片请求，用于空闲回收与统计"""
+        converter = self.converters.get(camera_id)
+        if converter is not None:
+            converter['last_segment_fetch'] = time.monotonic()
+            converter['segments_served'] += 1
+            converter['bytes_served'] += size
+
+    def _feed_frames(self, camera_id, process, subscription, size, stop_event):
+        """按恒定帧率向FFmpeg写入最新帧，没有新帧时重复上一帧"""
+        frame_interval = 1.0 / HLS_INPUT_FPS
+        last_image = None
+        next_time = time.monotonic()
+        try:
+            while not stop_event.is_set() and process.poll() is None:
+                frame = subscription.latest()
+                if frame is not None and frame.image is not None:
+                    image = frame.image
+                    if (image.shape[1], image.shape[0]) != size:
+                        image = cv2.resize(image, size)
+                    last_image = image
+
+                if last_image is not None:
+                    process.stdin.write(last_image.tobytes())
+
+                next_time += frame_interval
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.monotonic()
+        except (BrokenPipeError, OSError) as e:
+            if not stop_event.is_set():
+                logger.error(f"摄像头 {camera_id} 写入转换进程失败: {str(e)}")
+
     def stop_conversion(self, camera_id):
         """停止转换"""
         try:
-            if camera_id in self.converters:
-                process = self.converters[camera_id]
+            with self._lock:
+                converter = self.converters.pop(camera_id, None)
+            if converter is not None:
+                converter['stop_event'].set()
+                if converter['subscription'] is not None:
+                    converter['subscription'].close()
+                process = converter['process']
+                if process.stdin is not None:
+                    try:
+                        process.stdin.close()
+                    except OSError:
+                        pass
                 process.terminate()
-                process.wait(timeout=5)
-                del self.converters[camera_id]
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait(timeout=5)
                 logger.info(f"停止摄像头 {camera_id} 的流转换")
                 return True
         except Exception as e:
             logger.error(f"停止流转换失败: {str(e)}")
         return False
-    
+
     def stop_all_conversions(self):
         """停止所有转换"""
         for camera_id in list(self.converters.keys()):
             self.stop_conversion(camera_id)
-    
+
+    def _ensure_reaper(self):
+        with self._lock:
+            if self._reaper is None or not self._reaper.is_alive():
+                self._reaper = threading.Thread(target=self._reap_loop, name='hls-reaper', daemon=True)
+                self._reaper.start()
+
+    def _reap_loop(self):
+        """回收超过空闲时长没有分片请求的转换，以及已退出的FFmpeg进程"""
+        while True:
+            time.sleep(max(1.0, min(self.idle_seconds / 3, 10)))
+            now = time.monotonic()
+            with self._lock:
+                items = list(self.converters.items())
+            for camera_id, converter in items:
+                idle = now - converter['last_segment_fetch']
+                if idle > self.idle_seconds:
+                    logger.info(f"摄像头 {camera_id} 的HLS已 {idle:.0f} 秒无分片请求，停止转换")
+                    self.stop_conversion(camera_id)
+                elif converter['process'].poll() is not None:
+                    logger.warning(f"摄像头 {camera_id} 的FFmpeg进程已退出（返回码 {converter['process'].returncode}）")
+                    self.stop_conversion(camera_id)
+
+    def _converter_stats(self, converter):
+        now = time.monotonic()
+        cpu_percent = None
+        cpu_seconds = _process_cpu_seconds(converter['process'].pid)
+        if cpu_seconds is not None:
+            sample = converter['cpu_sample'] or (converter['started_at'], 0.0)
+            elapsed = now - sample[0]
+            if elapsed > 0:
+                cpu_percent = round((cpu_seconds - sample[1]) / elapsed * 100, 1)
+            converter['cpu_sample'] = (now, cpu_seconds)
+        return {
+            'running': converter['process'].poll() is None,
+            'mode': converter['mode'],
+            'codec': converter['codec'],
+            'process_id': converter['process'].pid,
+            'uptime': round(now - converter['started_at'], 1),
+            'idle': round(now - converter['last_segment_fetch'], 1),
+            'cpu_percent': cpu_percent,  # 自上次查询以来FFmpeg进程的平均CPU占用
+            'output_kbps': _playlist_bitrate(converter['hls_dir']),
+            'segments_served': converter['segments_served'],
+            'bytes_served': converter['bytes_served'],
+        }
+
     def get_conversion_status(self, camera_id):
         """获取转换状态"""
-        if camera_id in self.converters:
-            process = self.converters[camera_id]
-            return {
-                'running': process.poll() is None,
-                'hls_url': f"{self.hls_base_url}{camera_id}/playlist.m3u8"
-            }
+        converter = self.converters.get(camera_id)
+        if converter is not None:
+            return dict(self._converter_stats(converter), hls_url=self._hls_url(camera_id))
         return {'running': False, 'hls_url': None}
 
+    def get_stats(self):
+        """各路转换的CPU占用、码率与访问情况"""
+        with self._lock:
+            items = list(self.converters.items())
+        return {str(camera_id): self._converter_stats(converter) for camera_id, converter in items}
+
 # 全局转换器实例
 stream_converter = StreamConverter()
+
+
+@require_http_methods(["GET"])
+def hls_playlist(request, camera_id):
+    """HLS播放列表：首次请求时启动转换，之后直接返回当前播放列表"""
+    from .models import Camera
+    camera = Camera.objects.filter(id=camera_id).first()
+    if camera is None:
+        return HttpResponseNotFound('摄像头不存在')
+
+    playlist_path = stream_converter.ensure_conversion(camera.id, camera.rtsp_url)
+    if playlist_path is None:
+        return HttpResponse('HLS转换启动失败', status=503, content_type='text/plain; charset=utf-8')
+    try:
+        with open(playlist_path, 'rb') as f:
+            content = f.read()
+    except OSError:
+        return HttpResponse('播放列表暂不可用', status=503, content_type='text/plain; charset=utf-8')
+
+    response = HttpResponse(content, content_type='application/vnd.apple.mpegurl')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@require_http_methods(["GET"])
+def hls_segment(request, camera_id, segment):
+    """HLS分片；分片请求即视为有人观看，用于空闲回收"""
+    if not SEGMENT_PATTERN.match(segment):
+        return HttpResponseNotFound('分片不存在')
+    path = os.path.join(stream_converter._hls_dir(camera_id), segment)
+    try:
+        size = os.path.getsize(path)
+        handle = open(path, 'rb')
+    except OSError:
+        return HttpResponseNotFound('分片不存在')
+    stream_converter.touch_segment(camera_id, size)
+    return FileResponse(handle, content_type='video/mp2t')
@@ -1,6 +1,6 @@
 """
 视频流自动分析服务
-- 10秒截图用于：行为检测(吸烟、打电话)、火灾烟雾检测、垃圾检测、翻越检测
+- 按自适应间隔截图（由 CaptureScheduler 统一调度，共享推理帧率预算）用于：行为检测(吸烟、打电话)、火灾烟雾检测、垃圾检测、翻越检测
 - 30秒录制5秒视频用于：打架斗殴检测(暂时由于RTSP流不稳定，使用FFmpeg录制)
 """
 import cv2
@@ -12,6 +12,9 @@ from datetime import datetime
 from django.utils import timezone
 import subprocess
 import tempfile
+from .motion_gate import MotionGate
+from .capture_scheduler import CaptureScheduler
+from .ingest_hub import ingest_hub
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +31,12 @@ class VideoAnalysisService:
         
         # 配置：是否启用视频检测（由于RTSP流不稳定，默认禁用）
         self.enable_video_detection = False
+        
+        # 图像检测器，以及画面无变化时跳过推理的运动门控
+        self.image_detectors = ['behavior', 'firesmoke', 'rubbish', 'cross']
+        self.motion_gate = MotionGate()
+        # 截图间隔自适应调度，所有摄像头共享全局推理预算
+        self.capture_scheduler = CaptureScheduler()
     
     def start_all_cameras(self):
         """启动所有在线摄像头的分析"""
@@ -49,10 +58,12 @@ class VideoAnalysisService:
         
         self.cameras[camera_id] = {
             'running': True,
-            'rtsp_url': rtsp_url
+            'rtsp_url': rtsp_url,
+            # 与其他预览/推流共用同一个RTSP连接
+            'subscription': ingest_hub.subscribe(rtsp_url, f'analysis:{camera_id}')
         }
         
-        # 启动图像检测线程（10秒截图）
+        # 启动图像检测线程（自适应间隔截图）
         image_thread = threading.Thread(
             target=self._image_detection_loop,
             args=(camera_id, rtsp_url),
@@ -75,30 +86,30 @@ class VideoAnalysisService:
             logger.info(f"启动摄像头 {camera_id} 的图像分析（视频检测已禁用）")
     
     def _image_detection_loop(self, camera_id, rtsp_url):
-        """图像检测循环 - 每10秒截图并检测"""
+        """图像检测循环 - 由调度器决定截图时机并检测"""
         logger.info(f"摄像头 {camera_id} 图像检测线程启动")
         
-        last_capture_time = 0
-        capture_interval = 10  # 10秒
-        
+        self.capture_scheduler.register(camera_id)
         while camera_id in self.cameras and self.cameras[camera_id]['running']:
+            # 等待本摄像头到期并取得推理预算（超时后重新检查运行状态）
+            if not self.capture_scheduler.acquire(camera_id, timeout=1.0):
+                continue
+            
+            detected = None
             try:
-                current_time = time.time()
+                # 截取单帧（仅保留在内存中）
+                frame = self._capture_frame(camera_id, rtsp_url)
                 
-                if current_time - last_capture_time >= capture_interval:
-                    # 使用FFmpeg截图
-                    image_path = self._capture_image_ffmpeg(camera_id, rtsp_url)
-                    
-                    if image_path:
-                        # 执行图像检测
-                        self._perform_image_detections(camera_id, image_path)
-                        last_capture_time = current_time
-                    
-                time.sleep(1)
+                if frame is not None:
+                    # 执行图像检测
+                    detected = self._perform_image_detections(camera_id, frame)
                 
             except Exception as e:
                 logger.error(f"摄像头 {camera_id} 图像检测异常: {str(e)}")
                 time.sleep(5)
+            finally:
+                # 未实际推理时退还预算
+                self.capture_scheduler.report(camera_id, detected=bool(detected), inferred=detected is not None)
     
     def _video_detection_loop(self, camera_id, rtsp_url):
         """视频检测循环 - 每30秒录制3秒视频并检测"""
@@ -127,55 +138,30 @@ class VideoAnalysisService:
                 logger.error(f"摄像头 {camera_id} 视频检测异常: {str(e)}")
                 time.sleep(5)
     
-    def _capture_image_ffmpeg(self, camera_id, rtsp_url):
-        """使用OpenCV截取单帧图像（优化版）"""
-        cap = None
-        try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"camera_{camera_id}_{timestamp}.jpg"
-            filepath = os.path.join(self.media_root, 'images', filename)
-            
-            # 使用OpenCV快速截图
-            cap = cv2.VideoCapture(rtsp_url)
-            
-            # 优化设置
-            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # 减小缓冲
-            cap.set(cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, 3000)  # 3秒超时
-            cap.set(cv2.CAP_PROP_READ_TIMEOUT_MSEC, 3000)  # 3秒读取超时
-            
-            if not cap.isOpened():
-                logger.warning(f"摄像头 {camera_id} 无法打开RTSP流")
-                return None
-            
-            # 尝试读取5次，跳过前几帧（可能是损坏的）
-            for i in range(5):
-                ret, frame = cap.read()
-                if ret and frame is not None and frame.size > 0:
-                    # 检查图像质量
-                    if frame.shape[0] > 100 and frame.shape[1] > 100:
-                        # 保存图像
-                        success = cv2.imwrite(filepath, frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                        if success:
-                            # 验证文件大小
-                            file_size = os.path.getsize(filepath)
-                            if file_size > 10000:  # 至少10KB
-                                logger.info(f"摄像头 {camera_id} 截图成功: {filename} ({file_size/1024:.1f}KB)")
-                                cap.release()
-                                return f'/media/alarm_events/images/{filename}'
-                            else:
-                                logger.warning(f"摄像头 {camera_id} 截图文件过小: {file_size}B")
-                                os.remove(filepath)
-                time.sleep(0.3)
-            
-            logger.warning(f"摄像头 {camera_id} 截图失败: 无法获取有效帧")
-            
-        except Exception as e:
-            logger.error(f"摄像头 {camera_id} 截图异常: {str(e)}")
-        finally:
-            if cap is not None:
-                cap.release()
+    def _capture_frame(self, camera_id, rtsp_url):
+        """从接入中心的共享解码器取最新帧（不写入磁盘）；解码器刚启动时最多等待3秒首帧"""
+        camera = self.cameras.get(camera_id)
+        if camera is None:
+            return None
         
-        return None
+        frame = camera['subscription'].wait_for_frame(timeout=3.0)
+        if frame is None:
+            logger.warning(f"摄像头 {camera_id} 截图失败: 无可用的最新帧")
+            return None
+        return frame.image
+    
+    def _save_snapshot(self, camera_id, frame):
+        """将帧保存为报警截图，返回可访问的媒体路径"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = f"camera_{camera_id}_{timestamp}.jpg"
+        filepath = os.path.join(self.media_root, 'images', filename)
+        
+        if not cv2.imwrite(filepath, frame, [cv2.IMWRITE_JPEG_QUALITY, 85]):
+            logger.error(f"摄像头 {camera_id} 保存截图失败: {filename}")
+            return None
+        
+        logger.info(f"摄像头 {camera_id} 保存报警截图: {filename} ({os.path.getsize(filepath)/1024:.1f}KB)")
+        return f'/media/alarm_events/images/{filename}'
     
     def _capture_video_ffmpeg(self, camera_id, rtsp_url, duration):
         """使用FFmpeg录制RTSP流 - 优化版本"""
@@ -290,165 +276,169 @@ class VideoAnalysisService:
         
         return None
     
-    def _perform_image_detections(self, camera_id, image_path):
-        """执行图像检测：行为(吸烟、打电话)、火灾烟雾、垃圾、翻越"""
-        from .models import Camera, AlarmEvent
-        import requests
+    def _perform_image_detections(self, camera_id, frame):
+        """执行图像检测：行为(吸烟、打电话)、火灾烟雾、垃圾、翻越（进程内直接推理）
+        
+        返回是否有检测命中；未执行推理时返回None
+        """
+        from .models import Camera
+        from api.models_loader import is_models_loaded
+        from api.detection_utils import run_detections
         
         try:
             camera = Camera.objects.get(id=camera_id)
-            full_path = f'/root/Dog2/admin/backend{image_path}'
             
-            # 检查文件是否存在
-            if not os.path.exists(full_path):
-                logger.error(f"图像文件不存在: {full_path}")
-                return
+            if not is_models_loaded():
+                logger.error("模型未成功加载，跳过图像检测")
+                return None
             
-            # 1. 行为检测 (吸烟、打电话)
-            try:
-                with open(full_path, 'rb') as f:
-                    files = {'file': (os.path.basename(full_path), f, 'image/jpeg')}
-                    response = requests.post(
-                        'http://127.0.0.1:8003/api/detect-behavior',
-                        files=files,
-                        timeout=10
-                    )
-                if response.status_code == 200:
-                    result = response.json()
-                    logger.info(f"👤 行为检测结果: {result}")
-                    if result.get('has_warning', False):
-                        warnings = result.get('warnings', [])
-                        for warning in warnings:
-                            warning_type = warning.get('type')
-                            confidence = warning.get('confidence', 0.8)
-                            
-                            if warning_type == 'smoke':
-                                logger.info(f"⚠️ 检测到吸烟行为！置信度: {confidence:.2%}, 准备创建报警事件...")
-                                self._create_alarm_event(
-                                    camera=camera,
-                                    event_type='smoking',
-                                    title='检测到吸烟行为',
-                                    description=f"检测到有人在监控区域吸烟, 置信度: {confidence:.2%}",
-                                    image_path=image_path,
-                                    confidence=confidence,
-                                    detection_data=result,
-                                    severity='medium'
-                                )
-                            elif warning_type == 'phone':
-                                logger.info(f"⚠️ 检测到使用电话！置信度: {confidence:.2%}, 准备创建报警事件...")
-                                self._create_alarm_event(
-                                    camera=camera,
-                                    event_type='phone',
-                                    title='检测到使用电话',
-                                    description=f"检测到有人在监控区域使用电话, 置信度: {confidence:.2%}",
-                                    image_path=image_path,
-                                    confidence=confidence,
-                                    detection_data=result,
-                                    severity='low'
-                                )
-                    else:
-                        logger.info(f"✓ 行为检测：未发现异常")
-            except Exception as e:
-                logger.error(f"行为检测失败: {str(e)}")
+            # 画面无变化时只运行必须始终运行的检测器
+            detectors = self.motion_gate.select_detectors(camera_id, frame, self.image_detectors)
+            if not detectors:
+                return None
             
-            # 2. 火灾烟雾检测 (使用文件上传)
-            try:
-                with open(full_path, 'rb') as f:
-                    files = {'file': (os.path.basename(full_path), f, 'image/jpeg')}
-                    response = requests.post(
-                        'http://127.0.0.1:8003/api/detect-firesmoke',
-                        files=files,
-                        timeout=10
-                    )
-                if response.status_code == 200:
-                    result = response.json()
-                    logger.info(f"🔥 火灾烟雾检测结果: {result}")
-                    if result.get('has_firesmoke', False):
-                        # 从detections数组中提取最高置信度
-                        detections = result.get('detections', [])
-                        confidence = max([d.get('confidence', 0.8) for d in detections]) if detections else 0.8
-                        logger.info(f"⚠️ 检测到火灾或烟雾！置信度: {confidence:.2%}, 准备创建报警事件...")
-                        self._create_alarm_event(
-                            camera=camera,
-                            event_type='fire',
-                            title='检测到火灾或烟雾',
-                            description=f"检测到火灾或烟雾, 置信度: {confidence:.2%}",
-                            image_path=image_path,
-                            confidence=confidence,
-                            detection_data=result,
-                            severity='critical'
-                        )
-                    else:
-                        logger.info(f"✓ 火灾烟雾检测：未发现异常")
-            except Exception as e:
-                logger.error(f"火灾烟雾检测失败: {str(e)}")
+            # 同一帧直接交给所选检测器，无需编码/上传；配置了检测区域的检测器只在区域内推理
+            detection = run_detections(frame, detectors, camera_id, camera.roi_config)
+            results = detection['results']
             
-            # 3. 垃圾检测
-            try:
-                with open(full_path, 'rb') as f:
-                    files = {'file': (os.path.basename(full_path), f, 'image/jpeg')}
-                    response = requests.post(
-                        'http://127.0.0.1:8003/api/detect-rubbish',
-                        files=files,
-                        timeout=10
-                    )
-                if response.status_code == 200:
-                    result = response.json()
-                    logger.info(f"🗑️ 垃圾检测结果: {result}")
-                    if result.get('has_rubbish', False):
-                        # 从detections数组中提取最高置信度
-                        detections = result.get('detections', [])
-                        confidence = max([d.get('confidence', 0.8) for d in detections]) if detections else 0.8
-                        logger.info(f"⚠️ 检测到垃圾！置信度: {confidence:.2%}, 准备创建报警事件...")
-                        self._create_alarm_event(
-                            camera=camera,
-                            event_type='rubbish',
-                            title='检测到垃圾',
-                            description=f"检测到垃圾物品, 置信度: {confidence:.2%}",
-                            image_path=image_path,
-                            confidence=confidence,
-                            detection_data=result,
-                            severity='medium'
-                        )
-                    else:
-                        logger.info(f"✓ 垃圾检测：未发现异常")
-            except Exception as e:
-                logger.error(f"垃圾检测失败: {str(e)}")
+            # 截图仅在真正创建报警事件时写入磁盘，同一帧只写一次
+            snapshot = {}
+            def image_path():
+                if 'path' not in snapshot:
+                    snapshot['path'] = self._save_snapshot(camera_id, frame)
+                return snapshot['path']
             
-            # 4. 翻越检测
-            try:
-                with open(full_path, 'rb') as f:
-                    files = {'file': (os.path.basename(full_path), f, 'image/jpeg')}
-                    response = requests.post(
-                        'http://127.0.0.1:8003/api/detect-cross',
-                        files=files,
-                        timeout=10
-                    )
-                if response.status_code == 200:
-                    result = response.json()
-                    logger.info(f"🚶 翻越检测结果: {result}")
-                    if result.get('has_cross', False):
-                        # 从detections数组中提取最高置信度
-                        detections = result.get('detections', [])
-                        confidence = max([d.get('confidence', 0.8) for d in detections]) if detections else 0.8
-                        logger.info(f"⚠️ 检测到翻越行为！置信度: {confidence:.2%}, 准备创建报警事件...")
-                        self._create_alarm_event(
-                            camera=camera,
-                            event_type='crossover',
-                            title='检测到翻越行为',
-                            description=f"检测到翻越围栏, 置信度: {confidence:.2%}",
-                            image_path=image_path,
-                            confidence=confidence,
-                            detection_data=result,
-                            severity='high'
-                        )
-                    else:
-                        logger.info(f"✓ 翻越检测：未发现异常")
-            except Exception as e:
-                logger.error(f"翻越检测失败: {str(e)}")
+            self._handle_image_results(camera, image_path, results)
+            return detection['has_detection']
             
         except Exception as e:
             logger.error(f"图像检测异常: {str(e)}")
+            return None
+    
+    def _handle_image_results(self, camera, image_path, results):
+        """根据合并后的检测结果创建报警事件，image_path为按需保存截图的回调"""
+        # 1. 行为检测 (吸烟、打电话)
+        try:
+            result = results.get('behavior')
+            if result is not None and 'error' not in result:
+                logger.info(f"👤 行为检测结果: {result}")
+                if result.get('has_warning', False):
+                    warnings = result.get('warnings', [])
+                    for warning in warnings:
+                        warning_type = warning.get('type')
+                        confidence = warning.get('confidence', 0.8)
+                        
+                        if warning_type == 'smoke':
+                            logger.info(f"⚠️ 检测到吸烟行为！置信度: {confidence:.2%}, 准备创建报警事件...")
+                            self._create_alarm_event(
+                                camera=camera,
+                                event_type='smoking',
+                                title='检测到吸烟行为',
+                                description=f"检测到有人在监控区域吸烟, 置信度: {confidence:.2%}",
+                                image_path=image_path(),
+                                confidence=confidence,
+                                detection_data=result,
+                                severity='medium'
+                            )
+                        elif warning_type == 'phone':
+                            logger.info(f"⚠️ 检测到使用电话！置信度: {confidence:.2%}, 准备创建报警事件...")
+                            self._create_alarm_event(
+                                camera=camera,
+                                event_type='phone',
+                                title='检测到使用电话',
+                                description=f"检测到有人在监控区域使用电话, 置信度: {confidence:.2%}",
+                                image_path=image_path(),
+                                confidence=confidence,
+                                detection_data=result,
+                                severity='low'
+                            )
+                else:
+                    logger.info(f"✓ 行为检测：未发现异常")
+            elif result is not None:
+                logger.error(f"行为检测失败: {result['error']}")
+        except Exception as e:
+            logger.error(f"行为检测失败: {str(e)}")
+        
+        # 2. 火灾烟雾检测
+        try:
+            result = results.get('firesmoke')
+            if result is not None and 'error' not in result:
+                logger.info(f"🔥 火灾烟雾检测结果: {result}")
+                if result.get('has_firesmoke', False):
+                    # 从detections数组中提取最高置信度
+                    detections = result.get('detections', [])
+                    confidence = max([d.get('confidence', 0.8) for d in detections]) if detections else 0.8
+                    logger.info(f"⚠️ 检测到火灾或烟雾！置信度: {confidence:.2%}, 准备创建报警事件...")
+                    self._create_alarm_event(
+                        camera=camera,
+                        event_type='fire',
+                        title='检测到火灾或烟雾',
+                        description=f"检测到火灾或烟雾, 置信度: {confidence:.2%}",
+                        image_path=image_path(),
+                        confidence=confidence,
+                        detection_data=result,
+                        severity='critical'
+                    )
+                else:
+                    logger.info(f"✓ 火灾烟雾检测：未发现异常")
+            elif result is not None:
+                logger.error(f"火灾烟雾检测失败: {result['error']}")
+        except Exception as e:
+            logger.error(f"火灾烟雾检测失败: {str(e)}")
+        
+        # 3. 垃圾检测
+        try:
+            result = results.get('rubbish')
+            if result is not None and 'error' not in result:
+                logger.info(f"🗑️ 垃圾检测结果: {result}")
+                if result.get('has_rubbish', False):
+                    # 从detections数组中提取最高置信度
+                    detections = result.get('detections', [])
+                    confidence = max([d.get('confidence', 0.8) for d in detections]) if detections else 0.8
+                    logger.info(f"⚠️ 检测到垃圾！置信度: {confidence:.2%}, 准备创建报警事件...")
+                    self._create_alarm_event(
+                        camera=camera,
+                        event_type='rubbish',
+                        title='检测到垃圾',
+                        description=f"检测到垃圾物品, 置信度: {confidence:.2%}",
+                        image_path=image_path(),
+                        confidence=confidence,
+                        detection_data=result,
+                        severity='medium'
+                    )
+                else:
+                    logger.info(f"✓ 垃圾检测：未发现异常")
+            elif result is not None:
+                logger.error(f"垃圾检测失败: {result['error']}")
+        except Exception as e:
+            logger.error(f"垃圾检测失败: {str(e)}")
+        
+        # 4. 翻越检测
+        try:
+            result = results.get('cross')
+            if result is not None and 'error' not in result:
+                logger.info(f"🚶 翻越检测结果: {result}")
+                if result.get('has_cross', False):
+                    # 从detections数组中提取最高置信度
+                    detections = result.get('detections', [])
+                    confidence = max([d.get('confidence', 0.8) for d in detections]) if detections else 0.8
+                    logger.info(f"⚠️ 检测到翻越行为！置信度: {confidence:.2%}, 准备创建报警事件...")
+                    self._create_alarm_event(
+                        camera=camera,
+                        event_type='crossover',
+                        title='检测到翻越行为',
+                        description=f"检测到翻越围栏, 置信度: {confidence:.2%}",
+                        image_path=image_path(),
+                        confidence=confidence,
+                        detection_data=result,
+                        severity='high'
+                    )
+                else:
+                    logger.info(f"✓ 翻越检测：未发现异常")
+            elif result is not None:
+                logger.error(f"翻越检测失败: {result['error']}")
+        except Exception as e:
+            logger.error(f"翻越检测失败: {str(e)}")
     
     def _perform_video_detections(self, camera_id, video_path):
         """执行视频检测：打架斗殴"""
@@ -539,7 +529,12 @@ class VideoAnalysisService:
         """停止摄像头分析"""
         if camera_id in self.cameras:
             self.cameras[camera_id]['running'] = False
-            del self.cameras[camera_id]
+            camera = self.cameras.pop(camera_id)
+            camera['subscription'].close()
+            self.motion_gate.reset(camera_id)
+            self.capture_scheduler.unregister(camera_id)
+            from api.result_cache import result_cache
+            result_cache.invalidate(camera_id)
             logger.info(f"停止摄像头 {camera_id} 的视频分析")
     
     def stop_all(self):